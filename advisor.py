@@ -0,0 +1,321 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.expression import BinaryExpression, Join
+from sqlalchemy.sql.schema import Column
+
+#----------------------------------------------------------------------------#
+# Query plan advisor.
+#
+# "flask indexes advise" requests every page of the app, records the SELECTs
+# they run and explains each of them. A table read with a sequential scan
+# while the query filters or joins it on columns that no index starts with
+# gets an index recommendation, and --migration writes the recommended
+# indexes into a new migration.
+#----------------------------------------------------------------------------#
+
+# endpoints that cannot be requested blindly
+SKIPPED_ENDPOINTS = {'static'}
+
+EQUALITY = {operators.eq, operators.in_op, operators.is_}
+# LIKE is left out: the searches match anywhere in the name, which no
+# b-tree index helps with
+RANGE = {operators.lt, operators.le, operators.gt, operators.ge,
+         operators.between_op}
+
+def filtered_columns(statement):
+  '''
+  the {table name: ([equality columns], [range columns])} that "statement"
+  filters or joins on, in order of appearance.
+  '''
+  clauses = []
+  if getattr(statement, 'whereclause', None) is not None:
+    clauses.append(statement.whereclause)
+  for source in getattr(statement, 'get_final_froms', lambda: [])():
+    for element in visitors.iterate(source):
+      if isinstance(element, Join):
+        clauses.append(element.onclause)
+
+  columns = {}
+  for clause in clauses:
+    for element in visitors.iterate(clause):
+      if not isinstance(element, BinaryExpression):
+        continue
+      for side in (element.left, element.right):
+        if not isinstance(side, Column) or side.table is None:
+          continue
+        equality, ranged = columns.setdefault(side.table.name, ([], []))
+        if element.operator in EQUALITY and side.name not in equality:
+          equality.append(side.name)
+        elif element.operator in RANGE and side.name not in ranged:
+          ranged.append(side.name)
+  return columns
+
+def existing_indexes(engine):
+  '''
+  the column lists of the primary keys, unique constraints and indexes of
+  every table.
+  '''
+  inspector = inspect(engine)
+  indexes = {}
+  for table in inspector.get_table_names():
+    known = indexes[table] = []
+    primary_key = inspector.get_pk_constraint(table)['constrained_columns']
+    if primary_key:
+      known.append(primary_key)
+    known.extend(unique['column_names']
+                 for unique in inspector.get_unique_constraints(table))
+    known.extend(index['column_names'] for index in inspector.get_indexes(table))
+  return indexes
+
+def covered(columns, indexes):
+  '''
+  whether an index starts with all the "columns", in any order.
+  '''
+  return any(set(index[:len(columns)]) == set(columns) for index in indexes)
+
+#----------------------------------------------------------------------------#
+# Plans.
+#----------------------------------------------------------------------------#
+
+def explain(connection, statement, parameters):
+  '''
+  the (tables read with a sequential scan, time in ms, plan text) of a
+  statement.
+  '''
+  dialect = connection.dialect.name
+  if dialect == 'postgresql':
+    row = connection.exec_driver_sql(
+      'EXPLAIN (ANALYZE, FORMAT JSON) ' + statement, parameters).scalar()
+    plan = (json.loads(row) if isinstance(row, str) else row)[0]
+    scans, nodes = set(), [plan['Plan']]
+    while nodes:
+      node = nodes.pop()
+      if node['Node Type'] == 'Seq Scan':
+        scans.add(node['Relation Name'])
+      nodes.extend(node.get('Plans', []))
+    return scans, plan['Execution Time'], json.dumps(plan['Plan'], indent=1)
+
+  if dialect == 'sqlite':
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement,
+                                      parameters).all()
+    # "SCAN Show" reads the whole table, "SCAN Show USING INDEX ..." and
+    # "SEARCH ..." do not
+    scans = {row[3].split()[1] for row in rows
+             if row[3].startswith('SCAN ') and ' USING ' not in row[3]}
+    start = time.perf_counter()
+    connection.exec_driver_sql(statement, parameters).all()
+    elapsed = (time.perf_counter() - start) * 1000
+    return scans, elapsed, '\n'.join(row[3] for row in rows)
+
+  rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).all()
+  return set(), None, '\n'.join(str(row[0]) for row in rows)
+
+#----------------------------------------------------------------------------#
+# Seed data.
+#----------------------------------------------------------------------------#
+
+def seed(count):
+  '''
+  fill an empty database with "count" venues and artists and ten shows
+  per venue, so the planner has tables worth indexing.
+  '''
+  from extensions import db
+  from models import Show, Venue, Artist
+  if Venue.query.first() or Artist.query.first():
+    raise click.ClickException('--seed only fills an empty database.')
+  random.seed(0)
+  cities = [(f"City {i}", state) for i, state in
+            enumerate(['CA', 'NY', 'TX', 'WA', 'IL', 'FL', 'MA', 'CO'] * 10)]
+  genres = ['Jazz', 'Folk', 'Blues', 'Rock n Roll', 'Swing', 'Classical', 'Pop']
+  db.session.add_all(Venue(name=f"Venue {i}", city=city, state=state,
+                           address=f"{i} Main St", genres=random.choice(genres))
+                     for i, (city, state) in
+                     ((i, random.choice(cities)) for i in range(count)))
+  db.session.add_all(Artist(name=f"Artist {i}", city=city, state=state,
+                            genres=random.choice(genres))
+                     for i, (city, state) in
+                     ((i, random.choice(cities)) for i in range(count)))
+  db.session.flush()
+  venue_ids = [id for id, in db.session.query(Venue.id)]
+  artist_ids = [id for id, in db.session.query(Artist.id)]
+  start = datetime(2020, 1, 1)
+  db.session.add_all(Show(venue_id=venue_id, artist_id=random.choice(artist_ids),
+                          start_time=str(start + timedelta(hours=random.randrange(60000))))
+                     for venue_id in venue_ids for _ in range(10))
+  db.session.commit()
+  # refresh the planner statistics
+  with db.engine.begin() as connection:
+    connection.exec_driver_sql('ANALYZE')
+
+#----------------------------------------------------------------------------#
+# Routes.
+#----------------------------------------------------------------------------#
+
+def request_urls(app):
+  '''
+  a URL for every GET route, using the first venue and artist for the
+  ids in the path. Routes with other arguments are skipped.
+  '''
+  from models import Venue, Artist
+  venue, artist = Venue.query.first(), Artist.query.first()
+  values = {'venue_id': venue.id if venue else 1,
+            'artist_id': artist.id if artist else 1}
+  urls = []
+  for rule in app.url_map.iter_rules():
+    if 'GET' not in rule.methods or rule.endpoint in SKIPPED_ENDPOINTS or \
+       not set(rule.arguments) <= set(values):
+      continue
+    path = rule.build({name: values[name] for name in rule.arguments})[1]
+    urls.append((rule.endpoint, path + '?search_term=a'))
+  return urls
+
+def capture(app, urls):
+  '''
+  request every url and return {endpoint: [(sql, parameters, statement)]}
+  with the distinct SELECTs each of them ran.
+  '''
+  from extensions import db
+  captured = {}
+  current = []
+
+  def record(connection, cursor, statement, parameters, context, executemany):
+    if statement.lstrip().upper().startswith('SELECT') and \
+       context.compiled is not None and \
+       all(statement != seen[0] for seen in current):
+      current.append((statement, parameters, context.compiled.statement))
+
+  engine = db.engine
+  event.listen(engine, 'after_cursor_execute', record)
+  try:
+    client = app.test_client()
+    for endpoint, url in urls:
+      current = captured[endpoint] = []
+      response = client.get(url)
+      # run streamed bodies to the end too
+      response.get_data()
+      response.close()
+      click.echo(f"{response.status_code} {url} ({len(current)} queries)", err=True)
+  finally:
+    event.remove(engine, 'after_cursor_execute', record)
+  return captured
+
+#----------------------------------------------------------------------------#
+# Migration.
+#----------------------------------------------------------------------------#
+
+MIGRATION = '''"""{message}
+
+Revision ID: {revision}
+Revises: {down_revision}
+Create Date: {date}
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '{revision}'
+down_revision = '{down_revision}'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+{upgrade}
+
+
+def downgrade():
+{downgrade}
+'''
+
+def index_name(table, columns):
+  return f"ix_{table}_{'_'.join(columns)}"
+
+def write_migration(recommendations):
+  from alembic.script import ScriptDirectory
+  script = ScriptDirectory.from_config(
+    current_app.extensions['migrate'].migrate.get_config())
+  head = script.get_current_head()
+  revision = uuid.uuid4().hex[:12]
+  upgrade = [f"    op.create_index('{index_name(table, columns)}', '{table}', "
+             f"{list(columns)!r}, unique=False)"
+             for table, columns in recommendations]
+  downgrade = [f"    op.drop_index('{index_name(table, columns)}', table_name='{table}')"
+               for table, columns in reversed(recommendations)]
+  path = os.path.join(script.versions, f"{revision}_advised_indexes.py")
+  with open(path, 'w') as migration:
+    migration.write(MIGRATION.format(
+      message='indexes recommended by flask indexes advise', revision=revision,
+      down_revision=head, date=datetime.now(),
+      upgrade='\n'.join(upgrade), downgrade='\n'.join(downgrade)))
+  return path
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+indexes_cli = AppGroup('indexes', help='Check the indexes against the queries of the pages.')
+
+@indexes_cli.command('advise')
+@click.option('--seed', 'seed_count', type=int, help='First fill an empty database with '
+              'this many venues and artists.')
+@click.option('--plans', is_flag=True, help='Print the plan of every query.')
+@click.option('--migration', is_flag=True,
+              help='Write a migration creating the recommended indexes.')
+def advise(seed_count, plans, migration):
+  '''
+  explain the queries of every page and recommend missing indexes.
+  '''
+  from extensions import db
+  app = current_app._get_current_object()
+  if seed_count:
+    seed(seed_count)
+  app.config['RATELIMIT_ENABLED'] = False
+  captured = capture(app, request_urls(app))
+  indexes = existing_indexes(db.engine)
+
+  recommendations = []
+  with db.engine.connect() as connection:
+    for endpoint, queries in captured.items():
+      for sql, parameters, statement in queries:
+        scans, elapsed, plan = explain(connection, sql, parameters)
+        timing = f"{elapsed:.2f} ms" if elapsed is not None else ''
+        flags = ', '.join(f"seq scan on {table}" for table in sorted(scans))
+        click.echo(f"{endpoint}: {' '.join(sql.split())[:100]} {timing} {flags}")
+        if plans:
+          click.echo(plan)
+        for table, (equality, ranged) in filtered_columns(statement).items():
+          columns = tuple(equality + ranged[:1])
+          if table not in scans or not columns or \
+             covered(columns, indexes.get(table, [])):
+            continue
+          if (table, columns) not in recommendations:
+            recommendations.append((table, columns))
+          click.echo(f"  -> no index for {table}({', '.join(columns)})")
+    connection.rollback()
+
+  if not recommendations:
+    click.echo('No missing index found.')
+    return
+  click.echo('Recommended indexes:')
+  for table, columns in recommendations:
+    click.echo(f"  {index_name(table, columns)} ON {table} ({', '.join(columns)})")
+  if migration:
+    click.echo(f"Wrote {write_migration(recommendations)}")
+
+def init_app(app):
+  app.cli.add_command(indexes_cli)
@@ -0,0 +1,273 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from collections import Counter
+from datetime import date, datetime
+import click
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import select, func, insert, delete, update
+from cache import RedisError
+from extensions import db, entity_cache, metrics
+from changes import settled_before
+from shards import lookup
+from models import Change, Show, Venue, Artist, VenueActivity, ArtistActivity, \
+  GenreActivity, SummaryState
+
+blueprint = Blueprint('analytics', __name__)
+
+#----------------------------------------------------------------------------#
+# Summary tables.
+#
+# The dashboards only read VenueActivity, ArtistActivity and GenreActivity,
+# which hold the number of shows per venue, artist and genre and month.
+# They are in the main database while the venues and artists may be in
+# shards (see shards.py), so their names and genres are looked up apart.
+# refresh() keeps them up to date from the change log, run every few
+# minutes by the job workers (JOB_SCHEDULE) or "flask analytics refresh":
+# it only reads the show changes since its last run, so it never
+# aggregates the Show table.
+#----------------------------------------------------------------------------#
+
+STATE = 'activity'
+
+def genres_of(artist_ids):
+  return {id: [genre for genre in (genres or '').split(',') if genre]
+          for id, (genres,) in lookup(Artist, artist_ids, Artist.genres).items()}
+
+def rollup(shows):
+  '''
+  roll the number of shows per (venue id, artist id, month) in the Counter
+  "shows" up into Counters per (venue id, month), (artist id, month) and
+  (genre, month). A show counts for every genre of its artist.
+  '''
+  venues, artists, genres = Counter(), Counter(), Counter()
+  genres_by_artist = genres_of({artist_id for _, artist_id, _ in shows})
+  for (venue_id, artist_id, month), count in shows.items():
+    venues[venue_id, month] += count
+    artists[artist_id, month] += count
+    for genre in genres_by_artist.get(artist_id, ()):
+      genres[genre, month] += count
+  return venues, artists, genres
+
+def genre_rollup():
+  '''
+  the shows per (genre, month) from ArtistActivity and the current genres
+  of the artists, for when artists changed their genres.
+  '''
+  genres = Counter()
+  rows = db.session.query(ArtistActivity.artist_id, ArtistActivity.month,
+                          ArtistActivity.shows).all()
+  genres_by_artist = genres_of({artist_id for artist_id, _, _ in rows})
+  for artist_id, month, shows in rows:
+    for genre in genres_by_artist.get(artist_id, ()):
+      genres[genre, month] += shows
+  return genres
+
+def key_columns(model):
+  return [column.name for column in model.__table__.primary_key.columns]
+
+def replace_summary(model, counts):
+  db.session.execute(delete(model))
+  names = key_columns(model)
+  if counts:
+    db.session.execute(insert(model.__table__), [
+      dict(zip(names, key), shows=count) for key, count in counts.items() if count])
+
+def apply_deltas(model, deltas):
+  for key, delta in deltas.items():
+    if not delta:
+      continue
+    row = db.session.get(model, key)
+    if row is None:
+      db.session.add(model(**dict(zip(key_columns(model), key)), shows=delta))
+    elif row.shows + delta > 0:
+      row.shows += delta
+    else:
+      db.session.delete(row)
+
+def summary_state():
+  '''
+  the SummaryState row, locked until the transaction ends where the
+  database can lock rows, or None before the first rebuild.
+  '''
+  return db.session.scalars(
+    select(SummaryState).where(SummaryState.name == STATE).
+    with_for_update().execution_options(populate_existing=True)).first()
+
+def rebuild():
+  '''
+  recompute the summary tables with one aggregate over Show.
+  '''
+  if db.engine.dialect.name == 'postgresql':
+    # the aggregate and the cursor must come from the same snapshot
+    db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+  state = summary_state()
+  if state is None:
+    state = SummaryState(name=STATE, cursor=0)
+    db.session.add(state)
+  cursor = db.session.query(func.max(Change.id)).scalar() or 0
+  month = func.substr(Show.start_time, 1, 7)
+  rows = db.session.execute(
+    select(Show.venue_id, Show.artist_id, month, func.count()).
+    group_by(Show.venue_id, Show.artist_id, month))
+  venues, artists, genres = rollup(Counter({
+    (venue_id, artist_id, month): count
+    for venue_id, artist_id, month, count in rows}))
+  for model, counts in ((VenueActivity, venues), (ArtistActivity, artists),
+                        (GenreActivity, genres)):
+    replace_summary(model, counts)
+  state.cursor, state.refreshed_at = cursor, datetime.utcnow()
+  db.session.commit()
+  return sum(venues.values())
+
+def refresh():
+  '''
+  apply the changes logged since the last refresh to the summary tables,
+  in one transaction with the new cursor. Returns the number of show
+  changes applied. Before the first run the tables are rebuilt instead,
+  and the number of shows returned.
+  '''
+  state = summary_state()
+  if state is None:
+    return rebuild()
+  cursor = state.cursor
+  # stop at the settled changes: the cursor must not move past a change
+  # still to be committed
+  top = db.session.query(func.max(Change.id)).\
+    filter(Change.created_at < settled_before()).scalar() or cursor
+  changes = db.session.query(Change.entity, Change.op, Change.key).\
+    filter(Change.id > cursor, Change.id <= top,
+           Change.entity.in_(('show', 'artist'))).\
+    order_by(Change.id).execution_options(yield_per=1000)
+  shows = Counter()
+  applied = 0
+  genres_changed = False
+  for entity, op, key in changes:
+    if entity == 'artist':
+      genres_changed = genres_changed or op == 'update'
+      continue
+    venue_id, artist_id, start_time = key.split(':', 2)
+    shows[int(venue_id), int(artist_id), start_time[:7]] += \
+      -1 if op == 'delete' else 1
+    applied += 1
+
+  venues, artists, genres = rollup(shows)
+  apply_deltas(VenueActivity, venues)
+  apply_deltas(ArtistActivity, artists)
+  if genres_changed:
+    db.session.flush()
+    replace_summary(GenreActivity, genre_rollup())
+  else:
+    apply_deltas(GenreActivity, genres)
+  # the cursor only moves from where this refresh read it: one running
+  # alongside (SQLite cannot lock the row) has applied the same changes
+  moved = db.session.execute(
+    update(SummaryState).where(SummaryState.name == STATE, SummaryState.cursor == cursor).
+    values(cursor=top, refreshed_at=datetime.utcnow())).rowcount
+  if not moved:
+    db.session.rollback()
+    return 0
+  db.session.commit()
+  return applied
+
+#----------------------------------------------------------------------------#
+# Reports.
+#----------------------------------------------------------------------------#
+
+def first_month(months):
+  '''
+  the first month ("YYYY-MM") of the last "months" months.
+  '''
+  today = date.today()
+  index = today.year * 12 + today.month - months
+  return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def busiest(model, column, activity, since, top):
+  '''
+  the (id, name, shows) of the "top" rows of "model" with the most shows
+  in "activity" from "since" on. The ids of deleted rows are skipped.
+  '''
+  total = func.sum(activity.shows)
+  ranked = db.session.query(column, total).filter(activity.month >= since).\
+    group_by(column).order_by(total.desc(), column)
+  found = []
+  offset = 0
+  while len(found) < top:
+    rows = ranked.offset(offset).limit(top).all()
+    names = lookup(model, [id for id, _ in rows], model.name)
+    found.extend((id, names[id][0], shows) for id, shows in rows if id in names)
+    if len(rows) < top:
+      break
+    offset += top
+  return found[:top]
+
+def report(since, top):
+  '''
+  the busiest venues, the most active artists and the shows per genre and
+  month, counting the shows from the month "since" ("YYYY-MM") on.
+  '''
+  venues = busiest(Venue, VenueActivity.venue_id, VenueActivity, since, top)
+  artists = busiest(Artist, ArtistActivity.artist_id, ArtistActivity, since, top)
+  genres = {}
+  for genre, month, shows in db.session.query(GenreActivity.genre, GenreActivity.month,
+                                              GenreActivity.shows).\
+      filter(GenreActivity.month >= since).order_by(GenreActivity.month):
+    genres.setdefault(genre, {"genre": genre, "shows": 0, "months": {}})
+    genres[genre]["shows"] += shows
+    genres[genre]["months"][month] = shows
+  return {
+    "busiest_venues": [{"id": id, "name": name, "shows": shows}
+                       for id, name, shows in venues],
+    "most_active_artists": [{"id": id, "name": name, "shows": shows}
+                            for id, name, shows in artists],
+    "genres": sorted(genres.values(), key=lambda genre: -genre["shows"])
+  }
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+@blueprint.route('/analytics')
+def analytics():
+  '''
+  the activity report of the last "months" months (12 by default) as
+  JSON. Reports are cached until the next refresh of the summary tables.
+  '''
+  months = min(max(request.args.get('months', 12, type=int), 1), 120)
+  top = current_app.config['ANALYTICS_TOP']
+  state = db.session.get(SummaryState, STATE)
+  cursor = state.cursor if state else 0
+  since = first_month(months)
+  key = f"analytics:{since}:{top}:{cursor}"
+  try:
+    data = entity_cache.results.get(key)
+  except (OSError, RedisError):
+    data = None
+  metrics.count_cache('analytics', data is not None)
+  if data is None:
+    data = report(since, top)
+    data["since"] = since
+    data["refreshed_at"] = state.refreshed_at.isoformat() \
+      if state and state.refreshed_at else None
+    try:
+      entity_cache.results.set(key, data)
+    except (OSError, RedisError):
+      pass
+  return jsonify(data)
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@blueprint.cli.command('refresh')
+@click.option('--rebuild', 'full', is_flag=True,
+              help='Recompute the tables from the Show table.')
+def refresh_command(full):
+  '''
+  bring the analytics summary tables up to date.
+  '''
+  if full:
+    click.echo(f"Rebuilt the summary tables from {rebuild()} shows.")
+  else:
+    click.echo(f"Applied {refresh()} show changes.")
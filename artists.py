@@ -0,0 +1,182 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import sys
+from flask import Blueprint, render_template, request, flash, redirect, url_for, abort
+from extensions import db, entity_cache, limiter, search_index, images
+from models import Show, Venue, Artist
+from helpers import search, bulk_response, shared_page
+from documents import page, update_documents
+from sqlite import replica_reads
+from changes import record_change
+
+blueprint = Blueprint('artists', __name__)
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+#  Artists
+#  ----------------------------------------------------------------
+@blueprint.route('/artists')
+@replica_reads
+@shared_page
+def artists():
+  artists = Artist.query.all()
+  formatted_data = []
+  for artist in artists:
+    formatted_data.append({
+        "id": artist.id,
+        "name": artist.name
+        })
+
+  return render_template('pages/artists.html', artists=formatted_data)
+
+@blueprint.route('/artists/search', methods=['GET', 'POST'])
+@replica_reads
+@limiter.limit('search')
+@limiter.concurrency('search')
+def search_artists():
+  # the search box posts the term, the page links pass it in the URL
+  search_term = request.values.get('search_term', '')
+  results = search(Artist, search_term, after=request.args.get('after', type=int),
+                   before=request.args.get('before', type=int))
+  # nothing contains the term: suggest the closest names instead
+  if not results["count"] and search_term.strip():
+    results["suggestions"] = search_index.suggest('artist', search_term)
+  return render_template('pages/search_artists.html', results=results,
+                         search_term=search_term)
+
+@blueprint.route('/artists/<int:artist_id>')
+@replica_reads
+@shared_page
+def show_artist(artist_id):
+  # one primary key lookup: the page document holds the shows too
+  artist = page('artist', artist_id)
+  # Artist with artist_id is not found
+  if artist == None:
+    abort (404)
+  return render_template('pages/show_artist.html', artist=artist)
+
+#  Update
+#  ----------------------------------------------------------------
+@blueprint.route('/artists/<int:artist_id>/edit', methods=['GET'])
+def edit_artist(artist_id):
+  from forms import ArtistForm
+  artist = entity_cache.get(Artist, artist_id)
+  # Artist with artist_id is not found
+  if artist == None:
+    abort (404)
+  form = ArtistForm()
+  # Populate the form with the data of the object we want to edit
+  form.name.data = artist.name
+  form.city.data = artist.city
+  form.state.data = artist.state
+  form.image_link.data = artist.image_link
+  form.website.data = artist.website
+  form.phone.data = artist.phone
+  form.genres.data = artist.genres.split(',')
+  form.facebook_link.data = artist.facebook_link
+  form.seeking_venue.data = artist.seeking_venue
+  form.seeking_description.data = artist.seeking_description
+
+  return render_template('forms/edit_artist.html', form=form, artist=artist)
+
+@blueprint.route('/artists/<int:artist_id>/edit', methods=['POST'])
+def edit_artist_submission(artist_id):
+  from forms import ArtistForm
+  form = ArtistForm(request.form)
+  artist = Artist.query.get(artist_id)
+  # Artist with artist_id is not found
+  if artist == None:
+    abort (404)
+  if form.validate_on_submit():
+    try:
+      artist.name = form.name.data
+      artist.city = form.city.data
+      artist.state = form.state.data
+      artist.image_link = form.image_link.data
+      artist.website = form.website.data
+      artist.phone = form.phone.data
+      artist.genres = ','.join(form.genres.data)
+      artist.facebook_link = form.facebook_link.data
+      artist.seeking_venue = form.seeking_venue.data
+      artist.seeking_description = form.seeking_description.data
+
+      record_change('update', artist)
+      update_documents(artist)
+      images.warm_later(artist.image_link)
+      db.session.commit()
+      entity_cache.forget(artist)
+      search_index.update('artist', artist)
+      # on successful db insert, flash success
+      flash('Artist ' + form.name.data + ' was successfully edited!')
+    except:
+      db.session.rollback()
+      # on unsuccessful db insert, flash an error instead.
+      flash('An error occurred. Artist ' + form.name.data + ' could not be edited.', 'error')
+      print(sys.exc_info())
+    finally:
+      db.session.close()
+
+    return redirect(url_for('artists.show_artist', artist_id=artist_id))
+
+  return render_template('forms/edit_artist.html', form=form, artist=artist)
+
+#  Create Artist
+#  ----------------------------------------------------------------
+
+@blueprint.route('/artists/create', methods=['GET'])
+def create_artist_form():
+  from forms import ArtistForm
+  form = ArtistForm()
+  return render_template('forms/new_artist.html', form=form)
+
+@blueprint.route('/artists/create', methods=['POST'])
+@limiter.limit('write')
+@limiter.concurrency('write')
+def create_artist_submission():
+  from forms import ArtistForm
+  form = ArtistForm(request.form)
+  if form.validate_on_submit():
+    try:
+      # Create Artist using form data
+      artist = Artist(name=form.name.data, city=form.city.data,
+                      state=form.state.data, facebook_link=form.facebook_link.data,
+                      image_link=form.image_link.data, website=form.website.data,
+                      phone=form.phone.data, genres=','.join(form.genres.data),
+                      seeking_venue=form.seeking_venue.data,
+                      seeking_description=form.seeking_description.data)
+      db.session.add(artist)
+      db.session.flush()
+      record_change('create', artist)
+      update_documents(artist)
+      images.warm_later(artist.image_link)
+      db.session.commit()
+      entity_cache.forget(artist)
+      search_index.update('artist', artist)
+      # on successful db insert, flash success
+      flash('Artist ' + form.name.data + ' was successfully listed!')
+    except:
+      db.session.rollback()
+      # on unsuccessful db insert, flash an error instead.
+      flash('An error occurred. Artist ' + form.name.data + ' could not be listed.', 'error')
+      print(sys.exc_info())
+    finally:
+      db.session.close()
+
+    return render_template('pages/home.html')
+
+  return render_template('forms/new_artist.html', form=form)
+
+@blueprint.route('/artists/bulk', methods=['POST'])
+@limiter.limit('write')
+@limiter.concurrency('write')
+def create_artists_bulk():
+  '''
+  create the artists of a JSON array of objects with the fields of the
+  artist form, in one transaction, and answer with the outcome of each.
+  '''
+  from forms import ArtistForm
+  return bulk_response(Artist, ArtistForm)
@@ -0,0 +1,500 @@
+#----------------------------------------------------------------------------#
+# Async serving mode.
+#
+# The read-only pages (venues, artists, shows and their calendar, the
+# detail pages, the searches, the iCalendar feeds, the images and the
+# stream of the change log) served by an ASGI app on an event loop, with an
+# async DB driver (asyncpg, aiosqlite) and async SQLAlchemy sessions. It
+# renders the same templates as app.py from the same statements and
+# formatting code, so a reverse proxy can send the GET/search traffic here
+# and keep every form and write on the sync app:
+#
+#   hypercorn async_app:app --workers 4 --bind 0.0.0.0:8000
+#
+# With SHARDS set, the statements on Venue, Artist and Show run on every
+# shard and their rows are concatenated, as shards.RoutingSession does;
+# with SQLITE_REPLICA set, the read pages query the replica. The search
+# index (fuzzy.py) is kept by the sync code, in memory: /search and the
+# suggestions of the name searches run it in a thread, in the app context
+# of a sync app built from the same config.
+#----------------------------------------------------------------------------#
+
+from quart import Quart, Blueprint, Response, render_template, request, abort, \
+  redirect, send_file, url_for, jsonify, session, g, make_response, get_flashed_messages
+from quart.utils import run_sync
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+import asyncio
+import functools
+import json
+import os
+import time
+import keys
+from app import create_app
+from extensions import search_index
+from models import Venue, Artist, Show, Document, Change
+from changes import settled_before, changes_statement, latest_statement, format_event, \
+  parse_cursor
+from calendars import feed_window, feed_etag, feed_lines, feed_headers, \
+  venue_feed_statement, artist_feed_statement, venue_events, artist_events
+from documents import OTHER, load_statements, assemble, split_shows
+from images import ImageProxy, IMAGE_MAX_AGE, immutable_headers
+from pages import session_messages, session_headers
+from search import search_request, wants_json
+from shards import MAIN, sharded_statement, lookup_statements
+from sqlite import tune, replica_url, watch_file
+from helpers import format_datetime, highlight, search_statements, search_results, \
+  search_options, venue_areas, calendar_window, calendar_request, show_counts_statement, \
+  add_counts, calendar_shows_statement, calendar_page, format_shows, page_version, \
+  page_etag_of, shared_headers, private_headers
+
+#----------------------------------------------------------------------------#
+# App Config.
+#----------------------------------------------------------------------------#
+
+app = Quart(__name__)
+app.config.from_object('config')
+# the same keys as the sync app, to read its session cookie
+keys.init_app(app)
+app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.filters['highlight'] = highlight
+
+images = ImageProxy()
+images.configure(app.config, url_for, app.logger)
+app.jinja_env.filters['image'] = images.url
+
+# only the search index is used from it: its pools stay empty otherwise
+flask_app = create_app()
+
+ASYNC_DRIVERS = {
+  'postgresql': 'postgresql+asyncpg',
+  'postgres': 'postgresql+asyncpg',
+  'sqlite': 'sqlite+aiosqlite'
+}
+
+def async_url(url):
+  '''
+  the database "url" with the async counterpart of its driver.
+  '''
+  scheme, rest = url.split('://', 1)
+  return ASYNC_DRIVERS.get(scheme.split('+')[0], scheme) + '://' + rest
+
+def async_database_uri(config):
+  '''
+  use "ASYNC_DATABASE_URI" when set, otherwise swap the driver of
+  "SQLALCHEMY_DATABASE_URI" for its async counterpart.
+  '''
+  return config.get('ASYNC_DATABASE_URI') or async_url(config['SQLALCHEMY_DATABASE_URI'])
+
+def async_engine(url, pragmas):
+  engine = create_async_engine(url, pool_size=app.config.get('ASYNC_POOL_SIZE', 20))
+  tune(engine.sync_engine, pragmas)
+  return engine
+
+engine = async_engine(async_database_uri(app.config), app.config['SQLITE_PRAGMAS'])
+# the engine of each shard, the main database first (see shards.py)
+engines = {MAIN: engine}
+for name, url in (app.config.get('SHARDS') or {}).items():
+  engines[name] = async_engine(async_url(url), app.config['SQLITE_PRAGMAS'])
+
+replica = None
+if app.config.get('SQLITE_REPLICA'):
+  if len(engines) > 1:
+    raise RuntimeError('SQLITE_REPLICA does not support SHARDS.')
+  replica = async_engine(replica_url(app.config['SQLITE_REPLICA'], 'sqlite+aiosqlite'),
+                         app.config['SQLITE_REPLICA_PRAGMAS'])
+  watch_file(replica.sync_engine, app.config['SQLITE_REPLICA'])
+
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+#----------------------------------------------------------------------------#
+# Helper fuctions.
+#----------------------------------------------------------------------------#
+
+async def read(statement):
+  '''
+  the rows of the select "statement": from the replica in the
+  @replica_reads views, and from every shard, concatenated, when it reads
+  Venue, Artist or Show.
+  '''
+  if replica is not None and g.get('replica_reads'):
+    binds = [replica]
+  elif sharded_statement(statement):
+    binds = list(engines.values())
+  else:
+    binds = [engine]
+
+  async def execute(bind):
+    async with Session(bind=bind) as db_session:
+      return (await db_session.execute(statement)).all()
+
+  results = await asyncio.gather(*map(execute, binds))
+  return [row for rows in results for row in rows]
+
+async def get(model, id):
+  rows = await read(select(model).where(model.id == id))
+  return rows[0][0] if rows else None
+
+async def lookup(model, ids, *columns):
+  '''
+  shards.lookup on the async engines.
+  '''
+  found = {}
+  for statement in lookup_statements(model, ids, *columns):
+    for id, *values in await read(statement):
+      found[id] = tuple(values)
+  return found
+
+async def change_generation():
+  return (await read(select(func.max(Change.id))))[0][0] or 0
+
+def in_flask_app(function):
+  '''
+  "function" of the sync code as a coroutine function, which runs it in a
+  thread, in the app context of flask_app.
+  '''
+  @functools.wraps(function)
+  def wrapper(*args, **kwargs):
+    with flask_app.app_context():
+      return function(*args, **kwargs)
+  return run_sync(wrapper)
+
+def replica_reads(view):
+  '''
+  sqlite.replica_reads for the async views.
+  '''
+  @functools.wraps(view)
+  async def wrapper(*args, **kwargs):
+    g.replica_reads = True
+    return await view(*args, **kwargs)
+  return wrapper
+
+def shared_page(view):
+  '''
+  helpers.shared_page for the async views: the same ETag and headers, with
+  the newest change log id read from the async session.
+  '''
+  @functools.wraps(view)
+  async def wrapper(*args, **kwargs):
+    max_age = app.config['PAGE_MAX_AGE']
+    etag = page_etag_of(page_version(app), await change_generation(), max_age)
+    if request.if_none_match.contains_weak(etag):
+      response = Response('', 304)
+    else:
+      g.shared_page = True
+      response = await make_response(await view(*args, **kwargs))
+      if response.status_code != 200:
+        return response
+    if session.accessed:
+      return private_headers(response)
+    return shared_headers(response, etag, max_age)
+  return wrapper
+
+async def search_page(type, entity, template):
+  '''
+  helpers.search, and the suggestions of the venue and artist searches
+  when nothing contains the term.
+  '''
+  values = await request.values
+  search_term = values.get('search_term', '')
+  after = request.args.get('after', type=int)
+  before = request.args.get('before', type=int)
+  options = search_options(app.config)
+  count, page = search_statements(type, search_term, after, before, **options)
+  results = search_results([row[0] for row in await read(count)], await read(page),
+                           after, before, **options)
+  if not results["count"] and search_term.strip():
+    results["suggestions"] = await in_flask_app(search_index.suggest)(entity, search_term)
+  return await render_template(template, results=results, search_term=search_term)
+
+async def document_page(entity, id):
+  '''
+  documents.page on the async engines.
+  '''
+  rows = await read(select(Document.body).where(Document.entity == entity,
+                                                Document.id == id))
+  if rows:
+    return split_shows(json.loads(rows[0][0]))
+  other_model = OTHER[entity][1]
+  profiles, shows = load_statements(entity, [id])
+  profiles, shows = await read(profiles), await read(shows)
+  others = await lookup(other_model, {row[1] for row in shows},
+                        other_model.name, other_model.image_link)
+  data = assemble(entity, profiles, shows, others).get(id)
+  return split_shows(data) if data is not None else None
+
+async def feed(name, etag, events):
+  '''
+  calendars.feed for the async views: "events" is a coroutine function
+  giving the events, only called when the client does not have "etag".
+  '''
+  if request.if_none_match.contains_weak(etag):
+    response = Response('', status=304)
+  else:
+    lines = feed_lines(name, await events(), app.config['ICS_EVENT_HOURS'])
+    response = Response(lines, mimetype='text/calendar')
+  return feed_headers(response, etag, app.config['ICS_MAX_AGE'])
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#
+# The blueprints carry the same names as the sync ones so that the shared
+# templates resolve the same endpoints.
+#----------------------------------------------------------------------------#
+
+pages = Blueprint('pages', __name__)
+venues_blueprint = Blueprint('venues', __name__)
+artists_blueprint = Blueprint('artists', __name__)
+shows_blueprint = Blueprint('shows', __name__)
+search_blueprint = Blueprint('search', __name__)
+calendars_blueprint = Blueprint('calendars', __name__)
+images_blueprint = Blueprint('images', __name__)
+changes_blueprint = Blueprint('changes', __name__)
+
+@pages.route('/')
+async def index():
+  return await render_template('pages/home.html')
+
+@pages.route('/session')
+async def session_state():
+  '''
+  pages.session_state from the session cookie of the sync app. A session
+  kept in its store (SESSION_TYPE 'redis' or 'memory') is out of reach:
+  the answer is then empty and the messages wait for the sync app.
+  '''
+  if app.config['SESSION_TYPE'] == 'cookie':
+    return session_headers(jsonify(session_messages(get_flashed_messages)))
+  return session_headers(jsonify({'messages': []}), shown=False)
+
+#  Venues
+#  ----------------------------------------------------------------
+
+@venues_blueprint.route('/venues')
+@replica_reads
+@shared_page
+async def venues():
+  rows = await read(select(Venue.city, Venue.state, Venue.id, Venue.name))
+  return await render_template('pages/venues.html', areas=venue_areas(rows))
+
+@venues_blueprint.route('/venues/search', methods=['GET', 'POST'])
+@replica_reads
+async def search_venues():
+  return await search_page(Venue, 'venue', 'pages/search_venues.html')
+
+@venues_blueprint.route('/venues/<int:venue_id>')
+@replica_reads
+@shared_page
+async def show_venue(venue_id):
+  venue = await document_page('venue', venue_id)
+  # Venue with venue_id is not found
+  if venue is None:
+    abort(404)
+  return await render_template('pages/show_venue.html', venue=venue)
+
+#  Artists
+#  ----------------------------------------------------------------
+
+@artists_blueprint.route('/artists')
+@replica_reads
+@shared_page
+async def artists():
+  rows = await read(select(Artist.id, Artist.name))
+  data = [{"id": row[0], "name": row[1]} for row in rows]
+  return await render_template('pages/artists.html', artists=data)
+
+@artists_blueprint.route('/artists/search', methods=['GET', 'POST'])
+@replica_reads
+async def search_artists():
+  return await search_page(Artist, 'artist', 'pages/search_artists.html')
+
+@artists_blueprint.route('/artists/<int:artist_id>')
+@replica_reads
+@shared_page
+async def show_artist(artist_id):
+  artist = await document_page('artist', artist_id)
+  # Artist with artist_id is not found
+  if artist is None:
+    abort(404)
+  return await render_template('pages/show_artist.html', artist=artist)
+
+#  Shows
+#  ----------------------------------------------------------------
+
+async def show_listing(statement):
+  '''
+  format_shows() of the (venue id, artist id, start time) rows of
+  "statement", with the venues and artists read on their own since they
+  may be in other shards.
+  '''
+  rows = await read(statement)
+  venues = await lookup(Venue, {row[0] for row in rows}, Venue.name)
+  artists = await lookup(Artist, {row[1] for row in rows}, Artist.name, Artist.image_link)
+  return format_shows(rows, venues, artists)
+
+@shows_blueprint.route('/shows')
+@replica_reads
+@shared_page
+async def shows():
+  data = await show_listing(select(Show.venue_id, Show.artist_id, Show.start_time))
+  return await render_template('pages/shows.html', shows=data)
+
+@shows_blueprint.route('/shows/calendar')
+async def calendar():
+  asked = calendar_request(request.args)
+  if asked is None:
+    abort(404)
+  view, day = asked
+  start, end = calendar_window(view, day)
+  counts = add_counts(await read(show_counts_statement(start, end)))
+  shows = []
+  if view != 'month' and counts:
+    shows = await show_listing(calendar_shows_statement(start, end))
+  return await render_template('pages/calendar.html',
+                               **calendar_page(view, day, counts, shows))
+
+#  Search
+#  ----------------------------------------------------------------
+
+@search_blueprint.route('/search')
+async def search():
+  '''
+  search.search, with the search index of flask_app.
+  '''
+  found = await in_flask_app(search_request)(request.args, app.config['SEARCH_PAGE_SIZE'])
+  if wants_json(request.accept_mimetypes):
+    return jsonify(found['results'])
+  return await render_template('pages/search.html', **found)
+
+#  Calendars
+#  ----------------------------------------------------------------
+
+@calendars_blueprint.route('/venues/<int:venue_id>/shows.ics')
+async def venue_calendar(venue_id):
+  venue = await get(Venue, venue_id)
+  # Venue with venue_id is not found
+  if venue is None:
+    abort(404)
+  since = feed_window(app.config)
+
+  async def events():
+    rows = await read(venue_feed_statement(venue_id, since))
+    artists = await lookup(Artist, {artist_id for artist_id, _ in rows}, Artist.name)
+    return venue_events(venue, rows, artists)
+
+  etag = feed_etag('venue', venue_id, since, await change_generation())
+  return await feed(venue.name, etag, events)
+
+@calendars_blueprint.route('/artists/<int:artist_id>/shows.ics')
+async def artist_calendar(artist_id):
+  artist = await get(Artist, artist_id)
+  # Artist with artist_id is not found
+  if artist is None:
+    abort(404)
+  since = feed_window(app.config)
+
+  async def events():
+    rows = await read(artist_feed_statement(artist_id, since))
+    venues = await lookup(Venue, {venue_id for venue_id, _ in rows},
+                          Venue.name, Venue.address, Venue.city, Venue.state)
+    return artist_events(artist, rows, venues)
+
+  etag = feed_etag('artist', artist_id, since, await change_generation())
+  return await feed(artist.name, etag, events)
+
+#  Images
+#  ----------------------------------------------------------------
+
+@images_blueprint.route('/images/<size>/<signature>/<source>.webp')
+async def image(size, signature, source):
+  # fetching and encoding block, so they run off the event loop
+  url, path = await run_sync(images.serve)(size, signature, source, app.logger)
+  if url is None:
+    abort(404)
+  if path is None:
+    return redirect(url)
+  response = await send_file(path, mimetype='image/webp', add_etags=False,
+                             cache_timeout=IMAGE_MAX_AGE)
+  response.set_etag(os.path.basename(path))
+  await response.make_conditional(request)
+  return immutable_headers(response)
+
+#  Changes
+#  ----------------------------------------------------------------
+
+@changes_blueprint.route('/changes/stream')
+async def stream_changes():
+  '''
+  server-sent events with the changes after the cursor (see changes.py).
+  A subscriber waits on the event loop between two polls of the log. The
+  stream ends after CHANGES_STREAM_TIMEOUT seconds and the client then
+  reconnects transparently, from the id of the last event.
+  '''
+  config = app.config
+  cursor = parse_cursor(request.headers, request.args)
+  entity = request.args.get('entity')
+  poll_interval = config['CHANGES_POLL_INTERVAL']
+  page_size = config['CHANGES_PAGE_SIZE']
+  deadline = time.monotonic() + config['CHANGES_STREAM_TIMEOUT']
+  if cursor == 'latest':
+    async with Session() as db_session:
+      cursor = await db_session.scalar(latest_statement(settled_before(config))) or 0
+
+  async def events():
+    nonlocal cursor
+    yield f"retry: {int(poll_interval * 1000)}\n\n"
+    idle = 0
+    while time.monotonic() < deadline:
+      # a session per poll, so no connection is held while waiting
+      async with Session() as db_session:
+        statement = changes_statement(cursor, page_size, settled_before(config), entity)
+        changes = (await db_session.scalars(statement)).all()
+      for change in changes:
+        cursor = change.id
+        yield format_event(change)
+      if len(changes) == page_size:
+        continue
+      idle = 0 if changes else idle + poll_interval
+      # comment lines keep proxies from closing an idle connection
+      if idle >= 15:
+        idle = 0
+        yield ": keep-alive\n\n"
+      await asyncio.sleep(poll_interval)
+
+  response = Response(events(), mimetype='text/event-stream',
+                      headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+  response.timeout = None
+  return response
+
+@pages.app_errorhandler(404)
+async def not_found_error(error):
+  return await render_template('errors/404.html'), 404
+
+@pages.app_errorhandler(500)
+async def server_error(error):
+  return await render_template('errors/500.html'), 500
+
+app.register_blueprint(pages)
+app.register_blueprint(venues_blueprint)
+app.register_blueprint(artists_blueprint)
+app.register_blueprint(shows_blueprint)
+app.register_blueprint(search_blueprint)
+app.register_blueprint(calendars_blueprint)
+app.register_blueprint(images_blueprint)
+app.register_blueprint(changes_blueprint)
+
+@app.before_serving
+async def load_search_index():
+  await in_flask_app(search_index.load_in_background)()
+
+@app.after_serving
+async def dispose_engines():
+  for bind in [*engines.values(), *([replica] if replica is not None else [])]:
+    await bind.dispose()
+
+#----------------------------------------------------------------------------#
+# Launch.
+#----------------------------------------------------------------------------#
+
+if __name__ == '__main__':
+    app.run()
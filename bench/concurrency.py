@@ -0,0 +1,85 @@
+'''
+Concurrency benchmark for the read pages.
+
+Hammers the same pages on two running servers with the same number of
+concurrent clients and compares the throughput and latency, e.g.
+
+  gunicorn -w 4 app:app -b :5000
+  hypercorn -w 4 async_app:app -b :8000
+  python bench/concurrency.py http://localhost:5000 http://localhost:8000 \
+      --concurrency 64 --duration 20
+'''
+
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlparse
+
+PATHS = ['/venues', '/artists', '/shows', '/venues/1', '/artists/1']
+SEARCHES = [('/venues/search', 'a'), ('/artists/search', 'a')]
+
+
+def client(base_url, deadline, latencies, errors):
+  url = urlparse(base_url)
+  connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+  requests = [('GET', path, None) for path in PATHS] + \
+             [('POST', path, 'search_term=' + term) for path, term in SEARCHES]
+  i = 0
+  while time.monotonic() < deadline:
+    method, path, body = requests[i % len(requests)]
+    i += 1
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+    start = time.perf_counter()
+    try:
+      connection.request(method, path, body=body, headers=headers)
+      response = connection.getresponse()
+      response.read()
+      if response.status >= 500:
+        errors.append(response.status)
+    except (OSError, http.client.HTTPException):
+      errors.append(None)
+      connection.close()
+      continue
+    latencies.append(time.perf_counter() - start)
+  connection.close()
+
+
+def run(base_url, concurrency, duration):
+  latencies = []
+  errors = []
+  deadline = time.monotonic() + duration
+  threads = [threading.Thread(target=client, args=(base_url, deadline, latencies, errors))
+             for _ in range(concurrency)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  latencies.sort()
+  return {
+    "requests": len(latencies),
+    "errors": len(errors),
+    "rps": len(latencies) / duration,
+    "p50": statistics.median(latencies) * 1000 if latencies else 0,
+    "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('urls', nargs='+', help='base URL of every server to compare')
+  parser.add_argument('--concurrency', type=int, default=32)
+  parser.add_argument('--duration', type=float, default=10)
+  args = parser.parse_args()
+
+  print(f"{'server':<32} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+  for url in args.urls:
+    result = run(url, args.concurrency, args.duration)
+    print(f"{url:<32} {result['rps']:>9.1f} {result['p50']:>9.1f} "
+          f"{result['p99']:>9.1f} {result['errors']:>7}")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,58 @@
+'''
+First-request latency per route, with and without the template bytecode
+cache.
+
+Every mode runs in a fresh interpreter, like a freshly (re)started worker,
+and times the first request to each page:
+
+  flask templates precompile
+  python bench/first_request.py
+'''
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PATHS = ['/', '/venues', '/artists', '/shows', '/venues/1', '/artists/1',
+         '/venues/create', '/artists/create', '/shows/create']
+
+PROBE = '''
+import json, sys, time
+from app import create_app
+app = create_app()
+client = app.test_client()
+timings = {}
+for path in sys.argv[1:]:
+  start = time.perf_counter()
+  client.get(path)
+  timings[path] = (time.perf_counter() - start) * 1000
+print(json.dumps(timings))
+'''
+
+MODES = {
+  'compile on request': {'TEMPLATE_CACHE_TYPE': ''},
+  'bytecode cache': {}
+}
+
+
+def first_requests(env):
+  result = subprocess.run([sys.executable, '-c', PROBE] + PATHS, cwd=ROOT,
+                          capture_output=True, text=True,
+                          env=dict(os.environ, **env))
+  if result.returncode != 0:
+    raise SystemExit(result.stderr)
+  return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+  results = {mode: first_requests(env) for mode, env in MODES.items()}
+  print(f"{'path':<18}" + ''.join(f"{mode:>22}" for mode in results))
+  for path in PATHS:
+    print(f"{path:<18}" + ''.join(f"{timings[path]:>19.1f} ms" for timings in results.values()))
+
+
+if __name__ == '__main__':
+  main()
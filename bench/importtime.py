@@ -0,0 +1,75 @@
+'''
+Import-time profile of the app's cold start.
+
+Runs each target in a fresh interpreter with "-X importtime" and reports
+the total import time plus the slowest modules, so the cost of starting a
+CLI command or booting a worker can be tracked over time:
+
+  python bench/importtime.py            # all targets
+  python bench/importtime.py worker --top 30
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+  # what "flask <command>" pays before running the command
+  'cli': 'from app import create_app; create_app()',
+  # what a Gunicorn worker pays when the app is not preloaded
+  'worker': 'import wsgi',
+  'async': 'import async_app'
+}
+
+
+def profile(code):
+  '''
+  return the (module, self us, cumulative us) rows that "-X importtime"
+  prints for "code", in import order.
+  '''
+  result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=ROOT, capture_output=True, text=True,
+                          env=dict(os.environ, FYYUR_DEBUG='1'))
+  if result.returncode != 0:
+    raise SystemExit(result.stderr)
+  rows = []
+  for line in result.stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    self_us, cumulative_us, name = line[len('import time:'):].split('|')
+    rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+  return rows
+
+
+def report(name, rows, top):
+  # top-level imports are the ones that are not indented
+  total = sum(cumulative for module, _, cumulative in rows
+              if not module.startswith('  '))
+  print(f"{name}: {total / 1000:.1f} ms, {len(rows)} modules")
+  slowest = sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+  print(f"  {'cumulative ms':>13} {'self ms':>8}  module")
+  for module, self_us, cumulative_us in slowest:
+    print(f"  {cumulative_us / 1000:>13.1f} {self_us / 1000:>8.1f}  {module.strip()}")
+  print()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('targets', nargs='*', default=list(TARGETS),
+                      help='any of: ' + ', '.join(TARGETS))
+  parser.add_argument('--top', type=int, default=15,
+                      help='number of slowest modules to list')
+  args = parser.parse_args()
+  for name in args.targets:
+    if name not in TARGETS:
+      parser.error('unknown target: ' + name)
+  for name in args.targets:
+    report(name, profile(TARGETS[name]), args.top)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,292 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import json
+import socket
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+from sqlalchemy import inspect
+
+#----------------------------------------------------------------------------#
+# Backends.
+#----------------------------------------------------------------------------#
+
+class MemoryBackend:
+    '''
+    an in-process LRU cache. Every entry expires "ttl" seconds after it
+    was stored and the least recently used entry is evicted once the cache
+    holds more than "max_entries" entries.
+    '''
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisClient:
+    '''
+    a minimal client for the Redis protocol (RESP2). It only knows how to
+    send a command and parse its reply, which is all the cache needs, and
+    it talks to anything that speaks the protocol (Redis, KeyDB, a fake
+    server in tests, ...).
+    '''
+
+    def __init__(self, url='redis://localhost:6379/0', timeout=1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port),
+                                              timeout=self.timeout)
+        self._file = self._sock.makefile('rb')
+        if self.password:
+            self._command('AUTH', self.password)
+        if self.db:
+            self._command('SELECT', self.db)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._file = None
+
+    def _command(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self._sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('connection closed by server')
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b'+':
+            return rest
+        if prefix == b'-':
+            raise RedisError(rest.decode())
+        if prefix == b':':
+            return int(rest)
+        if prefix == b'$':
+            length = int(rest)
+            if length == -1:
+                return None
+            return self._file.read(length + 2)[:-2]
+        if prefix == b'*':
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError('unknown reply type %r' % prefix)
+
+    def execute(self, *args):
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            try:
+                return self._command(*args)
+            except (OSError, ConnectionError):
+                # drop the broken connection so the next call reconnects
+                self.close()
+                raise
+
+    # get/set with the memcached client signature, as expected by
+    # jinja2.MemcachedBytecodeCache
+
+    def get(self, key):
+        return self.execute('GET', key)
+
+    def set(self, key, value, timeout=None):
+        if timeout:
+            return self.execute('SET', key, value, 'EX', timeout)
+        return self.execute('SET', key, value)
+
+
+class RedisBackend:
+    '''
+    stores the entries as JSON in a Redis-protocol server so that every
+    worker process (and every node) shares one cache.
+    '''
+
+    def __init__(self, url='redis://localhost:6379/0', ttl=300,
+                 prefix='fyyur:', client=None):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.client = client or RedisClient(url)
+
+    def get(self, key):
+        value = self.client.execute('GET', self.prefix + key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.execute('SET', self.prefix + key, json.dumps(value),
+                            'PX', int(ttl * 1000))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.execute('DEL', *[self.prefix + key for key in keys])
+
+
+def backend_from_config(config):
+  '''
+  build the cache backend selected by the "CACHE_TYPE" config value.
+  '''
+  cache_type = config.get('CACHE_TYPE', 'simple')
+  ttl = config.get('CACHE_DEFAULT_TIMEOUT', 300)
+  if cache_type == 'simple':
+    return MemoryBackend(max_entries=config.get('CACHE_THRESHOLD', 1024),
+                         ttl=ttl)
+  if cache_type == 'redis':
+    return RedisBackend(url=config.get('CACHE_REDIS_URL'), ttl=ttl,
+                        prefix=config.get('CACHE_KEY_PREFIX', 'fyyur:'))
+  raise ValueError('Unknown CACHE_TYPE: ' + cache_type)
+
+#----------------------------------------------------------------------------#
+# Entity cache.
+#----------------------------------------------------------------------------#
+
+class EntityCache:
+    '''
+    a read-through cache for single rows looked up by primary key.
+
+    Rows are cached as plain dicts of their column values and handed back
+    as read-only namespaces, so a cached entity can be used in templates
+    exactly like the model object but never ends up in a session. The keys
+    hold the change log generation (changes.change_generation): a write
+    logs a change, so the next lookup of every worker misses, and a row
+    read before the write can only be stored under the old generation.
+    Writes still call "forget" once committed, for a change logged with an
+    id below the newest one.
+
+    "results" caches the calendar counts and the analytics reports. With
+    the in-process backend it is an LRU of its own, so they never evict
+    the rows.
+    '''
+
+    def __init__(self, app=None, backend=None, results=None):
+        self.backend = backend
+        self.results = results
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if self.backend is None:
+            self.backend = backend_from_config(app.config)
+        if self.results is None:
+            self.results = self.backend
+            if isinstance(self.backend, MemoryBackend):
+                self.results = MemoryBackend(
+                    max_entries=app.config.get('CACHE_RESULTS_THRESHOLD', 256),
+                    ttl=self.backend.ttl)
+        app.extensions['entity_cache'] = self
+
+    @staticmethod
+    def _key(model, id):
+        from changes import change_generation
+        return f"{model.__tablename__}:{id}:{change_generation()}"
+
+    def get(self, model, id):
+        key = self._key(model, id)
+        try:
+            row = self.backend.get(key)
+        except (OSError, RedisError):
+            # a cache outage must never take the pages down with it
+            self.errors += 1
+            row = None
+        if row is not None:
+            self.hits += 1
+            return SimpleNamespace(**row)
+
+        self.misses += 1
+        obj = model.query.get(id)
+        if obj is None:
+            return None
+        row = {column.name: getattr(obj, column.name)
+               for column in model.__table__.columns}
+        try:
+            self.backend.set(key, row)
+        except (OSError, RedisError):
+            self.errors += 1
+        return SimpleNamespace(**row)
+
+    def invalidate(self, model, *ids):
+        try:
+            self.backend.delete(*[self._key(model, id) for id in ids])
+        except (OSError, RedisError):
+            self.errors += 1
+
+    def forget(self, obj):
+        '''
+        invalidate the entry of a (possibly expired or deleted) model
+        object without loading any of its attributes from the database.
+        '''
+        identity = inspect(obj).identity
+        if identity is not None:
+            self.invalidate(type(obj), *identity)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
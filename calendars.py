@@ -0,0 +1,165 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, current_app, request, abort, stream_with_context
+from sqlalchemy import select
+from extensions import db, entity_cache
+from models import Show, Venue, Artist
+from changes import change_generation
+from shards import lookup
+
+blueprint = Blueprint('calendars', __name__)
+
+#----------------------------------------------------------------------------#
+# iCalendar.
+#
+# Calendar apps poll a subscription every few minutes, so a feed must be
+# cheap to answer when nothing changed: its ETag only needs the newest
+# change log id, and its body is a range scan of the (venue_id, start_time)
+# or (artist_id, start_time) index, plus one lookup of the names of the
+# other side, which may be in another shard.
+#----------------------------------------------------------------------------#
+
+def ics_escape(text):
+  return (text or '').replace('\\', '\\\\').replace(';', '\\;').\
+    replace(',', '\\,').replace('\n', '\\n')
+
+def ics_line(name, value):
+  '''
+  a content line, folded into lines of at most 75 octets (RFC 5545).
+  '''
+  line = f"{name}:{value}".encode('utf-8')
+  chunks = []
+  while len(line) > 75:
+    cut = 75 if not chunks else 74
+    # do not split a UTF-8 sequence
+    while line[cut] & 0xC0 == 0x80:
+      cut -= 1
+    chunks.append(line[:cut])
+    line = line[cut:]
+  chunks.append(line)
+  return b'\r\n '.join(chunks).decode('utf-8') + '\r\n'
+
+def ics_time(value):
+  import dateutil.parser
+  return dateutil.parser.parse(value, ignoretz=True).strftime('%Y%m%dT%H%M%S')
+
+def feed_window(config=None):
+  '''
+  the first start time in the feeds. It moves once a day, so the ETags
+  stay valid in between.
+  '''
+  days = (config or current_app.config)['ICS_LOOKBACK_DAYS']
+  return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+def feed_etag(entity, id, since, generation=None):
+  # any write is in the change log, so its newest id versions every feed
+  if generation is None:
+    generation = change_generation()
+  return f"{entity}-{id}-{since}-{generation}"
+
+def feed_lines(name, events, hours):
+  '''
+  the lines of the calendar "name" with the events of the (uid, start
+  time, summary, location) rows in "events", each "hours" long.
+  '''
+  stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+  yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Fyyur//Shows//EN\r\n'
+  yield 'CALSCALE:GREGORIAN\r\nMETHOD:PUBLISH\r\n'
+  yield ics_line('X-WR-CALNAME', ics_escape(name))
+  for uid, start_time, summary, location in events:
+    yield ('BEGIN:VEVENT\r\n' + ics_line('UID', uid) +
+           f"DTSTAMP:{stamp}\r\nDTSTART:{ics_time(start_time)}\r\n"
+           f"DURATION:PT{hours}H\r\n" +
+           ics_line('SUMMARY', ics_escape(summary)) +
+           ics_line('LOCATION', ics_escape(location)) + 'END:VEVENT\r\n')
+  yield 'END:VCALENDAR\r\n'
+
+def feed_headers(response, etag, max_age):
+  response.set_etag(etag, weak=True)
+  response.cache_control.public = True
+  response.cache_control.max_age = max_age
+  return response
+
+def feed(name, etag, events):
+  '''
+  the calendar "name" with the events of the (uid, start time, summary,
+  location) rows in "events", or 304 when the client has "etag" already.
+  '''
+  config = current_app.config
+  if request.if_none_match.contains_weak(etag):
+    response = Response(status=304)
+  else:
+    lines = feed_lines(name, events, config['ICS_EVENT_HOURS'])
+    response = Response(stream_with_context(lines), mimetype='text/calendar')
+  return feed_headers(response, etag, config['ICS_MAX_AGE'])
+
+def show_uid(venue_id, artist_id, start_time):
+  return f"{venue_id}-{artist_id}-{ics_time(start_time)}@fyyur"
+
+def venue_feed_statement(venue_id, since):
+  return select(Show.artist_id, Show.start_time).\
+    where(Show.venue_id == venue_id, Show.start_time >= since)
+
+def artist_feed_statement(artist_id, since):
+  return select(Show.venue_id, Show.start_time).\
+    where(Show.artist_id == artist_id, Show.start_time >= since)
+
+def venue_events(venue, rows, artists):
+  '''
+  the events of the feed of "venue", from the rows of
+  venue_feed_statement() and the names of their "artists" (see lookup()).
+  '''
+  location = f"{venue.address}, {venue.city}, {venue.state}"
+  for artist_id, start_time in sorted(rows, key=lambda row: row[1]):
+    if artist_id in artists:
+      yield (show_uid(venue.id, artist_id, start_time), start_time,
+             f"{artists[artist_id][0]} at {venue.name}", location)
+
+def artist_events(artist, rows, venues):
+  '''
+  the events of the feed of "artist", from the rows of
+  artist_feed_statement() and the name and address of their "venues".
+  '''
+  for venue_id, start_time in sorted(rows, key=lambda row: row[1]):
+    if venue_id in venues:
+      name, address, city, state = venues[venue_id]
+      yield (show_uid(venue_id, artist.id, start_time), start_time,
+             f"{artist.name} at {name}", f"{address}, {city}, {state}")
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+@blueprint.route('/venues/<int:venue_id>/shows.ics')
+def venue_calendar(venue_id):
+  venue = entity_cache.get(Venue, venue_id)
+  # Venue with venue_id is not found
+  if venue == None:
+    abort (404)
+  since = feed_window()
+
+  def events():
+    rows = db.session.execute(venue_feed_statement(venue_id, since)).all()
+    artists = lookup(Artist, {artist_id for artist_id, _ in rows}, Artist.name)
+    yield from venue_events(venue, rows, artists)
+
+  return feed(venue.name, feed_etag('venue', venue_id, since), events())
+
+@blueprint.route('/artists/<int:artist_id>/shows.ics')
+def artist_calendar(artist_id):
+  artist = entity_cache.get(Artist, artist_id)
+  # Artist with artist_id is not found
+  if artist == None:
+    abort (404)
+  since = feed_window()
+
+  def events():
+    rows = db.session.execute(artist_feed_statement(artist_id, since)).all()
+    venues = lookup(Venue, {venue_id for venue_id, _ in rows},
+                    Venue.name, Venue.address, Venue.city, Venue.state)
+    yield from artist_events(artist, rows, venues)
+
+  return feed(artist.name, feed_etag('artist', artist_id, since), events())
@@ -0,0 +1,160 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import json
+from datetime import datetime, timedelta
+from flask import Blueprint, current_app, g, request, jsonify
+from sqlalchemy import select, func
+from extensions import db
+from models import Change, Show, Venue, Artist
+
+blueprint = Blueprint('changes', __name__)
+
+#----------------------------------------------------------------------------#
+# Change log.
+#
+# The write handlers call record_change() before they commit, so a change
+# is logged in the same transaction as the write itself: it is in the log
+# if and only if the write happened.
+#----------------------------------------------------------------------------#
+
+def change_of(obj):
+  '''
+  return the (entity, key, payload) describing "obj" in the change log.
+  The payload only holds what a listing needs, not the whole row.
+  '''
+  if isinstance(obj, Show):
+    # the show form hands over the ids as strings
+    venue_id, artist_id = int(obj.venue_id), int(obj.artist_id)
+    return 'show', f"{venue_id}:{artist_id}:{obj.start_time}", {
+      "venue_id": venue_id,
+      "artist_id": artist_id,
+      "start_time": str(obj.start_time)
+    }
+  if isinstance(obj, Venue):
+    entity = 'venue'
+  elif isinstance(obj, Artist):
+    entity = 'artist'
+  else:
+    raise TypeError(f"{type(obj).__name__} is not logged")
+  return entity, str(obj.id), {
+    "id": obj.id,
+    "name": obj.name,
+    "city": obj.city,
+    "state": obj.state,
+    "genres": obj.genres
+  }
+
+def record_change(op, obj):
+  '''
+  add a "create", "update" or "delete" entry for "obj" to the current
+  transaction. New objects must have been flushed so they have an id.
+  '''
+  entity, key, payload = change_of(obj)
+  db.session.add(Change(entity=entity, op=op, key=key,
+                        payload=json.dumps(payload)))
+  # the request reads the generation again once it has written
+  g.pop('change_generation', None)
+
+def change_generation():
+  '''
+  the newest change log id, read once per request. The caches put it in
+  their keys, so any write makes every worker look up again, without
+  invalidating anything.
+  '''
+  if 'change_generation' not in g:
+    g.change_generation = db.session.scalar(select(func.max(Change.id))) or 0
+  return g.change_generation
+
+def settled_before(config=None):
+  '''
+  the time before which the log is complete. A transaction still in flight
+  may hold a smaller id than one already committed, so whoever moves a
+  cursor along the ids stops at the changes CHANGES_SETTLE_SECONDS old, or
+  it would step over that change for good.
+  '''
+  config = config or current_app.config
+  return datetime.utcnow() - timedelta(seconds=config['CHANGES_SETTLE_SECONDS'])
+
+def changes_statement(cursor, limit, settled, entity=None):
+  '''
+  the SELECT of the settled changes after "cursor", shared with the stream
+  of async_app.py.
+  '''
+  statement = select(Change).where(Change.id > cursor, Change.created_at < settled)
+  if entity:
+    statement = statement.where(Change.entity == entity)
+  return statement.order_by(Change.id).limit(limit)
+
+def latest_statement(settled):
+  return select(func.max(Change.id)).where(Change.created_at < settled)
+
+def changes_since(cursor, limit, entity=None):
+  return db.session.scalars(changes_statement(cursor, limit, settled_before(),
+                                              entity)).all()
+
+def format_change(change):
+  return {
+    "id": change.id,
+    "entity": change.entity,
+    "op": change.op,
+    "key": change.key,
+    "data": json.loads(change.payload) if change.payload else None,
+    "at": change.created_at.isoformat()
+  }
+
+def format_event(change):
+  '''
+  "change" as a server-sent event. The event id is the change id, so a
+  reconnecting EventSource resumes where it stopped.
+  '''
+  return (f"id: {change.id}\nevent: {change.entity}\n"
+          f"data: {json.dumps(format_change(change))}\n\n")
+
+def parse_cursor(headers, args):
+  '''
+  the position to resume from: the "Last-Event-ID" header an EventSource
+  sends when it reconnects, else the "cursor" query parameter. 0 replays
+  the whole log, "latest" (returned as is) starts at the current end of
+  the log.
+  '''
+  cursor = headers.get('Last-Event-ID') or args.get('cursor', '0')
+  if cursor == 'latest':
+    return cursor
+  try:
+    return max(int(cursor), 0)
+  except ValueError:
+    return 0
+
+def page_limit(args, config):
+  '''
+  the "limit" query parameter, kept within 1..CHANGES_PAGE_SIZE.
+  '''
+  return max(1, min(args.get('limit', 100, type=int), config['CHANGES_PAGE_SIZE']))
+
+def request_cursor():
+  cursor = parse_cursor(request.headers, request.args)
+  if cursor == 'latest':
+    return db.session.scalar(latest_statement(settled_before())) or 0
+  return cursor
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+@blueprint.route('/changes')
+def list_changes():
+  '''
+  one page of the log after "cursor", for clients that poll or catch up.
+  The server-sent events of /changes/stream are served by async_app.py,
+  where a subscriber waiting for changes does not hold a worker.
+  '''
+  cursor = request_cursor()
+  limit = page_limit(request.args, current_app.config)
+  changes = changes_since(cursor, limit, request.args.get('entity'))
+  data = [format_change(change) for change in changes]
+  return jsonify({
+    "changes": data,
+    "cursor": data[-1]["id"] if data else cursor
+  })
@@ -0,0 +1,252 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import json
+from bisect import bisect_left
+from datetime import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, insert, select
+from extensions import db
+from models import Document, Show, Venue, Artist
+from shards import lookup
+
+#----------------------------------------------------------------------------#
+# Page documents.
+#
+# The venue and artist pages are rendered from a Document row each: the
+# profile and every show of the venue or artist, with the name and image of
+# the other side, sorted by start time. The write handlers refresh the
+# documents a write touches in the same transaction, so a page is one
+# primary key lookup; only the split into past and upcoming shows depends
+# on the time and is done when rendering. "flask documents rebuild"
+# recomputes them all.
+#----------------------------------------------------------------------------#
+
+PROFILES = {
+  'venue': (Venue, ('id', 'name', 'genres', 'address', 'city', 'state', 'phone',
+                    'website', 'facebook_link', 'seeking_talent',
+                    'seeking_description', 'image_link')),
+  'artist': (Artist, ('id', 'name', 'genres', 'city', 'state', 'phone', 'website',
+                      'facebook_link', 'seeking_venue', 'seeking_description',
+                      'image_link'))
+}
+
+# the other side of the shows listed on a page: (entity, model, show column)
+OTHER = {
+  'venue': ('artist', Artist, Show.artist_id),
+  'artist': ('venue', Venue, Show.venue_id)
+}
+
+def sort_key(start_time):
+  '''
+  "start_time" as "YYYY-MM-DD HH:MM:SS", which sorts and compares as the
+  time it is, whatever format it was stored in.
+  '''
+  import dateutil.parser
+  return dateutil.parser.parse(start_time, ignoretz=True).strftime('%Y-%m-%d %H:%M:%S')
+
+def build(entity, records, shows):
+  '''
+  the document bodies of the "records" (dicts of profile columns) of
+  "entity", from its (own id, other id, other name, other image link,
+  start time) "shows" rows.
+  '''
+  other = OTHER[entity][0]
+  documents = {}
+  for record in records:
+    document = dict(record)
+    document['genres'] = document['genres'].split(',')
+    document['shows'] = []
+    documents[record['id']] = document
+  for id, other_id, other_name, other_image_link, start_time in shows:
+    if id in documents:
+      documents[id]['shows'].append({
+        f"{other}_id": other_id,
+        f"{other}_name": other_name,
+        f"{other}_image_link": other_image_link,
+        "start_time": start_time,
+        "sort_key": sort_key(start_time)
+      })
+  for document in documents.values():
+    document['shows'].sort(key=lambda show: show['sort_key'])
+  return documents
+
+def load_statements(entity, ids=None):
+  '''
+  the selects of the profiles and the (own id, other id, start time) rows
+  of the shows of the "ids" of "entity" (all of them by default).
+  '''
+  model, columns = PROFILES[entity]
+  other_column = OTHER[entity][2]
+  own_column = Show.venue_id if entity == 'venue' else Show.artist_id
+  profiles = select(*[getattr(model, name) for name in columns])
+  shows = select(own_column, other_column, Show.start_time)
+  if ids is not None:
+    profiles = profiles.where(model.id.in_(ids))
+    shows = shows.where(own_column.in_(ids))
+  return profiles, shows
+
+def assemble(entity, profiles, shows, others):
+  '''
+  build() from the rows of the load_statements() and the name and image
+  link of the "others" of the shows, by id.
+  '''
+  return build(entity, [row._asdict() for row in profiles],
+               [(id, other_id, *others[other_id], start_time)
+                for id, other_id, start_time in shows if other_id in others])
+
+def load(entity, ids=None):
+  '''
+  the document bodies of the "ids" of "entity" (all of them by default),
+  read with one query for the profiles, one for the shows and one for
+  the other side of the shows, which may be in another shard.
+  '''
+  other_model = OTHER[entity][1]
+  profiles, shows = load_statements(entity, ids)
+  profiles = db.session.execute(profiles).all()
+  shows = db.session.execute(shows).all()
+  others = lookup(other_model, {other_id for _, other_id, _ in shows},
+                  other_model.name, other_model.image_link)
+  return assemble(entity, profiles, shows, others)
+
+def affected_documents(obj):
+  '''
+  the {entity: ids} of the documents showing "obj": its own and those of
+  the venues or artists it has shows with. Read it before deleting "obj".
+  '''
+  if isinstance(obj, Show):
+    return {'venue': {int(obj.venue_id)}, 'artist': {int(obj.artist_id)}}
+  entity = 'venue' if isinstance(obj, Venue) else 'artist'
+  other, _, other_column = OTHER[entity]
+  own_column = Show.venue_id if entity == 'venue' else Show.artist_id
+  others = db.session.execute(
+    select(other_column).where(own_column == obj.id).distinct()).scalars()
+  return {entity: {obj.id}, other: set(others)}
+
+def insert_documents(entity, documents):
+  if documents:
+    now = datetime.utcnow()
+    # into the table: the sharded session (shards.py) has no ORM bulk insert
+    db.session.execute(insert(Document.__table__), [
+      {"entity": entity, "id": id, "body": json.dumps(body), "updated_at": now}
+      for id, body in documents.items()])
+
+def upsert_documents(entity, documents):
+  '''
+  insert the documents, or replace those already there: a document another
+  transaction inserted meanwhile is overwritten instead of failing on the
+  primary key.
+  '''
+  dialect = db.engine.dialect.name
+  if dialect == 'postgresql':
+    from sqlalchemy.dialects.postgresql import insert as dialect_insert
+  elif dialect == 'sqlite':
+    from sqlalchemy.dialects.sqlite import insert as dialect_insert
+  else:
+    db.session.execute(delete(Document).where(Document.entity == entity,
+                                              Document.id.in_(list(documents))))
+    return insert_documents(entity, documents)
+  if documents:
+    statement = dialect_insert(Document.__table__)
+    statement = statement.on_conflict_do_update(
+      index_elements=['entity', 'id'],
+      set_={"body": statement.excluded.body, "updated_at": statement.excluded.updated_at})
+    now = datetime.utcnow()
+    db.session.execute(statement, [
+      {"entity": entity, "id": id, "body": json.dumps(body), "updated_at": now}
+      for id, body in documents.items()])
+
+def refresh_documents(keys):
+  '''
+  recompute the documents of "keys" ({entity: ids}) in the current
+  transaction, and drop those of the venues and artists that are gone.
+  The venues and artists are locked first (in id order, venues first),
+  so two writes refreshing the same document take turns and the second
+  one reads the shows the first one added.
+  '''
+  for entity, ids in sorted(keys.items(), key=lambda item: item[0] != 'venue'):
+    ids = set(ids)
+    if not ids:
+      continue
+    model = PROFILES[entity][0]
+    db.session.execute(select(model.id).where(model.id.in_(ids)).
+                       order_by(model.id).with_for_update())
+    documents = load(entity, ids)
+    upsert_documents(entity, documents)
+    gone = ids - set(documents)
+    if gone:
+      db.session.execute(delete(Document).where(Document.entity == entity,
+                                                Document.id.in_(gone)))
+
+def update_documents(obj):
+  '''
+  refresh the documents showing "obj", which was just created or changed.
+  '''
+  db.session.flush()
+  refresh_documents(affected_documents(obj))
+
+def rebuild():
+  '''
+  recompute every document in one transaction. Returns how many.
+  '''
+  if db.engine.dialect.name == 'postgresql':
+    # a write refreshing a document meanwhile makes the rebuild fail rather
+    # than be overwritten with what the rebuild read before it
+    db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+  db.session.execute(delete(Document))
+  count = 0
+  for entity in PROFILES:
+    documents = load(entity)
+    insert_documents(entity, documents)
+    count += len(documents)
+  db.session.commit()
+  return count
+
+#----------------------------------------------------------------------------#
+# Pages.
+#----------------------------------------------------------------------------#
+
+def split_shows(data):
+  '''
+  the document body "data" as the templates take it: its shows split into
+  past and upcoming ones, with their counts.
+  '''
+  shows = data.pop('shows')
+  # the shows are sorted: the past ones are those before now
+  now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+  split = bisect_left([show['sort_key'] for show in shows], now)
+  data['past_shows'] = shows[:split]
+  data['upcoming_shows'] = shows[split:]
+  data['past_shows_count'] = split
+  data['upcoming_shows_count'] = len(shows) - split
+  return data
+
+def page(entity, id):
+  '''
+  the data of the page of the venue or artist "id", or None if there is no
+  such venue or artist. A document missing (before the first rebuild) is
+  computed from the tables instead.
+  '''
+  document = db.session.get(Document, (entity, id))
+  if document is not None:
+    return split_shows(json.loads(document.body))
+  data = load(entity, [id]).get(id)
+  return split_shows(data) if data is not None else None
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+documents_cli = AppGroup('documents', help='Manage the venue and artist page documents.')
+
+@documents_cli.command('rebuild')
+def rebuild_command():
+  '''
+  recompute the documents of every venue and artist.
+  '''
+  click.echo(f"Rebuilt {rebuild()} documents.")
+
+def init_app(app):
+  app.cli.add_command(documents_cli)
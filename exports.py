@@ -0,0 +1,249 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import datetime, timezone
+import click
+from flask import Blueprint, Response, request, abort, stream_with_context
+from sqlalchemy import tuple_
+from extensions import db
+from keys import admin_only
+from models import Change, Show, Venue, Artist
+
+# the commands are registered at the top level: "flask export ..."
+blueprint = Blueprint('exports', __name__, cli_group=None)
+
+MODELS = {'venue': Venue, 'artist': Artist, 'show': Show}
+FORMATS = {
+  'csv': 'text/csv',
+  'jsonl': 'application/x-ndjson',
+  'parquet': 'application/vnd.apache.parquet'
+}
+
+#----------------------------------------------------------------------------#
+# Rows.
+#
+# Tables are read with yield_per, a server-side cursor on Postgres, and
+# every writer below is a generator over those rows: an export holds one
+# batch in memory whatever the size of the table.
+#----------------------------------------------------------------------------#
+
+BATCH_SIZE = 1000
+
+def export_columns(entity):
+  return list(MODELS[entity].__table__.columns)
+
+def changed_keys(entity, since):
+  '''
+  batches of the keys of the "entity" rows created or updated since the
+  datetime "since", read from the change log. The database drops the keys
+  changed more than once, so memory stays flat however many there are.
+  '''
+  keys = db.session.query(Change.key).\
+    filter(Change.entity == entity, Change.created_at >= since,
+           Change.op != 'delete').\
+    group_by(Change.key).order_by(db.func.min(Change.id)).\
+    execution_options(yield_per=BATCH_SIZE)
+  return batches(key for key, in keys)
+
+def key_filter(entity, keys):
+  if entity == 'show':
+    keys = [key.split(':', 2) for key in keys]
+    return tuple_(Show.venue_id, Show.artist_id, Show.start_time).in_(
+      [(int(venue_id), int(artist_id), start_time)
+       for venue_id, artist_id, start_time in keys])
+  return MODELS[entity].id.in_([int(key) for key in keys])
+
+def export_rows(entity, since=None):
+  '''
+  the rows of "entity", or only those changed since "since". Rows deleted
+  since then are not exported; the change log lists them.
+  '''
+  model = MODELS[entity]
+  query = db.session.query(*export_columns(entity))
+  if since is None:
+    yield from query.order_by(*model.__table__.primary_key.columns).\
+      execution_options(yield_per=BATCH_SIZE)
+    return
+  for keys in changed_keys(entity, since):
+    yield from query.filter(key_filter(entity, keys))
+
+def batches(rows):
+  batch = []
+  for row in rows:
+    batch.append(row)
+    if len(batch) == BATCH_SIZE:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+#----------------------------------------------------------------------------#
+# Writers.
+#----------------------------------------------------------------------------#
+
+def write_csv(columns, rows):
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow([column.name for column in columns])
+  for batch in batches(rows):
+    writer.writerows(batch)
+    yield buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+  if buffer.tell():
+    yield buffer.getvalue().encode('utf-8')
+
+def write_jsonl(columns, rows):
+  names = [column.name for column in columns]
+  for batch in batches(rows):
+    yield ''.join(json.dumps(dict(zip(names, row)), default=str) + '\n'
+                  for row in batch).encode('utf-8')
+
+class ChunkSink:
+    '''
+    a write-only file that keeps what is written until it is drained, so
+    the Parquet writer can be streamed a row group at a time.
+    '''
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def write_parquet(columns, rows):
+  '''
+  one Parquet row group per batch. pyarrow is only needed for this format,
+  so it is imported here.
+  '''
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+  types = {int: pa.int64(), bool: pa.bool_(), str: pa.string(),
+           datetime: pa.timestamp('us')}
+  schema = pa.schema([(column.name, types[column.type.python_type])
+                      for column in columns])
+  sink = ChunkSink()
+  writer = pq.ParquetWriter(sink, schema, compression='snappy')
+  for batch in batches(rows):
+    writer.write_batch(pa.RecordBatch.from_pylist(
+      [dict(zip(schema.names, row)) for row in batch], schema=schema))
+    yield sink.drain()
+  writer.close()
+  yield sink.drain()
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'parquet': write_parquet}
+
+def gzipped(chunks):
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+  for chunk in chunks:
+    data = compressor.compress(chunk)
+    if data:
+      yield data
+  yield compressor.flush()
+
+def export(entity, format, since=None, compress=False):
+  '''
+  the export of "entity" in "format" as a generator of bytes.
+  '''
+  if format == 'parquet':
+    # fail before the first byte is sent when pyarrow is not installed
+    import pyarrow
+  chunks = WRITERS[format](export_columns(entity), export_rows(entity, since))
+  return gzipped(chunks) if compress else chunks
+
+def parse_since(value):
+  '''
+  the naive UTC datetime of the change log from an ISO 8601 string.
+  '''
+  if not value:
+    return None
+  since = datetime.fromisoformat(value)
+  if since.tzinfo is not None:
+    since = since.astimezone(timezone.utc).replace(tzinfo=None)
+  return since
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+@blueprint.route('/admin/export/<entity>.<format>')
+@admin_only
+def export_entity(entity, format):
+  '''
+  the export of a table for the holders of ADMIN_TOKEN (see
+  keys.admin_only). "since" (ISO 8601) limits it to the rows changed since
+  then and "gzip=1" compresses it.
+  '''
+  if entity not in MODELS or format not in FORMATS:
+    abort(404)
+  try:
+    since = parse_since(request.args.get('since'))
+  except ValueError:
+    abort(400)
+  compress = request.args.get('gzip') == '1'
+  try:
+    chunks = export(entity, format, since, compress)
+  except ImportError:
+    abort(501)
+
+  filename = f"{entity}.{format}" + ('.gz' if compress else '')
+  return Response(stream_with_context(chunks),
+                  mimetype='application/gzip' if compress else FORMATS[format],
+                  headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                           'Cache-Control': 'no-store'})
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@blueprint.cli.command('export')
+@click.argument('entity', type=click.Choice(sorted(MODELS)))
+@click.option('--format', 'format', type=click.Choice(sorted(FORMATS)), default='csv')
+@click.option('--since', help='Only rows created or updated since then '
+              '(ISO 8601, UTC unless it has an offset).')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False),
+              help='Write to this file instead of stdout.')
+def export_command(entity, format, since, compress, output):
+  '''
+  export every venue, artist or show.
+  '''
+  try:
+    since = parse_since(since)
+  except ValueError:
+    raise click.BadParameter('not an ISO 8601 date', param_hint='--since')
+  try:
+    chunks = export(entity, format, since, compress)
+  except ImportError:
+    raise click.ClickException('The parquet format needs pyarrow.')
+  out = open(output, 'wb') if output else sys.stdout.buffer
+  try:
+    for chunk in chunks:
+      out.write(chunk)
+  finally:
+    if output:
+      out.close()
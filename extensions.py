@@ -0,0 +1,40 @@
+#----------------------------------------------------------------------------#
+# Extensions.
+#
+# Created unbound here and bound to the app in create_app(), so models and
+# blueprints can import them without importing the app.
+#----------------------------------------------------------------------------#
+
+from flask import current_app
+from flask_moment import Moment
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from flask_migrate import Migrate
+
+from cache import EntityCache
+from fuzzy import SearchIndex
+from images import ImageProxy
+from metrics import Metrics
+from ratelimit import RateLimiter
+
+class AppSession(Session):
+    '''
+    the class of db.session, picked before the config is known: a
+    shards.RoutingSession in the apps with SHARDS set.
+    '''
+
+    def __new__(cls, db, **options):
+        if current_app.config.get('SHARDS'):
+            from shards import RoutingSession
+            return RoutingSession(db, **options)
+        return super().__new__(cls)
+
+
+db = SQLAlchemy(session_options={'class_': AppSession})
+migrate = Migrate()
+moment = Moment()
+entity_cache = EntityCache()
+limiter = RateLimiter()
+search_index = SearchIndex()
+metrics = Metrics()
+images = ImageProxy()
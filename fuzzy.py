@@ -0,0 +1,638 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import heapq
+import json
+import math
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter
+from operator import itemgetter
+from types import SimpleNamespace
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+#----------------------------------------------------------------------------#
+# Trigram index.
+#
+# Typo-tolerant name search: a name is split into the trigrams of its
+# words (like Postgres' pg_trgm), each trigram maps to the documents that
+# contain it, and a query is ranked by the trigram similarity
+# |common| / |union| between the query and each candidate name.
+#----------------------------------------------------------------------------#
+
+NOT_WORD = re.compile(r"[^\w\s]+")
+
+def normalize(text):
+  '''
+  lower case, strip accents and punctuation ("Guns N' Petals" and
+  "guns n petals" normalize to the same string).
+  '''
+  if not text.isascii():
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+  return ' '.join(NOT_WORD.sub('', text.lower()).split())
+
+def trigrams(text):
+  grams = set()
+  for word in normalize(text).split():
+    padded = '  ' + word + ' '
+    for i in range(len(padded) - 2):
+      grams.add(padded[i:i + 3])
+  return grams
+
+def similarity(common, size, other_size):
+  '''
+  the similarity of two trigram sets of "size" and "other_size" trigrams,
+  "common" of which they share.
+  '''
+  return common / (size + other_size - common) if common else 0.0
+
+
+class TrigramIndex:
+    '''
+    an inverted index from trigrams to compact arrays of document numbers.
+
+    Updates are incremental: a new or renamed entity gets a new document
+    number appended to the postings of its trigrams, and its previous
+    document is only marked dead. Dead documents are skipped by queries and
+    dropped by compact(), which runs once they make up half of the index.
+    '''
+
+    def __init__(self):
+        self.postings = {}
+        # document number -> (entity id, name, number of trigrams) for live
+        # documents
+        self.documents = {}
+        # entity id -> its live document number
+        self.current = {}
+        self.next_document = 0
+        self.dead = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.current)
+
+    # the lock is not saved with the snapshot
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, id, name):
+        with self._lock:
+            document = self.current.get(id)
+            if document is not None and self.documents[document][1] == name:
+                # the handler already applied the change the log replays
+                return
+            self._remove(id)
+            if self.dead > len(self.current):
+                # renames leave dead documents behind too
+                self._compact()
+            document = self.next_document
+            self.next_document += 1
+            grams = trigrams(name)
+            self.documents[document] = (id, name, len(grams))
+            self.current[id] = document
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = array('I')
+                posting.append(document)
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+            if self.dead > len(self.current):
+                self._compact()
+
+    def _remove(self, id):
+        document = self.current.pop(id, None)
+        if document is not None:
+            del self.documents[document]
+            self.dead += 1
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        postings = {}
+        for document, (id, name, _) in self.documents.items():
+            for gram in trigrams(name):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('I')
+                posting.append(document)
+        self.postings = postings
+        self.dead = 0
+
+    def search(self, query, limit=10, threshold=0.3, budget=50000, where=None):
+        '''
+        return up to "limit" (id, name, similarity) tuples, best first,
+        keeping only the ids for which "where" is true when it is given.
+        With "limit" None, every match, unsorted.
+
+        Postings are counted from the rarest trigram of the query to the
+        most common one, stopping before "budget" entries were counted, so
+        a query costs about the same whatever the size of the index. The
+        skipped trigrams are the ones most names share ("  s", "s  "): they
+        barely change which names are candidates, and the candidates are
+        scored exactly again. Every match needs every posting: "budget" is
+        ignored then.
+        '''
+        grams = trigrams(query)
+        postings = sorted((self.postings[gram] for gram in grams
+                           if gram in self.postings), key=len)
+        counts = Counter()
+        counted = 0
+        skipped = False
+        for posting in postings:
+            if limit is not None and counted and counted + len(posting) > budget:
+                skipped = True
+                break
+            counts.update(posting)
+            counted += len(posting)
+
+        documents = self.documents
+        if limit is None:
+            # a document with fewer trigrams in common cannot reach the
+            # threshold, so it is in one of the "rarest" postings at least
+            least = threshold * len(grams)
+            rarest = math.floor(len(postings) - least) + 1
+            pool = set().union(*postings[:max(rarest, 0)])
+            candidates = [(document, common) for document, common in
+                          zip(pool, map(counts.__getitem__, pool)) if common >= least]
+            if where is not None:
+                candidates = [(document, common) for document, common in candidates
+                              if document in documents and where(documents[document][0])]
+        elif where is None:
+            candidates = counts.most_common(limit * 5)
+        else:
+            candidates = heapq.nlargest(limit * 5, (
+                (document, common) for document, common in counts.items()
+                if document in documents and where(documents[document][0])),
+                key=itemgetter(1))
+
+        results = []
+        for document, common in candidates:
+            entry = documents.get(document)
+            if entry is None:
+                continue
+            if skipped:
+                common = len(grams & trigrams(entry[1]))
+            score = similarity(common, len(grams), entry[2])
+            if score >= threshold:
+                results.append((entry[0], entry[1], score))
+        if limit is None:
+            return results
+        results.sort(key=lambda result: result[2], reverse=True)
+        return results[:limit]
+
+    def memory_usage(self):
+        '''
+        an estimate of the bytes held by the index.
+        '''
+        size = sys.getsizeof(self.postings) + sys.getsizeof(self.documents) + \
+               sys.getsizeof(self.current)
+        for gram, posting in self.postings.items():
+            size += sys.getsizeof(gram) + sys.getsizeof(posting)
+        for entry in self.documents.values():
+            size += sys.getsizeof(entry) + sys.getsizeof(entry[1])
+        return size
+
+#----------------------------------------------------------------------------#
+# Catalog.
+#----------------------------------------------------------------------------#
+
+class Catalog:
+    '''
+    one trigram index over everything a visitor searches for: the names of
+    the venues and artists, keyed by ("venue", id) and ("artist", id), and
+    each distinct city, state and genre, keyed by ("city", "San Francisco")
+    and so on. A value is indexed once however many venues and artists
+    share it; "members" maps it to them.
+    '''
+
+    # how much a match on a value counts compared to a match on a name
+    FIELD_WEIGHTS = {'city': 0.8, 'state': 0.6, 'genre': 0.8}
+
+    def __init__(self):
+        self.index = TrigramIndex()
+        # (entity, id) -> (name, city, state, genres)
+        self.rows = {}
+        # (field, value) -> set of (entity, id)
+        self.members = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _values(self, row):
+        values = {('city', row[1]), ('state', row[2])}
+        values.update(('genre', genre) for genre in row[3])
+        return {value for value in values if value[1]}
+
+    def add(self, entity, row):
+        '''
+        index or re-index a venue or artist from a row with its id, name,
+        city, state and comma separated genres.
+        '''
+        key = (entity, row.id)
+        new = (row.name, row.city, row.state,
+               tuple(genre for genre in (row.genres or '').split(',') if genre))
+        with self._lock:
+            old = self.rows.get(key)
+            if old == new:
+                return
+            self.rows[key] = new
+            self.index.add(key, row.name)
+            old_values = self._values(old) if old else set()
+            new_values = self._values(new)
+            for value in old_values - new_values:
+                self._unlink(value, key)
+            for value in new_values - old_values:
+                self._link(value, key)
+
+    def remove(self, entity, id):
+        key = (entity, id)
+        with self._lock:
+            old = self.rows.pop(key, None)
+            if old is None:
+                return
+            self.index.remove(key)
+            for value in self._values(old):
+                self._unlink(value, key)
+
+    def _link(self, value, key):
+        members = self.members.get(value)
+        if members is None:
+            members = self.members[value] = set()
+            self.index.add(value, value[1])
+        members.add(key)
+
+    def _unlink(self, value, key):
+        members = self.members.get(value)
+        if members is None:
+            return
+        members.discard(key)
+        if not members:
+            del self.members[value]
+            self.index.remove(value)
+
+    def names(self, entity, query, limit=10, threshold=0.3):
+        '''
+        the (id, name, similarity) of the "entity" names closest to "query".
+        '''
+        return [(key[1], name, score) for key, name, score in
+                self.index.search(query, limit, threshold,
+                                  where=lambda key: key[0] == entity)]
+
+    def search(self, query, limit=20, threshold=0.3, entity=None, genre=None, offset=0):
+        '''
+        rank the venues and artists matching "query" by name, city, state or
+        genre, each scored by its best matching field. Returns the "limit"
+        best after the first "offset", optionally only of one entity type or
+        genre, with the total and the facet counts per type and genre of
+        every match.
+
+        A city, state or genre matches all its members at once, so matches
+        are combined as sets and counted with set intersections; only the
+        page is ranked one venue or artist at a time.
+        '''
+        # score -> [(field, keys matched with that score)]
+        levels = {}
+        for value, text, score in self.index.search(query, None, threshold):
+            if value[0] in self.FIELD_WEIGHTS:
+                keys = self.members.get(value)
+                if not keys:
+                    continue
+                field, score = value[0], score * self.FIELD_WEIGHTS[value[0]]
+            elif value in self.rows:
+                field, keys = 'name', (value,)
+            else:
+                continue
+            levels.setdefault(score, []).append((field, keys))
+        matches = set().union(*(keys for level in levels.values() for _, keys in level))
+
+        selected = matches
+        if genre is not None:
+            selected = selected & self.members.get(('genre', genre), set())
+        if entity is not None:
+            selected = {key for key in selected if key[0] == entity}
+
+        page = []
+        wanted = offset + limit
+        for score in sorted(levels, reverse=True):
+            if len(page) >= wanted:
+                break
+            # the keys not ranked at a better score, by name
+            fields = {}
+            for field, keys in levels[score]:
+                for key in selected.intersection(keys).difference(fields):
+                    fields[key] = field
+            for key in page:
+                fields.pop(key[1], None)
+            best = heapq.nsmallest(wanted - len(page), fields,
+                                   key=lambda key: self.rows[key][0])
+            page.extend((score, key, fields[key]) for key in best)
+
+        genres = Counter()
+        for value, keys in self.members.items():
+            if value[0] == 'genre':
+                # iterates over the smaller of the two sets
+                count = len(matches.intersection(keys))
+                if count:
+                    genres[value[1]] = count
+        return {
+            "count": len(selected),
+            "data": [{
+                "type": key[0],
+                "id": key[1],
+                "name": row[0],
+                "city": row[1],
+                "state": row[2],
+                "genres": list(row[3]),
+                "matched": field,
+                "score": round(score, 3)
+            } for score, key, field in page[offset:]
+              for row in (self.rows[key],)],
+            "facets": {
+                "type": dict(Counter(key[0] for key in matches).most_common()),
+                "genre": dict(genres.most_common())
+            }
+        }
+
+    def memory_usage(self):
+        '''
+        an estimate of the bytes held by the catalog.
+        '''
+        size = self.index.memory_usage() + sys.getsizeof(self.rows) + \
+               sys.getsizeof(self.members)
+        for key, row in self.rows.items():
+            size += sys.getsizeof(key) + sys.getsizeof(row) + sys.getsizeof(row[3])
+        for members in self.members.values():
+            size += sys.getsizeof(members)
+        return size
+
+#----------------------------------------------------------------------------#
+# Search index of the app.
+#----------------------------------------------------------------------------#
+
+class SearchIndex:
+    '''
+    the catalog of the app, from the snapshot written by "flask search
+    rebuild-index" when there is one, else from the database. The workers
+    load it when they start (see gunicorn.conf.py); a request finding it
+    not loaded yet starts loading it in a thread and is answered with a
+    substring match of the names meanwhile.
+
+    The handlers update it as they write, and a search applies the change
+    log entries after its cursor first (at most every
+    SEARCH_CATCH_UP_INTERVAL seconds), so the catalogs of the other workers
+    catch up with a cheap primary-key range query. The cursor only moves
+    over the settled entries (see changes.settled_before): the newer ones
+    are applied again by the next catch-up, so that an entry committed
+    later with a smaller id is not skipped.
+    '''
+
+    ENTITIES = ('venue', 'artist')
+
+    def __init__(self, app=None):
+        self.catalog = None
+        self.cursor = 0
+        self.caught_up_at = 0
+        self._lock = threading.Lock()
+        self._catch_up_lock = threading.Lock()
+        self._loader = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['search_index'] = self
+        app.cli.add_command(search_cli)
+
+    def _models(self):
+        from models import Venue, Artist
+        return {'venue': Venue, 'artist': Artist}
+
+    def build(self):
+        '''
+        load every venue and artist from the database into a new catalog.
+        '''
+        from extensions import db
+        from models import Change
+        from changes import settled_before
+        # read the cursor first: changes made while loading get applied
+        # again afterwards, which is harmless
+        cursor = db.session.query(db.func.max(Change.id)).\
+            filter(Change.created_at < settled_before()).scalar() or 0
+        catalog = Catalog()
+        for entity, model in self._models().items():
+            rows = db.session.query(model.id, model.name, model.city,
+                                    model.state, model.genres).\
+                execution_options(yield_per=10000)
+            for row in rows:
+                catalog.add(entity, row)
+        return catalog, cursor
+
+    def ensure_loaded(self):
+        if self.catalog is not None:
+            return
+        with self._lock:
+            if self.catalog is not None:
+                return
+            path = current_app.config.get('SEARCH_INDEX_PATH')
+            if path and os.path.exists(path):
+                with open(path, 'rb') as snapshot:
+                    catalog, cursor = pickle.load(snapshot)
+            else:
+                catalog, cursor = self.build()
+            self.catalog, self.cursor = catalog, cursor
+
+    def load_in_background(self):
+        '''
+        start loading the catalog in a thread of its own, unless one is
+        already at it.
+        '''
+        app = current_app._get_current_object()
+
+        def load():
+            try:
+                with app.app_context():
+                    self.ensure_loaded()
+            finally:
+                self._loader = None
+
+        with self._lock:
+            if self._loader is not None or self.catalog is not None:
+                return
+            self._loader = threading.Thread(target=load, name='search-index', daemon=True)
+            self._loader.start()
+
+    def catch_up(self):
+        from models import Change
+        from changes import settled_before
+        with self._catch_up_lock:
+            if time.monotonic() - self.caught_up_at < \
+               current_app.config['SEARCH_CATCH_UP_INTERVAL']:
+                return
+            settled = settled_before()
+            changes = Change.query.filter(Change.id > self.cursor,
+                                          Change.entity.in_(self.ENTITIES)).\
+                order_by(Change.id).all()
+            self.apply(changes, settled)
+            self.caught_up_at = time.monotonic()
+
+    def apply(self, changes, settled):
+        '''
+        apply the change log entries "changes" and move the cursor over
+        those logged before "settled". Call it holding the catch-up lock.
+        '''
+        moving = True
+        for change in changes:
+            if change.op == 'delete':
+                self.remove(change.entity, int(change.key))
+            else:
+                # entries logged before genres were part of the payload
+                row = SimpleNamespace(**{"genres": '', **json.loads(change.payload)})
+                self.update(change.entity, row)
+            moving = moving and change.created_at < settled
+            if moving:
+                self.cursor = change.id
+
+    def update(self, entity, row):
+        if self.catalog is not None:
+            self.catalog.add(entity, row)
+
+    def remove(self, entity, id):
+        if self.catalog is not None:
+            self.catalog.remove(entity, id)
+
+    def _ready(self):
+        '''
+        the catalog, caught up, or None while it is loading.
+        '''
+        if self.catalog is None:
+            self.load_in_background()
+            return None
+        self.catch_up()
+        return self.catalog
+
+    def suggest(self, entity, query, limit=10):
+        catalog = self._ready()
+        if catalog is None:
+            return []
+        threshold = current_app.config['FUZZY_SEARCH_THRESHOLD']
+        return [{"id": id, "name": name, "score": round(score, 3)}
+                for id, name, score in catalog.names(entity, query, limit, threshold)]
+
+    def search(self, query, limit=20, entity=None, genre=None, offset=0):
+        catalog = self._ready()
+        if catalog is None:
+            return self.substring_search(query, limit, entity, genre, offset)
+        return catalog.search(query, limit, current_app.config['FUZZY_SEARCH_THRESHOLD'],
+                              entity, genre, offset)
+
+    def substring_search(self, query, limit=20, entity=None, genre=None, offset=0):
+        '''
+        Catalog.search answered from the database while the catalog loads:
+        the venues and artists whose name contains "query", by name, with
+        the facet counts per type only.
+        '''
+        from sqlalchemy import select, func, literal
+        from extensions import db
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        results = {"count": 0, "data": [], "facets": {"type": {}, "genre": {}}}
+        found = []
+        for name, model in self._models().items():
+            condition = model.name.ilike('%' + escaped + '%', escape='\\')
+            # sharded, one count per shard
+            count = sum(db.session.scalars(select(func.count()).select_from(model).where(condition)))
+            if count:
+                results["facets"]["type"][name] = count
+            if entity not in (None, name):
+                continue
+            if genre is not None:
+                condition = condition & (literal(',') + model.genres + literal(',')).\
+                    contains(f",{genre},")
+                count = sum(db.session.scalars(select(func.count()).select_from(model).where(condition)))
+            results["count"] += count
+            found.extend((name, row) for row in db.session.execute(
+                select(model.id, model.name, model.city, model.state, model.genres).
+                where(condition).order_by(model.name).limit(offset + limit)))
+        found.sort(key=lambda item: item[1].name)
+        results["data"] = [{
+            "type": name,
+            "id": row.id,
+            "name": row.name,
+            "city": row.city,
+            "state": row.state,
+            "genres": [genre for genre in (row.genres or '').split(',') if genre],
+            "matched": 'name',
+            "score": None
+        } for name, row in found[offset:offset + limit]]
+        return results
+
+    def stats(self):
+        if self.catalog is None:
+            return {"loaded": False}
+        catalog = self.catalog
+        return {
+            "loaded": True,
+            "cursor": self.cursor,
+            "entries": len(catalog.index),
+            "rows": len(catalog),
+            "values": len(catalog.members),
+            "trigrams": len(catalog.index.postings),
+            "dead": catalog.index.dead,
+            "bytes": catalog.memory_usage()
+        }
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+search_cli = AppGroup('search', help='Manage the search index.')
+
+@search_cli.command('rebuild-index')
+def rebuild_index():
+  '''
+  build the search index from the database and save it to
+  SEARCH_INDEX_PATH, where workers load it instead of reading every venue
+  and artist at startup.
+  '''
+  from extensions import search_index
+  start = time.perf_counter()
+  catalog, cursor = search_index.build()
+  elapsed = time.perf_counter() - start
+  path = current_app.config['SEARCH_INDEX_PATH']
+  with open(path + '.tmp', 'wb') as snapshot:
+    pickle.dump((catalog, cursor), snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(path + '.tmp', path)
+  click.echo(f"{len(catalog)} venues and artists, {len(catalog.members)} cities, "
+             f"states and genres, {len(catalog.index.postings)} trigrams, "
+             f"{catalog.memory_usage() / 2**20:.1f} MiB")
+  click.echo(f"Built in {elapsed:.2f} s, saved to {path} (change cursor {cursor})")
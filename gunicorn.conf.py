@@ -0,0 +1,44 @@
+# Gunicorn settings for wsgi:application, see wsgi.py.
+import multiprocessing
+import os
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Import the app (and compile its templates) once in the master.
+preload_app = True
+
+# Recycle each worker after about MAX_REQUESTS requests, with jitter so the
+# workers do not all restart at the same time.
+max_requests = int(os.environ.get('MAX_REQUESTS', 1000))
+max_requests_jitter = max(max_requests // 10, 1)
+
+# Give in-flight requests this long to finish on SIGTERM / recycling.
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    from wsgi import warm_templates, reset_metrics
+    reset_metrics()
+    server.log.info('Compiled %d templates', warm_templates())
+
+
+def post_fork(server, worker):
+    from wsgi import warm_db_pool, warm_search_index
+    server.log.info('Worker %s opened %d DB connections', worker.pid, warm_db_pool())
+    server.log.info('Worker %s loaded %d venues and artists into the search index',
+                    worker.pid, warm_search_index())
+
+
+def worker_exit(server, worker):
+    from wsgi import close_db_pool, flush_metrics
+    flush_metrics()
+    close_db_pool()
+
+
+def child_exit(server, worker):
+    # in the master, for every worker that exits, even a killed one
+    from wsgi import retire_metrics
+    retire_metrics(worker.pid)
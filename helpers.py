@@ -0,0 +1,497 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import functools
+import hashlib
+import os
+import time
+from datetime import date, timedelta
+from flask import current_app, g, make_response, request
+from sqlalchemy import select, func
+from extensions import db
+
+# babel and dateutil are imported where they are used: they are slow to
+# import and most processes (CLI commands, workers booting) never need them.
+
+#----------------------------------------------------------------------------#
+# Filters.
+#----------------------------------------------------------------------------#
+
+def format_datetime(value, format='medium'):
+  import babel.dates
+  import dateutil.parser
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format, locale='en')
+
+#----------------------------------------------------------------------------#
+# Helper fuctions.
+#----------------------------------------------------------------------------#
+
+def search_statements(type, search_term, after=None, before=None,
+                      per_page=20, count_limit=1000):
+  '''
+  build the queries of one page of the search for "search_term" in the
+  names of "type": a count that stops after "count_limit" + 1 matches and
+  the (id, name) rows of the page after the id "after" (or before the id
+  "before"), one row more than "per_page" to tell if there is another page.
+  '''
+  escaped = search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+  condition = type.name.ilike("%" + escaped + "%", escape='\\')
+  capped = select(type.id).where(condition).limit(count_limit + 1).subquery()
+  count = select(func.count()).select_from(capped)
+  page = select(type.id, type.name).where(condition)
+  if before is not None:
+    page = page.where(type.id < before).order_by(type.id.desc())
+  else:
+    page = page.where(type.id > (after or 0)).order_by(type.id)
+  return count, page.limit(per_page + 1)
+
+def search_results(counts, rows, after=None, before=None, per_page=20,
+                   count_limit=1000):
+  '''
+  format the results of the statements built by search_statements(): the
+  "counts" and "rows" of every shard (see shards.py), which are added up
+  and merged. "next" and "prev" are the cursors of the neighbouring pages,
+  if any.
+  '''
+  count = sum(counts)
+  rows = sorted(rows, key=lambda row: row[0], reverse=before is not None)
+  more = len(rows) > per_page
+  rows = rows[:per_page]
+  if before is not None:
+    rows = rows[::-1]
+    has_prev, has_next = more, True
+  else:
+    has_prev, has_next = bool(after), more
+  return {
+    "count": min(count, count_limit),
+    "count_is_estimate": count > count_limit,
+    "data": [{"id": row[0], "name": row[1]} for row in rows],
+    "prev": rows[0][0] if rows and has_prev else None,
+    "next": rows[-1][0] if rows and has_next else None
+  }
+
+def search_options(config):
+  return dict(per_page=config['SEARCH_PAGE_SIZE'], count_limit=config['SEARCH_COUNT_LIMIT'])
+
+def search(type, search_term, after=None, before=None):
+  '''
+  a general implementation for the search functionality that takes
+  a "type" (in our case: Artist or Venue), search for the "search_term"
+  in the names of the objects of "type" and return one page of the
+  results with their count.
+  '''
+  options = search_options(current_app.config)
+  count, page = search_statements(type, search_term, after, before, **options)
+  return search_results(db.session.execute(count).scalars(), db.session.execute(page).all(),
+                        after, before, **options)
+
+def venue_areas(rows):
+  '''
+  the venues of the (city, state, id, name) "rows", grouped by area.
+  '''
+  areas = []
+  # sharded, an area may be in two shards until they are rebalanced
+  for city, state, id, name in sorted(rows, key=lambda row: (row[1], row[0], row[2])):
+    if not areas or (areas[-1]["city"], areas[-1]["state"]) != (city, state):
+      areas.append({
+        "city": city,
+        "state": state,
+        "venues": []
+      })
+    areas[-1]["venues"].append({
+      "id": id,
+      "name": name
+    })
+  return areas
+
+def calendar_window(view, day):
+  '''
+  the [first day, day after the last day) shown by the "day", "week" or
+  "month" view of the calendar around the date "day". A month is shown as
+  whole weeks, Monday to Sunday.
+  '''
+  if view == 'day':
+    return day, day + timedelta(days=1)
+  if view == 'week':
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=7)
+  first = day.replace(day=1)
+  last = (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+  return (first - timedelta(days=first.weekday()),
+          last + timedelta(days=7 - last.weekday()))
+
+def calendar_steps(view, day):
+  '''
+  the dates the "previous" and "next" links of a calendar view lead to.
+  '''
+  if view == 'day':
+    return day - timedelta(days=1), day + timedelta(days=1)
+  if view == 'week':
+    return day - timedelta(days=7), day + timedelta(days=7)
+  first = day.replace(day=1)
+  return (first - timedelta(days=1)).replace(day=1), \
+    (first + timedelta(days=31)).replace(day=1)
+
+def calendar_request(args):
+  '''
+  the view and the date a calendar request asks for, or None when they
+  are not valid.
+  '''
+  view = args.get('view', 'month')
+  if view not in ('day', 'week', 'month'):
+    return None
+  try:
+    return view, date.fromisoformat(args.get('date') or date.today().isoformat())
+  except ValueError:
+    return None
+
+def show_counts_statement(start, end):
+  from models import Show
+  day = func.substr(Show.start_time, 1, 10)
+  return select(day, func.count()).\
+    where(Show.start_time >= start.isoformat(), Show.start_time < end.isoformat()).\
+    group_by(day)
+
+def add_counts(rows):
+  counts = {}
+  # sharded, each shard counts its own shows
+  for day, count in rows:
+    counts[day] = counts.get(day, 0) + count
+  return counts
+
+def show_counts(start, end):
+  '''
+  the number of shows of each day in [start, end), as {"YYYY-MM-DD": count}.
+  One GROUP BY on a range of the start_time index: start times are stored
+  as "YYYY-MM-DD HH:MM:SS", so the day is their first 10 characters and
+  they sort as dates.
+  '''
+  return add_counts(db.session.execute(show_counts_statement(start, end)).all())
+
+def cached_show_counts(start, end):
+  '''
+  show_counts() through the entity cache backend. The key holds the newest
+  change log id, so any write makes the next lookup count again, in every
+  worker, without invalidating anything.
+  '''
+  from cache import RedisError
+  from changes import change_generation
+  from extensions import entity_cache, metrics
+  key = f"calendar:{start.isoformat()}:{end.isoformat()}:{change_generation()}"
+  backend = entity_cache.results
+  try:
+    counts = backend.get(key)
+  except (OSError, RedisError):
+    counts = None
+  metrics.count_cache('calendar', counts is not None)
+  if counts is None:
+    counts = show_counts(start, end)
+    try:
+      backend.set(key, counts)
+    except (OSError, RedisError):
+      pass
+  return counts
+
+def highlight(text, term):
+  '''
+  the "highlight" template filter: wrap every case-insensitive occurrence
+  of "term" in "text" in a <mark> tag, escaping everything else.
+  '''
+  from markupsafe import Markup, escape
+  if not term:
+    return escape(text)
+  lower_text, lower_term = text.lower(), term.lower()
+  parts = []
+  start = 0
+  index = lower_text.find(lower_term)
+  while index != -1:
+    parts.append(escape(text[start:index]))
+    parts.append(Markup('<mark>%s</mark>') % text[index:index + len(term)])
+    start = index + len(term)
+    index = lower_text.find(lower_term, start)
+  parts.append(escape(text[start:]))
+  return Markup('').join(parts)
+
+def calendar_shows_statement(start, end):
+  from models import Show
+  return select(Show.venue_id, Show.artist_id, Show.start_time).\
+    where(Show.start_time >= start.isoformat(), Show.start_time < end.isoformat())
+
+def format_shows(rows, venues, artists):
+  '''
+  the (venue id, artist id, start time) "rows" of shows as the templates
+  take them, with the names of their "venues" and the names and images of
+  their "artists" (see shards.lookup), by start time.
+  '''
+  shows = []
+  for venue_id, artist_id, start_time in sorted(rows, key=lambda row: row[2]):
+    if venue_id not in venues or artist_id not in artists:
+      continue
+    shows.append({
+      "venue_id": venue_id,
+      "venue_name": venues[venue_id][0],
+      "artist_id": artist_id,
+      "artist_name": artists[artist_id][0],
+      "artist_image_link": artists[artist_id][1],
+      "start_time": start_time
+    })
+  return shows
+
+def calendar_page(view, day, counts, shows):
+  '''
+  the arguments of the calendar template, from the "counts" of the days
+  and the "shows" listed (see format_shows).
+  '''
+  start, end = calendar_window(view, day)
+  by_day = {}
+  for show in shows:
+    by_day.setdefault(show["start_time"][:10], []).append(show)
+  previous, following = calendar_steps(view, day)
+  return dict(view=view, day=day, days=[start + timedelta(days=i)
+                                        for i in range((end - start).days)],
+              counts=counts, shows=by_day, previous=previous, following=following)
+
+#----------------------------------------------------------------------------#
+# Shared pages.
+#
+# The venue, artist and show pages are the same for every visitor, so
+# reverse proxies may keep them for PAGE_MAX_AGE seconds and browsers
+# revalidate them with an ETag. The layout leaves the flashed messages out
+# of these pages: script.js fetches them from /session when the flash
+# cookie says there are some.
+#----------------------------------------------------------------------------#
+
+@functools.lru_cache(maxsize=None)
+def templates_digest(folder):
+  '''
+  a digest of the templates in "folder", so a deploy changing them changes
+  the ETags too.
+  '''
+  digest = hashlib.sha1()
+  for root, directories, files in sorted(os.walk(folder)):
+    directories.sort()
+    for name in sorted(files):
+      with open(os.path.join(root, name), 'rb') as file:
+        digest.update(name.encode() + file.read())
+  return digest.hexdigest()[:12]
+
+def page_version(app):
+  return app.config.get('PAGE_VERSION') or \
+    templates_digest(os.path.join(app.root_path, app.template_folder))
+
+def page_etag_of(version, generation, max_age):
+  '''
+  the ETag of the shared pages: it changes with any write (the newest
+  change log id, "generation"), every "max_age" seconds since the pages
+  sort shows into past and upcoming ones, and with the templates.
+  '''
+  period = int(time.time() // max(max_age, 1))
+  return f"{version}-{generation}-{period}"
+
+def page_etag():
+  from changes import change_generation
+  return page_etag_of(page_version(current_app), change_generation(),
+                      current_app.config['PAGE_MAX_AGE'])
+
+def shared_headers(response, etag, max_age):
+  '''
+  the headers of a page shared by every visitor: browsers check with the
+  ETag, proxies keep the page for "max_age" seconds. Shared with
+  async_app.py.
+  '''
+  response.set_etag(etag, weak=True)
+  response.cache_control.public = True
+  response.cache_control.max_age = 0
+  response.cache_control.s_maxage = max_age
+  return response
+
+def private_headers(response):
+  '''
+  the headers of a page that may differ with the session cookie.
+  '''
+  response.cache_control.private = True
+  response.cache_control.no_cache = True
+  response.vary.add('Cookie')
+  return response
+
+def session_accessed():
+  # the session proxy marks the session accessed when it is merely looked
+  # at (Flask 3.1), so look at it from the request context
+  from flask.globals import request_ctx
+  current = getattr(request_ctx, '_session', None)
+  if current is None:
+    current = request_ctx.session
+  return current.accessed
+
+def shared_page(view):
+  '''
+  serve "view" as a page shared by every visitor, or 304 when the browser
+  has it already. The view must not touch the session: if it does, the
+  page is served as private.
+  '''
+  @functools.wraps(view)
+  def wrapper(*args, **kwargs):
+    etag = page_etag()
+    if request.if_none_match.contains_weak(etag):
+      response = make_response('', 304)
+    else:
+      g.shared_page = True
+      response = make_response(view(*args, **kwargs))
+      if response.status_code != 200:
+        return response
+    if session_accessed():
+      return private_headers(response)
+    return shared_headers(response, etag, current_app.config['PAGE_MAX_AGE'])
+  return wrapper
+
+#----------------------------------------------------------------------------#
+# Bulk creation.
+#----------------------------------------------------------------------------#
+
+# the unique constraints of the Venue and Artist tables (migration
+# 7f53e7f58143), checked before inserting a batch
+UNIQUE_COLUMNS = {
+  'Venue': ('address', 'phone', 'website', 'facebook_link'),
+  'Artist': ('phone', 'website', 'facebook_link')
+}
+
+def record_formdata(record):
+  '''
+  the form data a browser would post for the JSON object "record": lists
+  become repeated fields and false booleans are left out.
+  '''
+  from werkzeug.datastructures import MultiDict
+  formdata = MultiDict()
+  for name, value in record.items():
+    for item in value if isinstance(value, list) else [value]:
+      if item is None or item is False:
+        continue
+      formdata.add(name, 'y' if item is True else str(item))
+  return formdata
+
+def unique_conflicts(model, rows):
+  '''
+  the {index: {column: [error]}} of the "rows" ({index: row}) whose unique
+  values are taken, by a row of the table or an earlier row of the batch.
+  The table is read with a single query.
+  '''
+  from sqlalchemy import or_
+  unique = UNIQUE_COLUMNS[model.__tablename__]
+  conditions = []
+  for name in unique:
+    values = {row[name] for row in rows.values() if row[name] is not None}
+    if values:
+      conditions.append(getattr(model, name).in_(values))
+  taken = {name: set() for name in unique}
+  if conditions:
+    for existing in db.session.query(*[getattr(model, name) for name in unique]).\
+        filter(or_(*conditions)):
+      for name, value in zip(unique, existing):
+        taken[name].add(value)
+
+  conflicts = {}
+  seen = {name: {} for name in unique}
+  for index, row in rows.items():
+    errors = {}
+    for name in unique:
+      value = row[name]
+      if value is None:
+        continue
+      if value in taken[name]:
+        errors[name] = ['Already taken.']
+      elif value in seen[name]:
+        errors[name] = [f"Same as record {seen[name][value]}."]
+    if errors:
+      conflicts[index] = errors
+      continue
+    for name in unique:
+      if row[name] is not None:
+        seen[name][row[name]] = index
+  return conflicts
+
+def bulk_create(model, form_class, records):
+  '''
+  validate the JSON objects "records" with the rules of "form_class" and
+  insert the valid ones in one transaction, with a single multi-row
+  INSERT ... RETURNING. Returns the (number created, result per record).
+  '''
+  from changes import record_change
+  from documents import refresh_documents
+  from shards import insert_rows
+  from extensions import images, search_index
+  entity = model.__tablename__.lower()
+  unique = UNIQUE_COLUMNS[model.__tablename__]
+  results = [None] * len(records)
+  rows = {}
+  for index, record in enumerate(records):
+    if not isinstance(record, dict):
+      results[index] = {"index": index, "status": "invalid",
+                        "errors": {"record": ['Not an object.']}}
+      continue
+    form = form_class(formdata=record_formdata(record), meta={'csrf': False})
+    # a browser posts the text fields left empty too
+    for field in form:
+      if field.type == 'StringField' and field.data is None:
+        field.data = ''
+    if not form.validate():
+      results[index] = {"index": index, "status": "invalid", "errors": form.errors}
+      continue
+    row = {column.name: form[column.name].data
+           for column in model.__table__.columns if column.name in form}
+    row['genres'] = ','.join(form.genres.data)
+    # a blank value is no value: it must not collide with the other blanks
+    for name in unique:
+      row[name] = row[name] or None
+    rows[index] = row
+
+  for index, errors in unique_conflicts(model, rows).items():
+    results[index] = {"index": index, "status": "conflict", "errors": errors}
+    del rows[index]
+  if not rows:
+    return 0, results
+
+  indexes = list(rows)
+  ids = insert_rows(model, [rows[index] for index in indexes])
+  created = []
+  for index, id in zip(indexes, ids):
+    # not added to the session: the row is inserted already
+    obj = model(id=id, **rows[index])
+    record_change('create', obj)
+    images.warm_later(obj.image_link)
+    results[index] = {"index": index, "status": "created", "id": id}
+    created.append(obj)
+  refresh_documents({entity: ids})
+  db.session.commit()
+  for obj in created:
+    search_index.update(entity, obj)
+  return len(created), results
+
+def bulk_response(model, form_class):
+  '''
+  the JSON response of a bulk create endpoint: 201 when every record was
+  created, 200 when some were, 422 when none was.
+  '''
+  from flask import request, jsonify, abort
+  from sqlalchemy.exc import IntegrityError
+  records = request.get_json(silent=True)
+  if not isinstance(records, list):
+    abort(400)
+  if len(records) > current_app.config['BULK_MAX_RECORDS']:
+    abort(413)
+  try:
+    created, results = bulk_create(model, form_class, records)
+  except IntegrityError:
+    # a concurrent write took a value after the check
+    db.session.rollback()
+    return jsonify({"error": "A unique value was taken meanwhile, nothing was "
+                             "created. Retry the request."}), 409
+  finally:
+    db.session.close()
+  status = 201 if created == len(records) else 200 if created else 422
+  return jsonify({"created": created, "results": results}), status
@@ -0,0 +1,417 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import base64
+import hashlib
+import hmac
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import ssl
+import threading
+import urllib.request
+from urllib.parse import urlparse
+from flask import Blueprint, current_app, abort, redirect, send_file, url_for
+
+blueprint = Blueprint('images', __name__)
+
+#----------------------------------------------------------------------------#
+# Image proxy.
+#
+# Pages link to /images/<size>/<signature>/<source>.webp instead of the
+# image_link of venues and artists. The first request for an image fetches
+# it, scales it down to one of IMAGE_SIZES and encodes it to WebP; the
+# result is kept in a size-bounded cache on disk shared by the workers, and
+# since the URL names the source and the size, browsers and proxies may
+# keep it forever. The signature restricts the proxy to the images the app
+# links to.
+#----------------------------------------------------------------------------#
+
+class FetchError(Exception):
+    pass
+
+
+def public_addresses(host, port):
+  '''
+  the addresses "host" resolves to, refused unless they are all public.
+  '''
+  try:
+    addresses = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+  except (OSError, UnicodeError) as error:
+    raise FetchError(str(error))
+  for *_, address in addresses:
+    ip = ipaddress.ip_address(address[0].split('%')[0])
+    if not ip.is_global:
+      raise FetchError(f"{host} is not a public host")
+  return [address[0] for *_, address in addresses]
+
+def connect_public(host, port, timeout, source_address):
+  '''
+  a socket connected to one of the checked addresses of "host". Connecting
+  to the address that was checked, rather than resolving the name again,
+  leaves no room for the name to point elsewhere in between.
+  '''
+  error = None
+  for address in public_addresses(host, port):
+    try:
+      return socket.create_connection((address, port), timeout, source_address)
+    except OSError as failure:
+      error = failure
+  raise error
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        self.sock = connect_public(self.host, self.port, self.timeout,
+                                   self.source_address)
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host, context, **kwargs):
+        super().__init__(host, context=context, **kwargs)
+        self.public_context = context
+
+    def connect(self):
+        sock = connect_public(self.host, self.port, self.timeout, self.source_address)
+        # the certificate is still checked against the host name
+        self.sock = self.public_context.wrap_socket(sock, server_hostname=self.host)
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self):
+        super().__init__()
+        self.public_context = ssl.create_default_context()
+
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self.public_context)
+
+
+class HTTPFetcher:
+    '''
+    fetches http(s) URLs, refusing hosts on private networks (the links
+    are user input) and bodies over "max_bytes". Environment proxies are
+    ignored: they would resolve the hosts themselves.
+    '''
+
+    def __init__(self, timeout=5, max_bytes=10 * 1024 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        fetcher = self
+
+        class CheckedRedirects(urllib.request.HTTPRedirectHandler):
+            def redirect_request(self, req, fp, code, msg, headers, newurl):
+                fetcher.check(newurl)
+                return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+        self.opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler({}), PublicHTTPHandler, PublicHTTPSHandler,
+            CheckedRedirects)
+
+    def check(self, url):
+        '''
+        the hosts themselves are checked when connecting to them.
+        '''
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise FetchError(f"unsupported URL: {url}")
+
+    def fetch(self, url):
+        self.check(url)
+        request = urllib.request.Request(url, headers={'User-Agent': 'fyyur-images'})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                data = response.read(self.max_bytes + 1)
+        except (OSError, ValueError) as error:
+            raise FetchError(str(error))
+        if len(data) > self.max_bytes:
+            raise FetchError(f"{url} is larger than {self.max_bytes} bytes")
+        return data
+
+
+class FileFetcher:
+    '''
+    serves the URLs from a local mirror: http://host/path is read from
+    <root>/host/path. For development and tests, without the network.
+    '''
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def fetch(self, url):
+        parsed = urlparse(url)
+        path = os.path.abspath(os.path.join(self.root, parsed.hostname or '',
+                                            parsed.path.lstrip('/')))
+        if not path.startswith(self.root + os.sep):
+            raise FetchError(f"{url} is outside of {self.root}")
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except OSError as error:
+            raise FetchError(str(error))
+
+
+def fetcher_from_config(config):
+  '''
+  build the fetcher selected by "IMAGE_FETCHER".
+  '''
+  kind = config.get('IMAGE_FETCHER', 'http')
+  if kind == 'http':
+    return HTTPFetcher(timeout=config.get('IMAGE_FETCH_TIMEOUT', 5),
+                       max_bytes=config.get('IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+  if kind == 'file':
+    return FileFetcher(config['IMAGE_FETCHER_ROOT'])
+  raise ValueError('Unknown IMAGE_FETCHER: ' + kind)
+
+#----------------------------------------------------------------------------#
+# Disk cache.
+#----------------------------------------------------------------------------#
+
+class DiskLRU:
+    '''
+    files in "directory" totalling at most about "max_bytes". A hit bumps
+    the modification time of its file, and once the files outgrow the
+    limit the least recently used ones are removed until they fill 90% of
+    it. Every worker writes to the same directory, so the size is counted
+    again from the directory before evicting.
+    '''
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # bytes written since the directory was last counted
+        self._estimate = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def set(self, key, data):
+        path = self.path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+        with self._lock:
+            if self._estimate is None:
+                self._estimate = self.size()
+            else:
+                self._estimate += len(data)
+            if self._estimate > self.max_bytes:
+                self._estimate = self.evict()
+        return path
+
+    def entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        '''
+        remove the least recently used files down to 90% of the limit and
+        return the size left.
+        '''
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+#----------------------------------------------------------------------------#
+# Thumbnails.
+#----------------------------------------------------------------------------#
+
+def thumbnail(data, box, quality):
+  '''
+  "data" scaled down to fit in "box" (width, height) and encoded to WebP.
+  Pillow is only needed here, so it is imported here.
+  '''
+  from PIL import Image, ImageOps
+  try:
+    image = Image.open(io.BytesIO(data))
+    # let the JPEG decoder skip what the thumbnail does not need
+    image.draft('RGB', box)
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(box)
+  except (OSError, ValueError, Image.DecompressionBombError) as error:
+    raise FetchError(f"not an image: {error}")
+  if image.mode not in ('RGB', 'RGBA'):
+    image = image.convert('RGBA' if 'transparency' in image.info or
+                          image.mode in ('LA', 'PA') else 'RGB')
+  output = io.BytesIO()
+  image.save(output, 'WEBP', quality=quality, method=4)
+  return output.getvalue()
+
+#----------------------------------------------------------------------------#
+# Extension.
+#----------------------------------------------------------------------------#
+
+def encode_source(url):
+  return base64.urlsafe_b64encode(url.encode('utf-8')).rstrip(b'=').decode()
+
+def decode_source(source):
+  return base64.urlsafe_b64decode(source + '=' * (-len(source) % 4)).decode('utf-8')
+
+class ImageProxy:
+    '''
+    signs image URLs for the templates and serves the thumbnails. Without
+    Pillow, or with IMAGE_PROXY off, the templates keep linking to the
+    original images. The proxy needs IMAGE_PROXY_KEY: the URLs must not be
+    signed with a key that also signs the sessions.
+    '''
+
+    def __init__(self, app=None):
+        self.fetcher = None
+        self.cache = None
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.configure(app.config, url_for, app.logger)
+        app.jinja_env.filters['image'] = self.url
+        app.register_blueprint(blueprint)
+        app.extensions['images'] = self
+
+    def configure(self, config, url_for, logger):
+        '''
+        the setup shared with async_app, which has its own url_for.
+        '''
+        import importlib.util
+        self.enabled = config.get('IMAGE_PROXY', True) and \
+            importlib.util.find_spec('PIL') is not None
+        key = config.get('IMAGE_PROXY_KEY')
+        if self.enabled and not key:
+            logger.warning('No IMAGE_PROXY_KEY: the pages link to the original images.')
+            self.enabled = False
+        self.key = key.encode() if isinstance(key, str) else key
+        self.sizes = config['IMAGE_SIZES']
+        self.quality = config['IMAGE_QUALITY']
+        self.url_for = url_for
+        self.fetcher = fetcher_from_config(config)
+        self.cache = DiskLRU(config['IMAGE_CACHE_DIR'], config['IMAGE_CACHE_MAX_BYTES'])
+
+    def signature(self, size, url):
+        digest = hmac.new(self.key, f"{size}:{url}".encode('utf-8'),
+                          hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:16]).rstrip(b'=').decode()
+
+    def url(self, link, size='tile'):
+        '''
+        the proxied URL of the image at "link" in "size", for templates:
+        {{ venue.image_link|image('page') }}
+        '''
+        if not link or not self.enabled or size not in self.sizes:
+            return link or ''
+        return self.url_for('images.image', size=size, signature=self.signature(size, link),
+                            source=encode_source(link))
+
+    def source(self, size, signature, source):
+        '''
+        the image URL an /images/ request names, None unless it was signed.
+        '''
+        if size not in self.sizes or not self.enabled:
+            return None
+        try:
+            url = decode_source(source)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if not hmac.compare_digest(signature, self.signature(size, url)):
+            return None
+        return url
+
+    def warm_later(self, link):
+        '''
+        enqueue a job making the thumbnails of "link", in the current
+        transaction, so the first page showing it does not wait for them.
+        '''
+        if link and self.enabled:
+            from jobs import enqueue
+            key = 'images.warm:' + hashlib.sha256(link.encode('utf-8')).hexdigest()
+            enqueue('images.warm', {'url': link}, key=key)
+
+    def serve(self, size, signature, source, logger):
+        '''
+        the (url, path) of the thumbnail an /images/ request names: url is
+        None unless the request was signed, path is None when the image
+        could not be fetched, and the page gets the original one instead.
+        '''
+        url = self.source(size, signature, source)
+        if url is None:
+            return None, None
+        try:
+            return url, self.thumbnail(size, url)
+        except FetchError as error:
+            logger.warning('image proxy: %s', error)
+            return url, None
+
+    def thumbnail(self, size, url):
+        '''
+        the path of the cached thumbnail of "url" in "size", made on a miss.
+        '''
+        from extensions import metrics
+        key = hashlib.sha256(f"{size}:{url}".encode('utf-8')).hexdigest() + '.webp'
+        path = self.cache.get(key)
+        metrics.count_cache('images', path is not None)
+        if path is None:
+            data = thumbnail(self.fetcher.fetch(url), self.sizes[size], self.quality)
+            path = self.cache.set(key, data)
+        return path
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+# the URL of a thumbnail names its source and size, so it never changes
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
+def immutable_headers(response):
+  response.cache_control.public = True
+  response.cache_control.immutable = True
+  return response
+
+@blueprint.route('/images/<size>/<signature>/<source>.webp')
+def image(size, signature, source):
+  url, path = current_app.extensions['images'].serve(size, signature, source,
+                                                     current_app.logger)
+  if url is None:
+    abort(404)
+  if path is None:
+    # no worse than before the proxy
+    return redirect(url)
+  # hits bump the modification time, so the ETag is the cache key instead
+  response = send_file(path, mimetype='image/webp', conditional=True,
+                       etag=os.path.basename(path), max_age=IMAGE_MAX_AGE)
+  return immutable_headers(response)
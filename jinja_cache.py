@@ -0,0 +1,66 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import os
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache, MemcachedBytecodeCache
+
+#----------------------------------------------------------------------------#
+# Template bytecode cache.
+#
+# Jinja compiles a template to Python bytecode the first time it is
+# rendered, in every worker. With a bytecode cache the compiled code is
+# stored once (on disk or in a shared Redis-protocol server) and every
+# worker, and every restart, loads it instead of compiling again.
+#----------------------------------------------------------------------------#
+
+def bytecode_cache_from_config(config):
+  '''
+  build the bytecode cache selected by "TEMPLATE_CACHE_TYPE", or return
+  None when it is disabled.
+  '''
+  cache_type = config.get('TEMPLATE_CACHE_TYPE')
+  if cache_type == 'filesystem':
+    directory = config['TEMPLATE_CACHE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory)
+  if cache_type == 'redis':
+    from cache import RedisClient
+    return MemcachedBytecodeCache(RedisClient(config['CACHE_REDIS_URL']),
+                                  prefix=config.get('CACHE_KEY_PREFIX', '') + 'jinja:',
+                                  ignore_memcache_errors=True)
+  if cache_type:
+    raise ValueError('Unknown TEMPLATE_CACHE_TYPE: ' + cache_type)
+  return None
+
+def init_app(app):
+  app.jinja_env.bytecode_cache = bytecode_cache_from_config(app.config)
+  app.cli.add_command(templates_cli)
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+templates_cli = AppGroup('templates', help='Manage the compiled templates.')
+
+@templates_cli.command('precompile')
+@click.option('--clear', is_flag=True, help='Drop the cached bytecode first.')
+def precompile(clear):
+  '''
+  compile every template into the bytecode cache, e.g. at build time.
+  '''
+  env = current_app.jinja_env
+  if env.bytecode_cache is None:
+    raise click.ClickException('TEMPLATE_CACHE_TYPE is not set, nothing to fill.')
+  if clear:
+    env.bytecode_cache.clear()
+  names = env.list_templates(extensions=['html'])
+  start = time.perf_counter()
+  for name in names:
+    env.get_template(name)
+  click.echo(f"Compiled {len(names)} templates in "
+             f"{(time.perf_counter() - start) * 1000:.1f} ms")
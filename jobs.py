@@ -0,0 +1,327 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import json
+import os
+import random
+import signal
+import socket
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, or_, and_, update, delete
+from sqlalchemy.exc import IntegrityError
+
+#----------------------------------------------------------------------------#
+# Background jobs.
+#
+# Handlers call enqueue() before they commit, so a job is queued in the same
+# transaction as the write that needs it, and return at once. "flask jobs
+# work" claims the due jobs and runs them in a pool of processes; a job
+# that raises is retried with exponential backoff until it runs out of
+# attempts. Jobs must tolerate running twice: a worker that dies after
+# running one but before recording it leaves it to be claimed again once
+# JOB_LEASE seconds have passed.
+#
+# The workers also enqueue the periodic jobs of JOB_SCHEDULE, keyed by
+# their period so that only one of them gets in, and the finished jobs
+# are deleted once they are JOB_RETENTION seconds old.
+#----------------------------------------------------------------------------#
+
+TASKS = {}
+
+def task(name):
+  '''
+  register the decorated function as the job "name". Its payload is
+  passed as keyword arguments.
+  '''
+  def decorator(function):
+    TASKS[name] = function
+    return function
+  return decorator
+
+def enqueue(name, payload=None, key=None, delay=0, max_attempts=None):
+  '''
+  add the job "name" to the current transaction. With a "key", a job
+  already enqueued under that key (whatever its status, until it is
+  pruned) is returned instead of adding another one.
+  '''
+  from extensions import db
+  from models import Job
+  if key is not None:
+    existing = Job.query.filter_by(key=key).first()
+    if existing is not None:
+      return existing
+  now = datetime.utcnow()
+  job = Job(name=name, payload=json.dumps(payload or {}), key=key,
+            status='queued', attempts=0,
+            max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'],
+            run_at=now + timedelta(seconds=delay), created_at=now)
+  if key is None:
+    db.session.add(job)
+    return job
+  # another transaction may insert the key after the lookup: the insert
+  # then fails in its savepoint, without rolling back the caller's writes
+  try:
+    with db.session.begin_nested():
+      db.session.add(job)
+  except IntegrityError:
+    return Job.query.filter_by(key=key).one()
+  return job
+
+def backoff(attempts):
+  '''
+  the delay before retrying a job that failed "attempts" times: doubling
+  from JOB_BACKOFF, up to JOB_BACKOFF_MAX, with jitter so the jobs failed
+  by one outage do not all come back at once.
+  '''
+  config = current_app.config
+  delay = min(config['JOB_BACKOFF_MAX'], config['JOB_BACKOFF'] * 2 ** (attempts - 1))
+  return delay * random.uniform(0.5, 1)
+
+#----------------------------------------------------------------------------#
+# Queue.
+#----------------------------------------------------------------------------#
+
+def claimable(now):
+  from models import Job
+  lease = timedelta(seconds=current_app.config['JOB_LEASE'])
+  return or_(and_(Job.status == 'queued', Job.run_at <= now),
+             # the worker running it died
+             and_(Job.status == 'running', Job.locked_at < now - lease))
+
+def claim(limit, worker):
+  '''
+  mark up to "limit" due jobs as running for "worker" and return them as
+  (id, name, payload, run_at) tuples. Postgres skips the rows another
+  worker is claiming; elsewhere a claim only succeeds if the job is still
+  claimable when it is updated.
+  '''
+  from extensions import db
+  from models import Job
+  now = datetime.utcnow()
+  candidates = db.session.query(Job.id, Job.name, Job.payload, Job.run_at).\
+    filter(claimable(now)).order_by(Job.run_at).limit(limit).\
+    with_for_update(skip_locked=True).all()
+  claimed = []
+  for id, name, payload, run_at in candidates:
+    result = db.session.execute(
+      update(Job).where(Job.id == id, claimable(now)).
+      values(status='running', locked_by=worker, locked_at=now,
+             attempts=Job.attempts + 1))
+    if result.rowcount:
+      claimed.append((id, name, json.loads(payload), run_at))
+  db.session.commit()
+  return claimed
+
+def finish(id, error=None):
+  '''
+  record the outcome of a run: done, queued again after a backoff, or
+  failed for good. Returns which.
+  '''
+  from extensions import db
+  from models import Job
+  job = db.session.get(Job, id)
+  now = datetime.utcnow()
+  job.locked_by = job.locked_at = None
+  if error is None:
+    job.status, job.finished_at, job.error = 'done', now, None
+  elif job.attempts < job.max_attempts:
+    job.status, job.error = 'queued', error
+    job.run_at = now + timedelta(seconds=backoff(job.attempts))
+  else:
+    job.status, job.finished_at, job.error = 'failed', now, error
+  result = 'retry' if job.status == 'queued' else job.status
+  db.session.commit()
+  return result
+
+def schedule(enqueued):
+  '''
+  enqueue the JOB_SCHEDULE jobs whose period began since this worker last
+  did; "enqueued" maps their names to that period. The key names the
+  period, so the other workers enqueue the same job.
+  '''
+  from extensions import db
+  now = time.time()
+  due = {name: int(now // seconds)
+         for name, seconds in current_app.config['JOB_SCHEDULE'].items()
+         if enqueued.get(name) != int(now // seconds)}
+  for name, period in due.items():
+    enqueue(name, key=f"schedule:{name}:{period}")
+  if due:
+    db.session.commit()
+    enqueued.update(due)
+
+def prune():
+  '''
+  delete the jobs done or failed more than JOB_RETENTION seconds ago.
+  Returns how many.
+  '''
+  from extensions import db
+  from models import Job
+  before = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_RETENTION'])
+  result = db.session.execute(
+    delete(Job).where(Job.status.in_(('done', 'failed')), Job.finished_at < before))
+  db.session.commit()
+  return result.rowcount
+
+def queue_gauges():
+  '''
+  the depth of the queue, for /metrics.
+  '''
+  from extensions import db
+  from models import Job
+  now = datetime.utcnow()
+  due = and_(Job.status == 'queued', Job.run_at <= now)
+  status = db.case((due, 'due'), (Job.status == 'queued', 'delayed'),
+                   else_=Job.status)
+  counts = dict(db.session.query(status, func.count()).
+                filter(Job.status != 'done').group_by(status).all())
+  oldest = db.session.query(func.min(Job.run_at)).filter(due).scalar()
+  gauges = [['fyyur_job_queue_depth', [['status', name]], counts.get(name, 0)]
+            for name in ('due', 'delayed', 'running', 'failed')]
+  gauges.append(['fyyur_job_oldest_due_seconds', [],
+                 (now - oldest).total_seconds() if oldest else 0])
+  return gauges
+
+def queue_stats():
+  from extensions import db
+  from models import Job
+  return dict(db.session.query(Job.status, func.count()).group_by(Job.status).all())
+
+#----------------------------------------------------------------------------#
+# Worker.
+#
+# The pool processes only run the task functions, each with its own app;
+# claiming and recording the outcomes happens in the parent.
+#----------------------------------------------------------------------------#
+
+worker_app = None
+
+def start_pool_process():
+  global worker_app
+  from app import create_app
+  import tasks
+  worker_app = create_app()
+
+def run_task(name, payload):
+  '''
+  run a job in a pool process. Returns the error, or None.
+  '''
+  from extensions import db
+  with worker_app.app_context():
+    try:
+      TASKS[name](**payload)
+    except Exception:
+      db.session.rollback()
+      return traceback.format_exc(limit=5)
+  return None
+
+def work(processes, burst, poll):
+  '''
+  claim and run jobs until SIGTERM or SIGINT, or until the queue is empty
+  when "burst" is set. Returns the number of jobs run.
+  '''
+  from extensions import metrics
+  import metrics as metrics_files
+  directory = current_app.config.get('METRICS_DIR')
+  worker = f"{socket.gethostname()}:{os.getpid()}"
+  stopping = []
+  previous = {number: signal.signal(number, lambda *_: stopping.append(number))
+              for number in (signal.SIGTERM, signal.SIGINT)}
+  pool = ProcessPoolExecutor(processes, initializer=start_pool_process)
+  running = {}
+  enqueued = {}
+  count = 0
+  try:
+    while running or not stopping:
+      if not stopping:
+        schedule(enqueued)
+      if not stopping and len(running) < processes:
+        for id, name, payload, run_at in claim(processes - len(running), worker):
+          started = time.perf_counter()
+          metrics.observe('fyyur_job_wait_seconds',
+                          max((datetime.utcnow() - run_at).total_seconds(), 0),
+                          (('name', name),))
+          running[pool.submit(run_task, name, payload)] = (id, name, started)
+      if not running:
+        if burst:
+          break
+        time.sleep(poll)
+      else:
+        done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+        for future in done:
+          id, name, started = running.pop(future)
+          try:
+            error = future.result()
+          except BrokenProcessPool:
+            error = 'the worker process died'
+          result = finish(id, error)
+          count += 1
+          labels = (('name', name),)
+          metrics.inc('fyyur_jobs_total', labels + (('result', result),))
+          metrics.observe('fyyur_job_duration_seconds',
+                          time.perf_counter() - started, labels)
+          if error:
+            current_app.logger.warning('job %s (%s) %s: %s', id, name, result,
+                                       error.strip().splitlines()[-1])
+        if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+          # the other jobs of the broken pool fail the same way
+          pool.shutdown(wait=False, cancel_futures=True)
+          pool = ProcessPoolExecutor(processes, initializer=start_pool_process)
+      if directory and time.monotonic() - metrics.flushed_at > \
+         current_app.config['METRICS_FLUSH_INTERVAL']:
+        metrics.flush(directory)
+  finally:
+    pool.shutdown(wait=True)
+    for number, handler in previous.items():
+      signal.signal(number, handler)
+    if directory:
+      metrics.flush(directory)
+      metrics_files.retire(directory, os.getpid())
+  return count
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+jobs_cli = AppGroup('jobs', help='Run and inspect the background jobs.')
+
+@jobs_cli.command('work')
+@click.option('--processes', '-p', type=int, default=None,
+              help='Jobs run at once (JOB_PROCESSES by default).')
+@click.option('--burst', is_flag=True, help='Stop once the queue is empty.')
+@click.option('--poll', type=float, default=1.0,
+              help='Seconds between looks at an empty queue.')
+def work_command(processes, burst, poll):
+  '''
+  run the queued jobs in a pool of processes.
+  '''
+  processes = processes or current_app.config['JOB_PROCESSES']
+  click.echo(f"Ran {work(processes, burst, poll)} jobs.")
+
+@jobs_cli.command('stats')
+def stats_command():
+  '''
+  print the number of jobs in each status.
+  '''
+  for status, count in sorted(queue_stats().items()):
+    click.echo(f"{status}: {count}")
+
+@jobs_cli.command('prune')
+def prune_command():
+  '''
+  delete the finished jobs older than JOB_RETENTION.
+  '''
+  click.echo(f"Deleted {prune()} jobs.")
+
+def init_app(app):
+  from extensions import metrics
+  app.cli.add_command(jobs_cli)
+  metrics.on_scrape(queue_gauges)
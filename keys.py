@@ -0,0 +1,105 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import functools
+import hmac
+import os
+import secrets
+import click
+from flask import current_app, request, abort
+from flask.cli import AppGroup
+
+#----------------------------------------------------------------------------#
+# Secret keys.
+#
+# The sessions (and so the flashed messages) and the CSRF tokens are
+# signed with SECRET_KEY: every worker of every node must use the same one.
+# The keys come from SECRET_KEY_FILE, one per line, or from SECRET_KEYS,
+# comma separated; the first is the current key and the others, previous
+# keys, are still accepted so that rotating the key does not log anybody
+# out or break the forms they have open.
+#----------------------------------------------------------------------------#
+
+def read_keys(config):
+  '''
+  the secret keys from SECRET_KEY_FILE or SECRET_KEYS, current first.
+  '''
+  path = config.get('SECRET_KEY_FILE')
+  if path:
+    with open(path) as file:
+      lines = file.read().splitlines()
+  else:
+    lines = (config.get('SECRET_KEYS') or '').split(',')
+  return [line.strip() for line in lines
+          if line.strip() and not line.lstrip().startswith('#')]
+
+def init_app(app):
+  keys = read_keys(app.config)
+  if keys:
+    app.config['SECRET_KEY'] = keys[0]
+    app.config['SECRET_KEY_FALLBACKS'] = keys[1:]
+  elif not app.debug and not app.testing:
+    app.logger.warning('No SECRET_KEY_FILE or SECRET_KEYS: sessions and CSRF '
+                       'tokens only work within one worker process.')
+  # Flask checks sessions against SECRET_KEY_FALLBACKS, Flask-WTF does not:
+  # it takes a list of keys, oldest first, as its own secret instead
+  fallbacks = app.config.get('SECRET_KEY_FALLBACKS')
+  if fallbacks and not app.config.get('WTF_CSRF_SECRET_KEY'):
+    app.config['WTF_CSRF_SECRET_KEY'] = [*reversed(fallbacks), app.config['SECRET_KEY']]
+  app.cli.add_command(keys_cli)
+
+#----------------------------------------------------------------------------#
+# Admin token.
+#
+# The exports, the stats and the metrics are served to the holders of
+# ADMIN_TOKEN, as "Authorization: Bearer <token>". Without a token they do
+# not exist.
+#----------------------------------------------------------------------------#
+
+def admin_only(view):
+  @functools.wraps(view)
+  def wrapper(*args, **kwargs):
+    token = current_app.config.get('ADMIN_TOKEN')
+    if not token:
+      abort(404)
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+      abort(403)
+    return view(*args, **kwargs)
+  return wrapper
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+keys_cli = AppGroup('keys', help='Manage the secret keys.')
+
+@keys_cli.command('generate')
+def generate():
+  '''
+  print a new random key.
+  '''
+  click.echo(secrets.token_urlsafe(32))
+
+@keys_cli.command('rotate')
+@click.argument('path', type=click.Path(dir_okay=False), required=False)
+@click.option('--keep', default=2, show_default=True,
+              help='Previous keys still accepted.')
+def rotate(path, keep):
+  '''
+  make a new current key in the key file (SECRET_KEY_FILE by default),
+  keeping the previous ones. Restart the workers to use it.
+  '''
+  path = path or current_app.config.get('SECRET_KEY_FILE')
+  if not path:
+    raise click.ClickException('No key file: pass one or set SECRET_KEY_FILE.')
+  keys = read_keys({'SECRET_KEY_FILE': path}) if os.path.exists(path) else []
+  keys = [secrets.token_urlsafe(32)] + keys[:keep]
+  temporary = path + '.tmp'
+  # readable by the owner only, from the first byte
+  descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+  with os.fdopen(descriptor, 'w') as file:
+    file.write('\n'.join(keys) + '\n')
+  os.replace(temporary, path)
+  click.echo(f"Wrote a new key to {path}, keeping {len(keys) - 1} previous keys.")
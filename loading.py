@@ -0,0 +1,105 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import functools
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, raiseload
+
+#----------------------------------------------------------------------------#
+# Loading profiles.
+#
+# A view that follows relationships declares how they are loaded with
+# @loading_profile, e.g. selectinload(Show.venue) for the shows listing,
+# and the options are added to the ORM queries of the request that select
+# the model. With QUERY_CHECKS on (by default in debug and testing) every
+# other relationship raises instead of loading lazily, and a request that
+# runs the same statement QUERY_REPEAT_THRESHOLD times or more (an N+1
+# query, usually) is logged, counted in /metrics and flagged with an
+# X-Repeated-Queries header.
+#----------------------------------------------------------------------------#
+
+def loading_profile(profile):
+  '''
+  declare the loader options of a view: {model: (options, ...)}.
+  selectinload is safe with shards (see shards.py); joinedload only when
+  both sides live in the same database.
+  '''
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+      g.loading_profile = profile
+      return view(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def checks_enabled(app):
+  enabled = app.config.get('QUERY_CHECKS')
+  return app.debug or app.testing if enabled is None else enabled
+
+def selected_models(statement):
+  '''
+  the models a select loads whole objects of.
+  '''
+  return [description['entity'] for description in statement.column_descriptions
+          if description.get('entity') is not None and
+          description.get('expr') is description['entity']]
+
+def apply_profile(orm_context):
+  if not has_request_context() or not orm_context.is_select or \
+     orm_context.is_column_load or orm_context.is_relationship_load:
+    return
+  models = selected_models(orm_context.statement)
+  if not models:
+    return
+  profile = g.get('loading_profile') or {}
+  options = [option for model in models for option in profile.get(model, ())]
+  if g.get('query_counts') is not None:
+    # whatever the profile does not load must not be loaded later
+    options.append(raiseload('*'))
+  if options:
+    orm_context.statement = orm_context.statement.options(*options)
+
+#----------------------------------------------------------------------------#
+# Repeated queries.
+#----------------------------------------------------------------------------#
+
+def count_query(connection, cursor, statement, parameters, context, executemany):
+  if has_request_context():
+    counts = g.get('query_counts')
+    if counts is not None:
+      counts[statement] += 1
+
+def start_counting():
+  if checks_enabled(current_app):
+    g.query_counts = Counter()
+
+def report_repeats(response):
+  counts = g.pop('query_counts', None)
+  if not counts:
+    return response
+  threshold = current_app.config['QUERY_REPEAT_THRESHOLD']
+  repeated = {statement: count for statement, count in counts.items()
+              if count >= threshold}
+  if repeated:
+    from extensions import metrics
+    metrics.inc('fyyur_repeated_queries_total', (('endpoint', request.endpoint or ''),))
+    for statement, count in repeated.items():
+      current_app.logger.warning('%s ran %d times in %s: %s', request.endpoint, count,
+                                 request.path, ' '.join(statement.split())[:200])
+    response.headers['X-Repeated-Queries'] = str(len(repeated))
+  return response
+
+def init_app(app):
+  # on every session and engine: the sharded session and the engines of
+  # the binds are created after this
+  if not event.contains(Session, 'do_orm_execute', apply_profile):
+    event.listen(Session, 'do_orm_execute', apply_profile)
+  if checks_enabled(app) and \
+     not event.contains(Engine, 'before_cursor_execute', count_query):
+    event.listen(Engine, 'before_cursor_execute', count_query)
+  app.before_request(start_counting)
+  app.after_request(report_repeats)
@@ -0,0 +1,407 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import Blueprint, Response, current_app, g, request, \
+  before_render_template, template_rendered
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+from keys import admin_only
+
+blueprint = Blueprint('metrics', __name__)
+
+#----------------------------------------------------------------------------#
+# Metrics.
+#
+# Every worker aggregates its own counters and histograms in memory: an
+# update is a few additions under a lock that is never held for anything
+# longer. With METRICS_DIR set (one directory shared by the workers of a
+# node, like prometheus_client's multiprocess mode) each worker also writes
+# a snapshot of them to <pid>.json at most every METRICS_FLUSH_INTERVAL
+# seconds, and /metrics adds up the snapshots of all the workers, so any
+# worker can answer a scrape for the whole node. The master folds the
+# counters of the workers that exit into archive.json.
+#----------------------------------------------------------------------------#
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+RENDER_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1)
+POOL_WAIT_BUCKETS = (.0005, .001, .005, .01, .05, .1, .5, 1, 5, 30)
+JOB_BUCKETS = (.1, .5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+  'fyyur_http_requests_total':
+    ('counter', 'Requests by endpoint, method and status code.', None),
+  'fyyur_http_request_duration_seconds':
+    ('histogram', 'Time to the response (to its first chunk when streamed).',
+     LATENCY_BUCKETS),
+  'fyyur_template_render_seconds':
+    ('histogram', 'Time to render a template.', RENDER_BUCKETS),
+  'fyyur_db_pool_wait_seconds':
+    ('histogram', 'Time to get a connection from the pool.', POOL_WAIT_BUCKETS),
+  'fyyur_db_pool_timeouts_total':
+    ('counter', 'Requests that gave up waiting for a connection.', None),
+  'fyyur_db_pool_size':
+    ('gauge', 'Connections kept open by the pools.', None),
+  'fyyur_db_pool_checked_out':
+    ('gauge', 'Connections in use.', None),
+  'fyyur_db_pool_overflow':
+    ('gauge', 'Connections open beyond the pool size.', None),
+  'fyyur_cache_requests_total':
+    ('counter', 'Cache lookups by cache and result (hit, miss, error).', None),
+  'fyyur_repeated_queries_total':
+    ('counter', 'Requests running a statement QUERY_REPEAT_THRESHOLD times or more.', None),
+  'fyyur_ratelimit_rejections_total':
+    ('counter', 'Requests refused by the rate limiter, by limit and status.', None),
+  'fyyur_jobs_total':
+    ('counter', 'Jobs run by name and result (done, retry, failed).', None),
+  'fyyur_job_wait_seconds':
+    ('histogram', 'Time from when a job was due to when a worker started it.',
+     JOB_BUCKETS),
+  'fyyur_job_duration_seconds':
+    ('histogram', 'Time to run a job.', JOB_BUCKETS),
+  'fyyur_job_queue_depth':
+    ('gauge', 'Jobs by status: queued and due, delayed, running, failed.', None),
+  'fyyur_job_oldest_due_seconds':
+    ('gauge', 'Age of the oldest job waiting for a worker.', None)
+}
+
+ARCHIVE = 'archive.json'
+LOCK = '.lock'
+
+
+class TimedQueuePool(QueuePool):
+    '''
+    a QueuePool that records how long every checkout waited for a
+    connection, and how many gave up.
+    '''
+
+    def _do_get(self):
+        from extensions import metrics
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            metrics.inc('fyyur_db_pool_timeouts_total')
+            raise
+        finally:
+            metrics.observe('fyyur_db_pool_wait_seconds',
+                            time.perf_counter() - start)
+
+
+def merge(total, snapshot, gauges=True):
+  '''
+  add the series of "snapshot" to "total", both {"counters": [...],
+  "histograms": [...], "gauges": [...]} of [name, labels, value] lists.
+  '''
+  for kind in ('counters', 'histograms', 'gauges'):
+    if kind == 'gauges' and not gauges:
+      continue
+    series = total.setdefault(kind, {})
+    for name, labels, value in snapshot.get(kind, []):
+      key = (name, tuple(map(tuple, labels)))
+      if kind == 'histograms':
+        counts, sum_ = value
+        current = series.get(key)
+        if current is None:
+          series[key] = [list(counts), sum_]
+        else:
+          current[0] = [a + b for a, b in zip(current[0], counts)]
+          current[1] += sum_
+      else:
+        series[key] = series.get(key, 0) + value
+  return total
+
+def serialize(total):
+  return {kind: [[name, labels, value] for (name, labels), value in series.items()]
+          for kind, series in total.items()}
+
+def read_json(path):
+  try:
+    with open(path) as file:
+      return json.load(file)
+  except (OSError, ValueError):
+    # a worker that is just starting, or a file removed meanwhile
+    return {}
+
+def write_json(path, data):
+  temporary = f"{path}.{os.getpid()}.tmp"
+  with open(temporary, 'w') as file:
+    json.dump(data, file)
+  # readers see the old snapshot or the new one, never half of one
+  os.replace(temporary, path)
+
+class DirectoryLock:
+    '''
+    a flock on METRICS_DIR/.lock: scrapes hold it shared, the master holds
+    it exclusively while it folds a worker into the archive, so no scrape
+    counts that worker twice or not at all.
+    '''
+
+    def __init__(self, directory, exclusive=False):
+        self.path = os.path.join(directory, LOCK)
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        import fcntl
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+def retire(directory, pid):
+  '''
+  fold the counters and histograms of the exited worker "pid" into the
+  archive and drop its snapshot. Its gauges died with it.
+  '''
+  if not directory:
+    return
+  path = os.path.join(directory, f"{pid}.json")
+  if not os.path.exists(path):
+    return
+  with DirectoryLock(directory, exclusive=True):
+    archive = os.path.join(directory, ARCHIVE)
+    total = merge(merge({}, read_json(archive)), read_json(path), gauges=False)
+    write_json(archive, serialize(total))
+    os.remove(path)
+
+def reset(directory):
+  '''
+  drop every snapshot, when the server starts.
+  '''
+  if not directory:
+    return
+  os.makedirs(directory, exist_ok=True)
+  for name in os.listdir(directory):
+    if name.endswith('.json') or name.endswith('.tmp'):
+      os.remove(os.path.join(directory, name))
+
+#----------------------------------------------------------------------------#
+# Exposition.
+#----------------------------------------------------------------------------#
+
+def escape(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+  if not labels:
+    return ''
+  return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+def format_value(value):
+  if isinstance(value, float) and value.is_integer():
+    value = int(value)
+  return str(value)
+
+def exposition(total):
+  '''
+  the series of "total" in the Prometheus text format.
+  '''
+  lines = []
+  by_name = {}
+  for kind, series in total.items():
+    for (name, labels), value in series.items():
+      by_name.setdefault(name, []).append((labels, value))
+  for name, (kind, help, buckets) in METRICS.items():
+    if name not in by_name:
+      continue
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in sorted(by_name[name]):
+      if kind != 'histogram':
+        lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        continue
+      counts, sum_ = value
+      cumulative = 0
+      for bound, count in zip(buckets + ('+Inf',), counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} "
+                     f"{cumulative}")
+      lines.append(f"{name}_sum{format_labels(labels)} {format_value(sum_)}")
+      lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+  return '\n'.join(lines) + '\n'
+
+#----------------------------------------------------------------------------#
+# Extension.
+#----------------------------------------------------------------------------#
+
+class Metrics:
+    '''
+    the request, template, DB pool, cache and rate limit metrics of the
+    app, served at /metrics.
+    '''
+
+    def __init__(self, app=None):
+        self._reset()
+        # functions returning gauges read once per scrape, e.g. from the DB
+        self.scrape_collectors = []
+        self._render_starts = threading.local()
+        # a forked worker starts from zero, not from the master's figures
+        os.register_at_fork(after_in_child=self._reset)
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        # (name, labels) -> [[count per bucket and +Inf], sum]
+        self.histograms = {}
+        self.flushed_at = 0
+
+    def init_app(self, app):
+        '''
+        must run before db.init_app(), which creates the engines.
+        '''
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        # Flask-SQLAlchemy still uses a StaticPool for in-memory SQLite
+        options.setdefault('poolclass', TimedQueuePool)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._end_render, app)
+        app.register_blueprint(blueprint)
+        app.extensions['metrics'] = self
+
+    # aggregation
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        index = bisect_left(METRICS[name][2], value)
+        key = (name, labels)
+        with self._lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [[0] * (len(METRICS[name][2]) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def on_scrape(self, collector):
+        '''
+        add a function returning [name, labels, value] gauges for the whole
+        deployment, read by the worker answering the scrape only.
+        '''
+        if collector not in self.scrape_collectors:
+            self.scrape_collectors.append(collector)
+
+    def count_cache(self, cache, hit):
+        self.inc('fyyur_cache_requests_total',
+                 (('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+    # hooks
+
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+
+    def _end_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            rule = request.url_rule
+            labels = (('endpoint', rule.endpoint if rule else 'none'),
+                      ('method', request.method),
+                      ('status', str(response.status_code)))
+            self.inc('fyyur_http_requests_total', labels)
+            self.observe('fyyur_http_request_duration_seconds',
+                         time.perf_counter() - start, labels)
+        directory = current_app.config.get('METRICS_DIR')
+        if directory and time.monotonic() - self.flushed_at > \
+           current_app.config['METRICS_FLUSH_INTERVAL']:
+            self.flush(directory)
+        return response
+
+    def _start_render(self, sender, template, context, **extra):
+        stack = getattr(self._render_starts, 'stack', None)
+        if stack is None:
+            stack = self._render_starts.stack = []
+        stack.append(time.perf_counter())
+
+    def _end_render(self, sender, template, context, **extra):
+        stack = getattr(self._render_starts, 'stack', None)
+        if stack:
+            self.observe('fyyur_template_render_seconds',
+                         time.perf_counter() - stack.pop(),
+                         (('template', template.name or 'string'),))
+
+    # snapshots
+
+    def collect(self):
+        '''
+        the counters and gauges kept by the other extensions: the entity
+        cache, the rate limiter and the DB pools of this process.
+        '''
+        from extensions import db, entity_cache, limiter
+        counters = [['fyyur_cache_requests_total', [['cache', 'entity'], ['result', result]],
+                     getattr(entity_cache, attribute)]
+                    for result, attribute in (('hit', 'hits'), ('miss', 'misses'),
+                                              ('error', 'errors'))]
+        counters.extend(['fyyur_ratelimit_rejections_total',
+                         [['limit', name], ['status', str(status)]], count]
+                        for (name, status), count in list(limiter.rejected.items()))
+        gauges = []
+        for bind, engine in db.engines.items():
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            labels = [['bind', bind or 'default']]
+            gauges.append(['fyyur_db_pool_size', labels, pool.size()])
+            gauges.append(['fyyur_db_pool_checked_out', labels, pool.checkedout()])
+            gauges.append(['fyyur_db_pool_overflow', labels, max(pool.overflow(), 0)])
+        return counters, gauges
+
+    def snapshot(self):
+        counters, gauges = self.collect()
+        with self._lock:
+            counters.extend([name, labels, value]
+                            for (name, labels), value in self.counters.items())
+            histograms = [[name, labels, [list(counts), sum_]]
+                          for (name, labels), (counts, sum_) in self.histograms.items()]
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    def flush(self, directory):
+        '''
+        write the snapshot of this worker where the others can read it.
+        '''
+        self.flushed_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        write_json(os.path.join(directory, f"{os.getpid()}.json"), self.snapshot())
+
+    def gather(self):
+        '''
+        the series of the whole node: the snapshots of every worker and the
+        archive when METRICS_DIR is set, else those of this process.
+        '''
+        directory = current_app.config.get('METRICS_DIR')
+        if not directory:
+            total = merge({}, self.snapshot())
+        else:
+            self.flush(directory)
+            total = {}
+            with DirectoryLock(directory):
+                for name in os.listdir(directory):
+                    if name.endswith('.json'):
+                        merge(total, read_json(os.path.join(directory, name)))
+        for collector in self.scrape_collectors:
+            merge(total, {'gauges': collector()})
+        return total
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+@blueprint.route('/metrics')
+@admin_only
+def metrics_view():
+  return Response(exposition(current_app.extensions['metrics'].gather()),
+                  mimetype='text/plain; version=0.0.4',
+                  headers={'Cache-Control': 'no-store'})
@@ -4,17 +4,20 @@ import logging
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
+from sqlalchemy import inspect
 from sqlalchemy import pool
 
 from alembic import context
+from alembic.util import CommandError
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
 # Interpret the config file for Python logging.
-# This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# This line sets up loggers basically. It keeps the logger Flask-Migrate
+# reports the errors with.
+fileConfig(config.config_file_name, disable_existing_loggers=False)
 logger = logging.getLogger('alembic.env')
 
 # add your model's MetaData object here
@@ -78,15 +81,27 @@ def run_migrations_online():
         poolclass=pool.NullPool,
     )
 
+    configure_args = dict(current_app.extensions['migrate'].configure_args)
     with connectable.connect() as connection:
+        # SQLite cannot alter most of a table: alter it by copying it into a
+        # new one ("batch" mode), in autogenerated migrations too
+        configure_args.setdefault('render_as_batch',
+                                  connection.dialect.name == 'sqlite')
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
-            **current_app.extensions['migrate'].configure_args
+            **configure_args
         )
 
         with context.begin_transaction():
+            # the first revisions only run on Postgres (they create tables
+            # that exist already and drop unnamed constraints)
+            if connection.dialect.name == 'sqlite' and \
+               not inspect(connection).has_table('alembic_version') and \
+               not inspect(connection).has_table('Venue'):
+                raise CommandError('Create a new SQLite database with '
+                                   '"flask sqlite init" instead.')
             context.run_migrations()
 
 
@@ -0,0 +1,32 @@
+"""add change log
+
+Revision ID: a3c1f2d9e4b7
+Revises: 3e69c5bd2ca6
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c1f2d9e4b7'
+down_revision = '3e69c5bd2ca6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Change',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('entity', sa.String(length=10), nullable=False),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('key', sa.String(length=60), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('Change')
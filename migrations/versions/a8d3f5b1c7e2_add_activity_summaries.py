@@ -0,0 +1,50 @@
+"""add the activity summary tables of analytics
+
+Revision ID: a8d3f5b1c7e2
+Revises: f1a7c4e9b2d5
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d3f5b1c7e2'
+down_revision = 'f1a7c4e9b2d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('VenueActivity',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('shows', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('venue_id', 'month')
+    )
+    op.create_table('ArtistActivity',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('shows', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('artist_id', 'month')
+    )
+    op.create_table('GenreActivity',
+    sa.Column('genre', sa.String(length=120), nullable=False),
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('shows', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('genre', 'month')
+    )
+    op.create_table('SummaryState',
+    sa.Column('name', sa.String(length=30), nullable=False),
+    sa.Column('cursor', sa.BigInteger(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('SummaryState')
+    op.drop_table('GenreActivity')
+    op.drop_table('ArtistActivity')
+    op.drop_table('VenueActivity')
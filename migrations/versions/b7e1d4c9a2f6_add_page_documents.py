@@ -0,0 +1,30 @@
+"""add the venue and artist page documents
+
+Revision ID: b7e1d4c9a2f6
+Revises: d6e2b8f4a1c9
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1d4c9a2f6'
+down_revision = 'd6e2b8f4a1c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Document',
+    sa.Column('entity', sa.String(length=10), nullable=False),
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('entity', 'id')
+    )
+
+
+def downgrade():
+    op.drop_table('Document')
@@ -0,0 +1,28 @@
+"""add the id sequences of the sharded tables
+
+Revision ID: c3f8a6e1d5b2
+Revises: b7e1d4c9a2f6
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f8a6e1d5b2'
+down_revision = 'b7e1d4c9a2f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ShardSequence',
+    sa.Column('name', sa.String(length=30), nullable=False),
+    sa.Column('next_id', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('ShardSequence')
@@ -0,0 +1,24 @@
+"""index the change log by time
+
+Revision ID: e4b9a6c3d2f8
+Revises: c5d8e2a7f1b3
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b9a6c3d2f8'
+down_revision = 'c5d8e2a7f1b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_Change_created_at'), 'Change', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Change_created_at'), table_name='Change')
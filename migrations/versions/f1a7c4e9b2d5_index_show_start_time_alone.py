@@ -0,0 +1,24 @@
+"""index shows by start time for the calendar
+
+Revision ID: f1a7c4e9b2d5
+Revises: e4b9a6c3d2f8
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a7c4e9b2d5'
+down_revision = 'e4b9a6c3d2f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_start_time', 'Show', ['start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_start_time', table_name='Show')
@@ -0,0 +1,178 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+from extensions import db
+
+#----------------------------------------------------------------------------#
+# Models.
+#----------------------------------------------------------------------------#
+
+# Use association object to hold the extra start_time data instead of
+# association table to implement Many to Many relation
+class Show(db.Model):
+    __tablename__ = 'Show'
+    # the schedule of a venue or an artist and the calendar are range scans
+    # on these
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_start_time', 'start_time'),
+    )
+
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'),
+        primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'),
+        primary_key=True)
+    start_time = db.Column(db.String(30), primary_key=True)
+    artist = db.relationship("Artist", backref=db.backref('shows', lazy=True))
+
+    def __repr__(self):
+        return f"Artist {self.artist_id} performs on Venue {self.venue_id}"
+
+class Venue(db.Model):
+    __tablename__ = 'Venue'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    city = db.Column(db.String(120), nullable=False)
+    state = db.Column(db.String(2), nullable=False)
+    address = db.Column(db.String(120), nullable=False, unique=True)
+    phone = db.Column(db.String(12))
+    genres = db.Column(db.String(120))
+    seeking_talent = db.Column(db.Boolean)
+    seeking_description = db.Column(db.String(500))
+    image_link = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(120))
+    website = db.Column(db.String(120))
+    shows = db.relationship('Show', backref=db.backref('venue', lazy=True),
+        cascade="all, delete, delete-orphan")
+
+    def __repr__(self):
+        return f"Venue {self.id}: {self.name}"
+
+
+class Artist(db.Model):
+    __tablename__ = 'Artist'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    city = db.Column(db.String(2), nullable=False)
+    state = db.Column(db.String(120), nullable=False)
+    phone = db.Column(db.String(12))
+    genres = db.Column(db.String(120), nullable=False)
+    website = db.Column(db.String(120))
+    image_link = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(120))
+    seeking_venue = db.Column(db.Boolean)
+    seeking_description = db.Column(db.String(500))
+
+    def __repr__(self):
+        return f"Artist {self.id}: {self.name}"
+
+
+# Append-only log of every create, update and delete, read by the change
+# feed (see changes.py). "key" is the id of the venue/artist, or
+# "venue_id:artist_id:start_time" for a show.
+class Change(db.Model):
+    __tablename__ = 'Change'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'),
+        primary_key=True)
+    entity = db.Column(db.String(10), nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    key = db.Column(db.String(60), nullable=False)
+    payload = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False,
+        default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"Change {self.id}: {self.op} {self.entity} {self.key}"
+
+
+# Background jobs (see jobs.py). A job is "queued" until a worker claims
+# it ("running"), then "done", or "failed" once it ran out of attempts.
+# "key", when set, makes enqueueing the same work again a no-op.
+class Job(db.Model):
+    __tablename__ = 'Job'
+    # workers look for the oldest queued jobs that are due
+    __table_args__ = (
+        db.Index('ix_Job_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'),
+        primary_key=True)
+    name = db.Column(db.String(60), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    key = db.Column(db.String(200), unique=True)
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+
+    def __repr__(self):
+        return f"Job {self.id}: {self.name} {self.status}"
+
+
+# Ready-to-render data of the venue and artist pages (see documents.py):
+# "body" is the JSON of the profile and the shows of venue or artist "id".
+class Document(db.Model):
+    __tablename__ = 'Document'
+
+    entity = db.Column(db.String(10), primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    body = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"Document {self.entity} {self.id}"
+
+
+# The next id of the venues and artists when they are sharded (see
+# shards.py): "name" is the table.
+class ShardSequence(db.Model):
+    __tablename__ = 'ShardSequence'
+
+    name = db.Column(db.String(30), primary_key=True)
+    next_id = db.Column(db.BigInteger, nullable=False)
+
+
+# Summary tables of analytics.py: shows per venue, artist and genre and
+# month ("YYYY-MM"), kept up to date from the change log. "SummaryState"
+# holds the id of the last change applied to them.
+class VenueActivity(db.Model):
+    __tablename__ = 'VenueActivity'
+
+    venue_id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ArtistActivity(db.Model):
+    __tablename__ = 'ArtistActivity'
+
+    artist_id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+
+class GenreActivity(db.Model):
+    __tablename__ = 'GenreActivity'
+
+    genre = db.Column(db.String(120), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SummaryState(db.Model):
+    __tablename__ = 'SummaryState'
+
+    name = db.Column(db.String(30), primary_key=True)
+    cursor = db.Column(db.BigInteger, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime)
@@ -0,0 +1,99 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from flask import Blueprint, render_template, jsonify, session, g, \
+  get_flashed_messages, message_flashed
+from extensions import entity_cache, search_index
+from keys import admin_only
+
+blueprint = Blueprint('pages', __name__)
+
+# set while the session holds messages no page has shown yet: the shared
+# pages (helpers.shared_page) leave them out, and script.js only asks
+# /session for them when this cookie is there
+FLASH_COOKIE = 'fyyur_flash'
+
+def retry_after(error):
+  return {'Retry-After': str(error.retry_after)} if error.retry_after else {}
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+@blueprint.route('/')
+def index():
+  return render_template('pages/home.html')
+
+#  Session
+#  ----------------------------------------------------------------
+
+def remember_flash(sender, message, category):
+  g.flashed = True
+
+message_flashed.connect(remember_flash)
+
+@blueprint.after_app_request
+def set_flash_cookie(response):
+  # the messages were not rendered by this response (a redirect, usually)
+  if g.get('flashed') and '_flashes' in session:
+    response.set_cookie(FLASH_COOKIE, '1', samesite='Lax')
+  return response
+
+def session_messages(get_flashed_messages):
+  return {'messages': [{'category': category, 'message': message} for category, message
+                       in get_flashed_messages(with_categories=True)]}
+
+def session_headers(response, shown=True):
+  '''
+  the headers of a /session answer, which ends the flash cookie once the
+  messages are "shown".
+  '''
+  response.cache_control.private = True
+  response.cache_control.no_store = True
+  response.vary.add('Cookie')
+  if shown:
+    response.delete_cookie(FLASH_COOKIE)
+  return response
+
+@blueprint.route('/session')
+def session_state():
+  '''
+  what the shared pages leave out for the visitor: the flashed messages.
+  '''
+  return session_headers(jsonify(session_messages(get_flashed_messages)))
+
+#  Stats
+#  ----------------------------------------------------------------
+
+@blueprint.route('/stats/cache')
+@admin_only
+def cache_stats():
+  return jsonify(entity_cache.stats())
+
+@blueprint.route('/stats/jobs')
+@admin_only
+def job_stats():
+  from jobs import queue_stats
+  return jsonify(queue_stats())
+
+@blueprint.route('/stats/search-index')
+@admin_only
+def search_index_stats():
+  return jsonify(search_index.stats())
+
+@blueprint.app_errorhandler(404)
+def not_found_error(error):
+    return render_template('errors/404.html'), 404
+
+@blueprint.app_errorhandler(429)
+def too_many_requests_error(error):
+    return render_template('errors/429.html'), 429, retry_after(error)
+
+@blueprint.app_errorhandler(503)
+def unavailable_error(error):
+    return render_template('errors/503.html'), 503, retry_after(error)
+
+@blueprint.app_errorhandler(500)
+def server_error(error):
+    return render_template('errors/500.html'), 500
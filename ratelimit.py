@@ -0,0 +1,224 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import math
+import secrets
+import threading
+import time
+from functools import wraps
+from flask import abort, current_app, request
+from cache import RedisClient, RedisError
+
+#----------------------------------------------------------------------------#
+# Token bucket stores.
+#
+# A bucket holds up to "burst" tokens and refills at "rate" tokens per
+# second; a request takes one token or is refused. consume() returns how
+# long to wait before a token is available, 0 meaning the request may go.
+#
+# The stores also count the requests running a route: acquire() admits a
+# request while fewer than "limit" run and returns a ticket for release(),
+# or None. A ticket the shared store never got back (a worker killed
+# mid-request) stops counting after "ttl" seconds.
+#----------------------------------------------------------------------------#
+
+class MemoryStore:
+    '''
+    buckets kept in the worker process. Limits are per process: with N
+    workers a client gets up to N times the configured rate.
+    '''
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                wait = 0
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            # remember when the bucket will be full again
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # a bucket that has refilled completely is the same as no bucket
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if bucket[2] > now}
+
+    def acquire(self, key, limit, ttl):
+        # a worker always releases its own tickets: no expiry needed
+        with self._lock:
+            if self._running.get(key, 0) >= limit:
+                return None
+            self._running[key] = self._running.get(key, 0) + 1
+        return key
+
+    def release(self, key, ticket):
+        with self._lock:
+            self._running[key] -= 1
+
+
+# Refill and take a token atomically on the server, on the server's clock.
+TOKEN_BUCKET_SCRIPT = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+'''
+
+# The running requests of a route as a sorted set of tickets scored by
+# their start time; the tickets older than the ttl are dropped first.
+ACQUIRE_SCRIPT = '''
+local limit = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - ttl)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], math.ceil(ttl * 1000))
+return 1
+'''
+
+class RedisStore:
+    '''
+    buckets and running counts shared by every worker and node through a
+    Redis-protocol server, so the limits hold for the whole deployment.
+    '''
+
+    def __init__(self, url, prefix='fyyur:ratelimit:', client=None):
+        self.prefix = prefix
+        self.client = client or RedisClient(url)
+
+    def consume(self, key, rate, burst):
+        return float(self.client.execute('EVAL', TOKEN_BUCKET_SCRIPT, 1,
+                                         self.prefix + key, rate, burst))
+
+    def acquire(self, key, limit, ttl):
+        ticket = secrets.token_hex(8)
+        if self.client.execute('EVAL', ACQUIRE_SCRIPT, 1, self.prefix + key,
+                               limit, ttl, ticket):
+            return ticket
+        return None
+
+    def release(self, key, ticket):
+        self.client.execute('ZREM', self.prefix + key, ticket)
+
+#----------------------------------------------------------------------------#
+# Rate limiter.
+#----------------------------------------------------------------------------#
+
+def client_key():
+  '''
+  the client a bucket belongs to: RATELIMIT_CLIENT_HEADER when set, else
+  the address of the client (as forwarded by the TRUSTED_PROXIES).
+  '''
+  header = current_app.config.get('RATELIMIT_CLIENT_HEADER')
+  return (header and request.headers.get(header)) or request.remote_addr
+
+class RateLimiter:
+    '''
+    admission control for expensive routes:
+
+    - limit(name) applies the token bucket RATELIMITS[name] to every
+      client on every route it decorates, answering 429 when it is empty;
+    - concurrency(name) lets at most CONCURRENCY_LIMITS[name] requests run
+      the routes it decorates at once and answers 503 to the others, so
+      they shed load before they exhaust the database connections. The
+      count is kept in the store: with 'redis' it holds for the whole
+      deployment, with 'memory' for one worker process, which only caps
+      anything with threaded workers (a sync worker runs one request).
+    '''
+
+    def __init__(self, app=None):
+        self.store = None
+        self.rejected = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        storage = app.config.get('RATELIMIT_STORAGE', 'memory')
+        if storage == 'memory':
+            self.store = MemoryStore()
+        elif storage == 'redis':
+            self.store = RedisStore(app.config['RATELIMIT_REDIS_URL'])
+        else:
+            raise ValueError('Unknown RATELIMIT_STORAGE: ' + storage)
+        app.extensions['ratelimit'] = self
+
+    def _reject(self, name, status, retry_after):
+        self.rejected[name, status] = self.rejected.get((name, status), 0) + 1
+        abort(status, retry_after=max(1, math.ceil(retry_after)))
+
+    def limit(self, name):
+        def decorator(view):
+            @wraps(view)
+            def limited(*args, **kwargs):
+                config = current_app.config
+                if config.get('RATELIMIT_ENABLED', True) and name in config['RATELIMITS']:
+                    rate, burst = config['RATELIMITS'][name]
+                    key = f"{request.endpoint}:{client_key()}"
+                    try:
+                        wait = self.store.consume(key, rate, burst)
+                    except (OSError, RedisError):
+                        # fail open: an outage of the shared store must not
+                        # take the routes down with it
+                        current_app.logger.warning('rate limit store unavailable')
+                        wait = 0
+                    if wait > 0:
+                        self._reject(name, 429, wait)
+                return view(*args, **kwargs)
+            return limited
+        return decorator
+
+    def concurrency(self, name):
+        def decorator(view):
+            @wraps(view)
+            def capped(*args, **kwargs):
+                config = current_app.config
+                limit = config.get('CONCURRENCY_LIMITS', {}).get(name)
+                if limit is None:
+                    return view(*args, **kwargs)
+                key = f"running:{name}"
+                try:
+                    ticket = self.store.acquire(key, limit, config['CONCURRENCY_TTL'])
+                except (OSError, RedisError):
+                    current_app.logger.warning('rate limit store unavailable')
+                    return view(*args, **kwargs)
+                if ticket is None:
+                    self._reject(name, 503, 1)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    try:
+                        self.store.release(key, ticket)
+                    except (OSError, RedisError):
+                        current_app.logger.warning('rate limit store unavailable')
+            return capped
+        return decorator
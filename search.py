@@ -0,0 +1,52 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from flask import Blueprint, current_app, render_template, request, jsonify
+from extensions import limiter, search_index
+
+blueprint = Blueprint('search', __name__)
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+#  Search
+#  ----------------------------------------------------------------
+
+def search_request(args, per_page):
+  '''
+  the results of the /search request with the query string "args", and
+  the term, type and genre it asks for, as template arguments.
+  '''
+  search_term = args.get('search_term', '')
+  entity = args.get('type') or None
+  genre = args.get('genre') or None
+  page = max(args.get('page', 1, type=int), 1)
+  if search_term.strip():
+    results = search_index.search(search_term, per_page, entity, genre,
+                                  (page - 1) * per_page)
+  else:
+    results = {"count": 0, "data": [], "facets": {"type": {}, "genre": {}}}
+  results["prev"] = page - 1 if page > 1 else None
+  results["next"] = page + 1 if page * per_page < results["count"] else None
+  return dict(results=results, search_term=search_term, type=entity, genre=genre)
+
+def wants_json(accept_mimetypes):
+  return accept_mimetypes.best_match(['text/html', 'application/json']) == \
+    'application/json'
+
+@blueprint.route('/search')
+@limiter.limit('search')
+@limiter.concurrency('search')
+def search():
+  '''
+  venues and artists matching the term by name, city, state or genre, best
+  first and one "page" at a time, with the number of matches per type and
+  genre. "type" and "genre" narrow the results down without changing the
+  facet counts. Answers JSON to clients that prefer it.
+  '''
+  found = search_request(request.args, current_app.config['SEARCH_PAGE_SIZE'])
+  if wants_json(request.accept_mimetypes):
+    return jsonify(found['results'])
+  return render_template('pages/search.html', **found)
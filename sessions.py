@@ -0,0 +1,142 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import secrets
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+from cache import MemoryBackend, RedisBackend, RedisError
+
+#----------------------------------------------------------------------------#
+# Server-side sessions.
+#
+# With SESSION_TYPE 'cookie' (the default) Flask keeps the session in a
+# signed cookie. 'redis' keeps it in the shared Redis-protocol server
+# instead, so it can grow without bloating every request and be dropped on
+# the server; 'memory' keeps it in the worker, for tests and a single
+# process. The cookie then only holds the session id, signed with the
+# secret keys.
+#----------------------------------------------------------------------------#
+
+class ServerSession(CallbackDict, SessionMixin):
+    '''
+    the session of a request, stored under "sid".
+    '''
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class ServerSessionInterface(SessionInterface):
+    '''
+    sessions kept in a cache backend (see cache.py) for the lifetime of a
+    permanent session.
+    '''
+
+    serializer = TaggedJSONSerializer()
+    salt = 'fyyur-session'
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def signer(self, app):
+        # current key last: itsdangerous signs with it, accepts them all
+        keys = [*app.config.get('SECRET_KEY_FALLBACKS', []), app.secret_key]
+        return Signer(keys, salt=self.salt)
+
+    def new_session(self):
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie or not app.secret_key:
+            return self.new_session()
+        try:
+            sid = self.signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return self.new_session()
+        try:
+            data = self.backend.get('session:' + sid)
+        except (OSError, RedisError):
+            app.logger.warning('session store unavailable')
+            data = None
+        if data is None:
+            return self.new_session()
+        return ServerSession(self.serializer.loads(data), sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                try:
+                    self.backend.delete('session:' + session.sid)
+                except (OSError, RedisError):
+                    app.logger.warning('session store unavailable')
+                response.delete_cookie(name, domain=domain, path=path)
+                response.vary.add('Cookie')
+            return
+        if not self.should_set_cookie(app, session):
+            return
+
+        try:
+            self.backend.set('session:' + session.sid,
+                             self.serializer.dumps(dict(session)),
+                             app.permanent_session_lifetime.total_seconds())
+        except (OSError, RedisError):
+            app.logger.warning('session store unavailable')
+            return
+        response.set_cookie(name, self.signer(app).sign(session.sid).decode(),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+        response.vary.add('Cookie')
+
+
+def session_backend_from_config(config):
+  '''
+  the store selected by "SESSION_TYPE", or None for cookie sessions.
+  '''
+  session_type = config.get('SESSION_TYPE', 'cookie')
+  ttl = config['PERMANENT_SESSION_LIFETIME']
+  ttl = ttl.total_seconds() if hasattr(ttl, 'total_seconds') else ttl
+  if session_type == 'cookie':
+    return None
+  if session_type == 'memory':
+    return MemoryBackend(max_entries=config.get('SESSION_MAX_ENTRIES', 10000), ttl=ttl)
+  if session_type == 'redis':
+    return RedisBackend(url=config['SESSION_REDIS_URL'], ttl=ttl,
+                        prefix=config.get('CACHE_KEY_PREFIX', 'fyyur:'))
+  raise ValueError('Unknown SESSION_TYPE: ' + session_type)
+
+def init_app(app):
+  backend = session_backend_from_config(app.config)
+  if backend is not None:
+    app.session_interface = ServerSessionInterface(backend)
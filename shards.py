@@ -0,0 +1,413 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import os
+import threading
+from collections import defaultdict
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, select, update, insert, delete, func
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql.util import find_tables
+from extensions import db
+
+#----------------------------------------------------------------------------#
+# Sharding by state.
+#
+# Optional: with SHARDS set, the venues and artists live in the shard
+# SHARD_STATES gives their state, the shows in the shard of their venue,
+# and everything else (the change log, documents, jobs, summaries) in the
+# main database, which is also where states without a shard go. The shards
+# are Flask-SQLAlchemy binds and db.session becomes a RoutingSession: writes
+# go to the shard of the object, queries on Venue, Artist and Show run on
+# every shard and their results are concatenated (so their ORDER BY only
+# holds within a shard). Ids are allocated from the main database so they
+# stay unique across shards.
+#
+# A venue or artist whose state changes stays in its shard until "flask
+# shards rebalance" moves it, which is also how the rows of an unsharded
+# database are spread once SHARDS is set. The unique constraints of the
+# tables (phone, website, ...) only hold within one shard: two shards may
+# hold the same value, and rebalance refuses to run until that is fixed. A show, its venue and its artist
+# may be in different shards, and the summaries and documents are in the
+# main database, so nothing joins them: each side is read with its own
+# query, the other side with lookup(), and they are matched in Python.
+#----------------------------------------------------------------------------#
+
+MAIN = 'main'
+SHARDED = ('Venue', 'Artist', 'Show')
+
+def shard_names():
+  return [MAIN, *current_app.config.get('SHARDS', {})]
+
+def bind_key(name):
+  return 'shard:' + name
+
+def shard_engines():
+  return {name: db.engines[None if name == MAIN else bind_key(name)]
+          for name in shard_names()}
+
+def shard_for_state(state):
+  config = current_app.config
+  return config.get('SHARD_STATES', {}).get(state, config.get('SHARD_DEFAULT') or MAIN)
+
+def is_sharded(mapper):
+  return mapper is not None and mapper.local_table.name in SHARDED
+
+#----------------------------------------------------------------------------#
+# Ids.
+#
+# The shards number their rows independently, so the ids of new venues and
+# artists come from the ShardSequence table of the main database instead.
+# Each process reserves SHARD_ID_BLOCK ids at a time.
+#----------------------------------------------------------------------------#
+
+class IdAllocator:
+    def __init__(self):
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # (database, table) -> [next id, end of the block]
+        self.blocks = {}
+
+    def reserve(self, name, count):
+        '''
+        take "count" ids from the sequence "name" in its own transaction,
+        so the sequence row is not locked until the request commits.
+        '''
+        from models import ShardSequence
+        with db.engines[None].begin() as connection:
+            end = connection.execute(
+                update(ShardSequence).where(ShardSequence.name == name).
+                values(next_id=ShardSequence.next_id + count).
+                returning(ShardSequence.next_id)).scalar()
+        if end is None:
+            raise RuntimeError(f"No id sequence for {name}: run 'flask shards init'.")
+        return end - count, end
+
+    def allocate(self, name, count=1):
+        key = (str(db.engines[None].url), name)
+        block = current_app.config['SHARD_ID_BLOCK']
+        with self._lock:
+            ids = []
+            while len(ids) < count:
+                start, end = self.blocks.get(key, (0, 0))
+                if start == end:
+                    start, end = self.reserve(name, max(block, count - len(ids)))
+                taken = min(end - start, count - len(ids))
+                ids.extend(range(start, start + taken))
+                self.blocks[key] = (start + taken, end)
+            return ids
+
+allocator = IdAllocator()
+
+#----------------------------------------------------------------------------#
+# Routing.
+#----------------------------------------------------------------------------#
+
+def choose_shard(mapper, instance, clause=None, **kw):
+  '''
+  the shard an object is written to. New objects are placed before the
+  flush (see place_new_objects), so only the other tables land here.
+  '''
+  if not is_sharded(mapper) or instance is None:
+    return MAIN
+  if hasattr(instance, 'state'):
+    return shard_for_state(instance.state)
+  return MAIN
+
+def choose_identity_shards(mapper, primary_key, **kw):
+  return shard_names() if is_sharded(mapper) else [MAIN]
+
+def choose_execute_shards(orm_context):
+  '''
+  the shards a statement runs on: the main database unless it reads
+  Venue, Artist or Show, in which case every shard. The shows of a venue
+  are in its shard.
+  '''
+  # the mappers miss the tables read in a subquery, such as the counts of
+  # helpers.search_statements
+  if not any(is_sharded(mapper) for mapper in orm_context.all_mappers) and \
+     not sharded_statement(orm_context.statement):
+    return [MAIN]
+  if orm_context.is_insert:
+    raise ValueError('Insert venues, artists and shows with shards.insert_rows().')
+  parent, mapper = orm_context.lazy_loaded_from, orm_context.bind_mapper
+  if parent is not None and mapper is not None and \
+     parent.mapper.local_table.name == 'Venue' and mapper.local_table.name == 'Show':
+    return [parent.key[2]]
+  return shard_names()
+
+def place_new_objects(session, flush_context, instances):
+  '''
+  give the new venues and artists an id and the shard of their state, and
+  the new shows the shard of their venue.
+  '''
+  from models import Show, Venue, Artist
+  for obj in list(session.new):
+    state = inspect(obj)
+    if isinstance(obj, (Venue, Artist)):
+      if obj.id is None:
+        obj.id = allocator.allocate(obj.__tablename__)[0]
+      state.identity_token = shard_for_state(obj.state)
+    elif isinstance(obj, Show):
+      venue = session.get(Venue, int(obj.venue_id))
+      state.identity_token = inspect(venue).key[2] if venue is not None else \
+        shard_for_state(None)
+
+
+class RoutingSession(ShardedSession):
+    '''
+    the session of db.session when SHARDS is set (see
+    extensions.AppSession).
+    '''
+
+    def __init__(self, db, **options):
+        super().__init__(shard_chooser=choose_shard,
+                         identity_chooser=choose_identity_shards,
+                         execute_chooser=choose_execute_shards,
+                         shards=shard_engines(), **options)
+        self.db = db
+        event.listen(self, 'before_flush', place_new_objects)
+
+
+def sharded_statement(statement):
+  '''
+  whether "statement" reads Venue, Artist or Show, and so runs on every
+  shard (for the async app, which has no RoutingSession).
+  '''
+  return any(table.name in SHARDED for table in find_tables(statement))
+
+def lookup_statements(model, ids, *columns, batch=1000):
+  '''
+  the selects of lookup(), "batch" ids each.
+  '''
+  ids = sorted(set(ids))
+  for start in range(0, len(ids), batch):
+    yield select(model.id, *columns).where(model.id.in_(ids[start:start + batch]))
+
+def lookup(model, ids, *columns, batch=1000):
+  '''
+  the "columns" of the rows "ids" of "model" that exist, by id, read
+  "batch" ids at a time: the other side of a join.
+  '''
+  found = {}
+  for statement in lookup_statements(model, ids, *columns, batch=batch):
+    for id, *values in db.session.execute(statement):
+      found[id] = tuple(values)
+  return found
+
+def insert_rows(model, rows):
+  '''
+  insert the dicts "rows" into the table of "model" and return their ids,
+  in order: with one multi-row INSERT ... RETURNING, or with shards one
+  INSERT per shard, with ids from the allocator.
+  '''
+  if not current_app.config.get('SHARDS'):
+    return db.session.scalars(
+      insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+  ids = allocator.allocate(model.__tablename__, len(rows))
+  placed = defaultdict(list)
+  for id, row in zip(ids, rows):
+    placed[shard_for_state(row['state'])].append(dict(row, id=id))
+  for shard, shard_rows in placed.items():
+    db.session.execute(insert(model.__table__), shard_rows,
+                       bind_arguments={'shard_id': shard})
+  return ids
+
+#----------------------------------------------------------------------------#
+# Maintenance.
+#----------------------------------------------------------------------------#
+
+def sharded_tables():
+  from models import Venue, Artist, Show
+  return [Venue.__table__, Artist.__table__, Show.__table__]
+
+def create_shard_tables(engine):
+  '''
+  create the Venue, Artist and Show tables in a shard. Without foreign
+  keys: the artist of a show may be in another shard.
+  '''
+  with engine.begin() as connection:
+    for table in sharded_tables():
+      if inspect(connection).has_table(table.name):
+        continue
+      connection.execute(CreateTable(table, include_foreign_key_constraints=[]))
+      for index in table.indexes:
+        index.create(connection)
+
+def init_shards():
+  '''
+  create the tables of the shards and start the id sequences after the
+  highest id of any shard.
+  '''
+  from models import ShardSequence
+  engines = shard_engines()
+  for name, engine in engines.items():
+    if name != MAIN:
+      create_shard_tables(engine)
+  for table in sharded_tables()[:2]:
+    highest = 0
+    for engine in engines.values():
+      with engine.connect() as connection:
+        highest = max(highest, connection.execute(
+          select(func.max(table.c.id))).scalar() or 0)
+    sequence = db.session.get(ShardSequence, table.name)
+    if sequence is None:
+      db.session.add(ShardSequence(name=table.name, next_id=highest + 1))
+    else:
+      sequence.next_id = max(sequence.next_id, highest + 1)
+  db.session.commit()
+
+def lock_rows(connection, table, ids):
+  '''
+  keep the rows "ids" of "table" (and the shows of venues) from changing
+  until the transaction of "connection" ends. An UPDATE that changes
+  nothing locks the rows on PostgreSQL, and the whole database on SQLite.
+  '''
+  from models import Show
+  connection.execute(update(table).where(table.c.id.in_(ids)).values(id=table.c.id))
+  if table.name == 'Venue' and connection.dialect.name == 'postgresql':
+    # no new show either: it would stay behind in the source shard
+    connection.exec_driver_sql(f'LOCK TABLE "{Show.__tablename__}" IN EXCLUSIVE MODE')
+
+def move(table, ids, source, target, engines):
+  '''
+  copy the rows "ids" of "table" (and the shows of venues) to the shard
+  "target", then delete them from "source", where they are locked from
+  the copy to the delete so no write made meanwhile is lost. A copy left
+  over by an interrupted move is replaced, so a move can be run again.
+  '''
+  from models import Show
+  shows = Show.__table__
+  with engines[source].begin() as source_connection:
+    lock_rows(source_connection, table, ids)
+    rows = [dict(row) for row in source_connection.execute(
+      select(table).where(table.c.id.in_(ids))).mappings()]
+    show_rows = [dict(row) for row in source_connection.execute(
+      select(shows).where(shows.c.venue_id.in_(ids))).mappings()] \
+      if table.name == 'Venue' else []
+    with engines[target].begin() as connection:
+      if show_rows:
+        connection.execute(delete(shows).where(shows.c.venue_id.in_(ids)))
+      connection.execute(delete(table).where(table.c.id.in_(ids)))
+      connection.execute(insert(table), rows)
+      if show_rows:
+        connection.execute(insert(shows), show_rows)
+    # a crash from here to the commit leaves the rows in both shards,
+    # which duplicates() reports
+    if show_rows:
+      source_connection.execute(delete(shows).where(shows.c.venue_id.in_(ids)))
+    source_connection.execute(delete(table).where(table.c.id.in_(ids)))
+  return len(rows)
+
+def duplicates():
+  '''
+  the values found in more than one shard, as (table, column, value,
+  shards): an id (the copy left by an interrupted move), or a value of a
+  unique column, which each shard only enforces within itself.
+  '''
+  from helpers import UNIQUE_COLUMNS
+  engines = shard_engines()
+  found = []
+  for table in sharded_tables()[:2]:
+    for name in ('id', *UNIQUE_COLUMNS[table.name]):
+      column = table.c[name]
+      shards = defaultdict(list)
+      for shard, engine in engines.items():
+        with engine.connect() as connection:
+          for value in connection.execute(
+              select(column).where(column.isnot(None)).distinct()).scalars():
+            shards[value].append(shard)
+      found.extend((table.name, name, value, names)
+                   for value, names in shards.items() if len(names) > 1)
+  return found
+
+def rebalance(batch=500, dry_run=False):
+  '''
+  move the venues and artists that are not in the shard of their state.
+  Returns the {(table, source, target): rows} moved.
+  '''
+  engines = shard_engines()
+  moved = defaultdict(int)
+  for table in sharded_tables()[:2]:
+    for source, engine in engines.items():
+      misplaced = defaultdict(list)
+      with engine.connect() as connection:
+        for id, state in connection.execute(select(table.c.id, table.c.state)):
+          target = shard_for_state(state)
+          if target != source:
+            misplaced[target].append(id)
+      for target, ids in misplaced.items():
+        for start in range(0, len(ids), batch):
+          chunk = ids[start:start + batch]
+          moved[(table.name, source, target)] += len(chunk) if dry_run else \
+            move(table, chunk, source, target, engines)
+  return moved
+
+def shard_stats():
+  counts = {}
+  for name, engine in shard_engines().items():
+    with engine.connect() as connection:
+      counts[name] = {table.name: connection.execute(
+        select(func.count()).select_from(table)).scalar()
+        for table in sharded_tables()}
+  return counts
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+shards_cli = AppGroup('shards', help='Manage the shards of SHARDS.')
+
+@shards_cli.command('init')
+def init_command():
+  '''
+  create the shard tables and the id sequences.
+  '''
+  init_shards()
+  click.echo(f"Initialized {len(shard_names()) - 1} shards.")
+
+@shards_cli.command('rebalance')
+@click.option('--batch', default=500, show_default=True, help='Rows moved at once.')
+@click.option('--dry-run', is_flag=True, help='Only count the rows to move.')
+def rebalance_command(batch, dry_run):
+  '''
+  move the venues (with their shows) and artists to the shard of their
+  state, after changing SHARD_STATES or sharding a database. Refuses to
+  while a row or a unique value is in more than one shard.
+  '''
+  found = duplicates()
+  if found:
+    for table, column, value, names in found:
+      click.echo(f"{table}.{column} {value!r} is in {', '.join(names)}")
+    raise click.ClickException(f"{len(found)} values are in several shards: keep one "
+                               "of each, then rebalance again.")
+  moved = rebalance(batch, dry_run)
+  for (table, source, target), count in sorted(moved.items()):
+    click.echo(f"{table}: {count} from {source} to {target}")
+  click.echo(f"{'Would move' if dry_run else 'Moved'} {sum(moved.values())} rows.")
+
+@shards_cli.command('stats')
+def stats_command():
+  '''
+  print the number of rows of each shard.
+  '''
+  for name, counts in shard_stats().items():
+    click.echo(f"{name}: " + ', '.join(f"{table} {count}" for table, count in counts.items()))
+
+def init_app(app):
+  '''
+  must run before db.init_app(), which creates the engines of the binds.
+  '''
+  shards = app.config.get('SHARDS') or {}
+  if shards:
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update({bind_key(name): url for name, url in shards.items()})
+    app.config['SQLALCHEMY_BINDS'] = binds
+  app.cli.add_command(shards_cli)
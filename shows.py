@@ -0,0 +1,109 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import sys
+from flask import Blueprint, render_template, request, flash, abort
+from sqlalchemy.orm import selectinload
+from extensions import db, limiter
+from models import Show, Venue, Artist
+from helpers import calendar_window, calendar_request, calendar_shows_statement, \
+  calendar_page, cached_show_counts, format_shows, shared_page
+from loading import loading_profile
+from sqlite import replica_reads
+from documents import update_documents
+from shards import lookup
+from changes import record_change
+
+blueprint = Blueprint('shows', __name__)
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+#  Shows
+#  ----------------------------------------------------------------
+
+@blueprint.route('/shows')
+@replica_reads
+@shared_page
+@limiter.concurrency('listing')
+@loading_profile({Show: (selectinload(Show.venue), selectinload(Show.artist))})
+def shows():
+  # three queries however many shows: the venues and artists are loaded
+  # with one IN query each
+  shows = Show.query.all()
+  formatted_data = []
+  for show in shows:
+    formatted_data.append({
+      "venue_id": show.venue_id,
+      "venue_name": show.venue.name,
+      "artist_id": show.artist_id,
+      "artist_name": show.artist.name,
+      "artist_image_link": show.artist.image_link,
+      "start_time": show.start_time
+    })
+
+  return render_template('pages/shows.html', shows=formatted_data)
+
+@blueprint.route('/shows/calendar')
+@limiter.concurrency('listing')
+def calendar():
+  '''
+  the shows by "day", "week" or "month" around "date" (today by default).
+  Every view shows the number of shows per day; the day and week views
+  also list them, loading only the shows of the window.
+  '''
+  asked = calendar_request(request.args)
+  if asked is None:
+    abort(404)
+  view, day = asked
+  start, end = calendar_window(view, day)
+  counts = cached_show_counts(start, end)
+
+  shows = []
+  if view != 'month' and counts:
+    # the venues and artists may be in other shards than the shows
+    rows = db.session.execute(calendar_shows_statement(start, end)).all()
+    venues = lookup(Venue, {row[0] for row in rows}, Venue.name)
+    artists = lookup(Artist, {row[1] for row in rows}, Artist.name, Artist.image_link)
+    shows = format_shows(rows, venues, artists)
+  return render_template('pages/calendar.html', **calendar_page(view, day, counts, shows))
+
+@blueprint.route('/shows/create')
+def create_shows():
+  # renders form. do not touch.
+  from forms import ShowForm
+  form = ShowForm()
+  return render_template('forms/new_show.html', form=form)
+
+@blueprint.route('/shows/create', methods=['POST'])
+@limiter.limit('write')
+@limiter.concurrency('write')
+def create_show_submission():
+  from forms import ShowForm
+  form = ShowForm(request.form)
+  if form.validate_on_submit():
+    try:
+      # Create Show using form data
+      show = Show(artist_id=form.artist_id.data,
+                  venue_id=form.venue_id.data,
+                  start_time=form.start_time.data)
+      db.session.add(show)
+      db.session.flush()
+      record_change('create', show)
+      update_documents(show)
+      db.session.commit()
+      # on successful db insert, flash success
+      flash('Show was successfully listed!')
+    except:
+      db.session.rollback()
+      # on unsuccessful db insert, flash an error instead.
+      flash('An error occurred. Show could not be listed.', 'error')
+      print(sys.exc_info())
+    finally:
+      db.session.close()
+
+    return render_template('pages/home.html')
+
+  return render_template('forms/new_show.html', form=form)
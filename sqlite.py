@@ -0,0 +1,165 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import functools
+import os
+import sqlite3
+import click
+from flask import current_app, g, has_request_context
+from flask.cli import AppGroup
+from sqlalchemy import create_engine, event, exc, inspect
+from sqlalchemy.orm import Session
+from extensions import db
+
+#----------------------------------------------------------------------------#
+# SQLite mode.
+#
+# With DATABASE_URL=sqlite:///... the app runs on a SQLite file, for a
+# single node or an edge node and for tests. The first migrations were
+# written for Postgres, so "flask sqlite init" creates a new database from
+# the models and marks it as migrated; "flask db upgrade" applies the later
+# migrations (in batch mode, see migrations/env.py). Every connection gets the
+# SQLITE_PRAGMAS: WAL journaling, so readers never wait for the writer,
+# synchronous=NORMAL, a memory mapped file and a larger page cache.
+#
+# With SQLITE_REPLICA set as well, the read pages (@replica_reads) run
+# their selects on that file instead: a copy written by "flask sqlite
+# snapshot" (from cron, or shipped from another node), opened read-only
+# and immutable, so reading it takes no lock and goes through the memory
+# map. A snapshot replaces the file atomically; the connections to the
+# previous one are reopened when they are next checked out. The pages lag
+# behind the database by the time since the last snapshot, and their ETags
+# come from the replica too, so they stay consistent with what is shown.
+#----------------------------------------------------------------------------#
+
+def set_pragmas(dbapi_connection, connection_record, pragmas):
+  cursor = dbapi_connection.cursor()
+  for name, value in pragmas.items():
+    cursor.execute(f"PRAGMA {name} = {value}")
+  cursor.close()
+
+def tune(engine, pragmas):
+  if engine.dialect.name == 'sqlite':
+    event.listen(engine, 'connect', functools.partial(set_pragmas, pragmas=pragmas))
+
+#----------------------------------------------------------------------------#
+# Read-only replica.
+#----------------------------------------------------------------------------#
+
+def replica_url(path, driver='sqlite'):
+  return f"{driver}:///file:{os.path.abspath(path)}?mode=ro&immutable=1&uri=true"
+
+def remember_file(dbapi_connection, connection_record, path):
+  connection_record.info['inode'] = os.stat(path).st_ino
+
+def check_file(dbapi_connection, connection_record, connection_proxy, path):
+  '''
+  reopen the connections to a replica file that was replaced since.
+  '''
+  if os.stat(path).st_ino != connection_record.info.get('inode'):
+    raise exc.DisconnectionError('replica file replaced')
+
+def watch_file(engine, path):
+  event.listen(engine, 'connect', functools.partial(remember_file, path=path))
+  event.listen(engine, 'checkout', functools.partial(check_file, path=path))
+
+def replica_engine(app, path):
+  options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+  engine = create_engine(replica_url(path), **options)
+  tune(engine, app.config['SQLITE_REPLICA_PRAGMAS'])
+  watch_file(engine, path)
+  # never share the connections of the master with the workers
+  os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+  return engine
+
+def replica_reads(view):
+  '''
+  run the selects of a read-only view on SQLITE_REPLICA, when it is set.
+  Put it above @shared_page, which reads the ETag.
+  '''
+  @functools.wraps(view)
+  def wrapper(*args, **kwargs):
+    g.replica_reads = True
+    return view(*args, **kwargs)
+  return wrapper
+
+def route_to_replica(orm_context):
+  if not has_request_context() or not g.get('replica_reads') or \
+     not orm_context.is_select:
+    return
+  engine = current_app.extensions.get('sqlite_replica')
+  if engine is not None:
+    orm_context.bind_arguments['bind'] = engine
+
+def snapshot(path):
+  '''
+  copy the database to the replica file "path" with the online backup
+  API, which does not block the writer, and replace "path" with it at
+  once. Returns the size of the copy.
+  '''
+  if db.engine.dialect.name != 'sqlite':
+    raise RuntimeError('Snapshots need a SQLite DATABASE_URL.')
+  temporary = path + '.tmp'
+  if os.path.exists(temporary):
+    os.remove(temporary)
+  target = sqlite3.connect(temporary)
+  try:
+    with db.engine.connect() as connection:
+      connection.connection.dbapi_connection.backup(target)
+    # a single file: immutable readers ignore the -wal file
+    target.execute('PRAGMA journal_mode = DELETE')
+  finally:
+    target.close()
+  os.replace(temporary, path)
+  return os.path.getsize(path)
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+sqlite_cli = AppGroup('sqlite', help='Manage the SQLite database and its replica.')
+
+@sqlite_cli.command('init')
+def init_command():
+  '''
+  create the tables of a new SQLite database and stamp it with the latest
+  migration.
+  '''
+  from flask_migrate import stamp
+  if db.engine.dialect.name != 'sqlite':
+    raise click.UsageError('Only a SQLite DATABASE_URL is created this way: '
+                           'run "flask db upgrade".')
+  if inspect(db.engine).has_table('alembic_version'):
+    raise click.UsageError('The database has migrations already: run "flask db upgrade".')
+  db.create_all(bind_key=None)
+  stamp()
+  click.echo(f"Created {db.engine.url.database}.")
+
+@sqlite_cli.command('snapshot')
+@click.option('--path', help='Replica file (SQLITE_REPLICA by default).')
+def snapshot_command(path):
+  '''
+  write the read-only replica file the read pages query.
+  '''
+  path = path or current_app.config.get('SQLITE_REPLICA')
+  if not path:
+    raise click.UsageError('Set SQLITE_REPLICA or pass --path.')
+  click.echo(f"Wrote {snapshot(path)} bytes to {path}.")
+
+def init_app(app):
+  '''
+  must run after db.init_app(), which creates the engines.
+  '''
+  with app.app_context():
+    engines = list(db.engines.values())
+  for engine in engines:
+    tune(engine, app.config['SQLITE_PRAGMAS'])
+  path = app.config.get('SQLITE_REPLICA')
+  if path:
+    if app.config.get('SHARDS'):
+      raise RuntimeError('SQLITE_REPLICA does not support SHARDS.')
+    app.extensions['sqlite_replica'] = replica_engine(app, path)
+    if not event.contains(Session, 'do_orm_execute', route_to_replica):
+      event.listen(Session, 'do_orm_execute', route_to_replica)
+  app.cli.add_command(sqlite_cli)
@@ -2,3 +2,24 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Shared pages (helpers.shared_page in the app) are cached for every
+// visitor, so they leave out the flashed messages: fetch them when the
+// flash cookie says there are some.
+document.addEventListener('DOMContentLoaded', function () {
+  var container = document.getElementById('messages');
+  if (!container || !/(^|;\s*)fyyur_flash=/.test(document.cookie)) {
+    return;
+  }
+  fetch(container.getAttribute('data-src'), {credentials: 'same-origin', cache: 'no-store'})
+    .then(function (response) { return response.json(); })
+    .then(function (state) {
+      state.messages.forEach(function (message) {
+        var alert = document.createElement('div');
+        alert.className = 'alert alert-block alert-info fade in';
+        alert.innerHTML = '<a class="close" data-dismiss="alert">&times;</a>';
+        alert.appendChild(document.createTextNode(message.message));
+        container.appendChild(alert);
+      });
+    });
+});
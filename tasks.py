@@ -0,0 +1,31 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from flask import current_app
+from jobs import task, prune
+
+#----------------------------------------------------------------------------#
+# Jobs.
+#
+# The functions run by "flask jobs work", enqueued with jobs.enqueue().
+# They run in an app context, outside of any request.
+#----------------------------------------------------------------------------#
+
+@task('images.warm')
+def warm_image(url):
+  '''
+  make the thumbnails of a new image link before a page asks for them.
+  '''
+  proxy = current_app.extensions['images']
+  for size in current_app.config['IMAGE_SIZES']:
+    proxy.thumbnail(size, url)
+
+@task('analytics.refresh')
+def refresh_analytics():
+  import analytics
+  analytics.refresh()
+
+@task('jobs.prune')
+def prune_jobs():
+  prune()
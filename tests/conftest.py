@@ -0,0 +1,50 @@
+#----------------------------------------------------------------------------#
+# Fixtures.
+#
+# The apps run on SQLite files in a temporary directory, with the local
+# stand-ins of the shared services: the in-process cache and rate limit
+# stores, and the image fetcher reading a local mirror.
+#----------------------------------------------------------------------------#
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from app import create_app
+from extensions import db
+
+@pytest.fixture
+def make_app(tmp_path):
+  '''
+  build an app with the settings of config.py and "overrides".
+  '''
+  def make(**overrides):
+    settings = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    settings.update(TESTING=True, DEBUG=True, SECRET_KEY='test', WTF_CSRF_ENABLED=False,
+                    SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'fyyur.db'}",
+                    TEMPLATE_CACHE_TYPE=None, METRICS_DIR=None, IMAGE_PROXY=False,
+                    SEARCH_INDEX_PATH=str(tmp_path / 'index.pickle'),
+                    IMAGE_CACHE_DIR=str(tmp_path / 'images'))
+    settings.update(overrides)
+    app = create_app(type('TestConfig', (), settings))
+    with app.app_context():
+      db.create_all()
+    return app
+  return make
+
+@pytest.fixture
+def app(make_app):
+  return make_app()
+
+def venue(**fields):
+  from models import Venue
+  return Venue(**{"name": 'The Musical Hop', "city": 'San Francisco', "state": 'CA',
+                  "address": '1015 Folsom Street', "genres": 'Jazz', **fields})
+
+def artist(**fields):
+  from models import Artist
+  return Artist(**{"name": "Guns N' Petals", "city": 'San Francisco', "state": 'CA',
+                   "genres": 'Rock n Roll', **fields})
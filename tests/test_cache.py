@@ -0,0 +1,53 @@
+from datetime import date
+from sqlalchemy import update
+from cache import EntityCache, MemoryBackend
+from changes import record_change
+from extensions import db
+from helpers import cached_show_counts
+from models import Venue, Show
+from conftest import venue, artist
+
+def test_cached_rows_are_served_until_a_change_is_logged(app):
+  cache = EntityCache(backend=MemoryBackend())
+  with app.test_request_context():
+    db.session.add(venue())
+    db.session.commit()
+    assert cache.get(Venue, 1).name == 'The Musical Hop'
+  with app.test_request_context():
+    # written behind the cache's back: still the cached row
+    db.session.execute(update(Venue).where(Venue.id == 1).values(name='Hop'))
+    db.session.commit()
+    assert cache.get(Venue, 1).name == 'The Musical Hop'
+    assert cache.stats()['hits'] == 1
+
+def test_a_logged_change_makes_every_worker_miss(app):
+  # two workers, each with its own in-process cache
+  first, second = EntityCache(backend=MemoryBackend()), EntityCache(backend=MemoryBackend())
+  with app.test_request_context():
+    db.session.add(venue())
+    db.session.commit()
+    assert first.get(Venue, 1).name == second.get(Venue, 1).name == 'The Musical Hop'
+  with app.test_request_context():
+    obj = db.session.get(Venue, 1)
+    obj.name = 'Hop'
+    record_change('update', obj)
+    db.session.commit()
+    # the request that wrote reads the new generation too
+    assert first.get(Venue, 1).name == 'Hop'
+  with app.test_request_context():
+    assert second.get(Venue, 1).name == 'Hop'
+    assert second.stats()['misses'] == 2
+
+def test_calendar_counts_follow_the_change_log(app):
+  start, end = date(2035, 5, 1), date(2035, 6, 1)
+  with app.test_request_context():
+    db.session.add_all([venue(), artist()])
+    db.session.commit()
+    assert cached_show_counts(start, end) == {}
+  with app.test_request_context():
+    show = Show(venue_id=1, artist_id=1, start_time='2035-05-21 21:30:00')
+    db.session.add(show)
+    record_change('create', show)
+    db.session.commit()
+  with app.test_request_context():
+    assert cached_show_counts(start, end) == {'2035-05-21': 1}
@@ -0,0 +1,79 @@
+import io
+import socket
+import pytest
+from PIL import Image
+from extensions import images
+from images import FetchError, HTTPFetcher, public_addresses, connect_public
+
+LINK = 'http://example.com/venue.png'
+
+@pytest.fixture
+def proxy_app(make_app, tmp_path):
+  mirror = tmp_path / 'mirror' / 'example.com'
+  mirror.mkdir(parents=True)
+  Image.new('RGB', (2000, 1000), 'red').save(mirror / 'venue.png')
+  return make_app(IMAGE_PROXY=True, IMAGE_PROXY_KEY='test', IMAGE_FETCHER='file',
+                  IMAGE_FETCHER_ROOT=str(tmp_path / 'mirror'))
+
+def proxied(app, link=LINK, size='tile'):
+  with app.test_request_context():
+    return images.url(link, size)
+
+def test_signed_urls_serve_thumbnails(proxy_app):
+  url = proxied(proxy_app)
+  assert url.startswith('/images/tile/')
+  response = proxy_app.test_client().get(url)
+  assert response.status_code == 200
+  assert response.mimetype == 'image/webp'
+  assert response.cache_control.immutable
+  # scaled down to fit the tile box
+  assert Image.open(io.BytesIO(response.data)).size == (720, 360)
+
+def test_unsigned_urls_are_refused(proxy_app):
+  client = proxy_app.test_client()
+  _, _, size, signature, source = proxied(proxy_app).split('/')
+  other = proxied(proxy_app, 'http://example.com/other.png').split('/')[-1]
+  assert client.get(f"/images/{size}/{'A' * len(signature)}/{source}").status_code == 404
+  assert client.get(f"/images/{size}/{signature}/{other}").status_code == 404
+  assert client.get(f"/images/page/{signature}/{source}").status_code == 404
+  assert client.get(f"/images/huge/{signature}/{source}").status_code == 404
+
+def test_missing_images_redirect_to_the_original(proxy_app):
+  url = proxied(proxy_app, 'http://example.com/missing.png')
+  response = proxy_app.test_client().get(url)
+  assert response.status_code == 302
+  assert response.location == 'http://example.com/missing.png'
+
+def test_no_key_links_to_the_original_images(make_app):
+  app = make_app(IMAGE_PROXY=True, IMAGE_PROXY_KEY=None)
+  assert proxied(app) == LINK
+
+def resolving_to(monkeypatch, *addresses):
+  def getaddrinfo(host, port, *args, **kwargs):
+    return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port))
+            for address in addresses]
+  monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+
+@pytest.mark.parametrize('address', ['127.0.0.1', '10.1.2.3', '169.254.169.254', '192.168.0.1'])
+def test_private_addresses_are_refused(monkeypatch, address):
+  resolving_to(monkeypatch, address)
+  with pytest.raises(FetchError):
+    public_addresses('example.com', 80)
+
+def test_one_private_address_refuses_the_host(monkeypatch):
+  resolving_to(monkeypatch, '93.184.216.34', '127.0.0.1')
+  with pytest.raises(FetchError):
+    public_addresses('example.com', 80)
+
+def test_connections_go_to_the_checked_address(monkeypatch):
+  resolving_to(monkeypatch, '93.184.216.34')
+  connected = []
+  monkeypatch.setattr(socket, 'create_connection',
+                      lambda address, *args: connected.append(address) or 'socket')
+  assert connect_public('example.com', 80, 5, None) == 'socket'
+  # the name is not resolved again when connecting
+  assert connected == [('93.184.216.34', 80)]
+
+def test_only_http_urls_are_fetched():
+  with pytest.raises(FetchError):
+    HTTPFetcher().fetch('file:///etc/passwd')
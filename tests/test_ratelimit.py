@@ -0,0 +1,37 @@
+from extensions import limiter
+
+def search(client, address='10.0.0.1'):
+  return client.get('/venues/search?search_term=hop', environ_base={'REMOTE_ADDR': address})
+
+def test_an_empty_bucket_answers_429_with_retry_after(make_app):
+  app = make_app(RATELIMIT_ENABLED=True, RATELIMITS={'search': (0.1, 2)})
+  client = app.test_client()
+  assert [search(client).status_code for _ in range(2)] == [200, 200]
+  response = search(client)
+  assert response.status_code == 429
+  # a token every 10 seconds
+  assert 1 <= int(response.headers['Retry-After']) <= 10
+  # the bucket is the client's own
+  assert search(client, '10.0.0.2').status_code == 200
+
+def test_disabled_limits_let_everything_through(make_app):
+  app = make_app(RATELIMIT_ENABLED=False, RATELIMITS={'search': (0.1, 1)})
+  client = app.test_client()
+  assert {search(client).status_code for _ in range(3)} == {200}
+
+def test_a_full_concurrency_cap_answers_503(make_app):
+  app = make_app(RATELIMIT_ENABLED=False, CONCURRENCY_LIMITS={'search': 1})
+  client = app.test_client()
+  # another request is running the route
+  ticket = limiter.store.acquire('running:search', 1, 30)
+  response = search(client)
+  assert response.status_code == 503
+  assert response.headers['Retry-After'] == '1'
+  limiter.store.release('running:search', ticket)
+  assert search(client).status_code == 200
+
+def test_finished_requests_free_their_place(make_app):
+  app = make_app(RATELIMIT_ENABLED=False, CONCURRENCY_LIMITS={'search': 1})
+  client = app.test_client()
+  assert [search(client).status_code for _ in range(3)] == [200, 200, 200]
+  assert limiter.store.acquire('running:search', 1, 30) is not None
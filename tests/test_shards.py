@@ -0,0 +1,105 @@
+import sqlite3
+import pytest
+from sqlalchemy import insert, select, update
+import shards
+from extensions import db
+from models import Venue, Artist, Show
+from conftest import venue, artist
+
+@pytest.fixture
+def sharded_app(make_app, tmp_path):
+  app = make_app(SHARDS={'west': f"sqlite:///{tmp_path / 'west.db'}"},
+                 SHARD_STATES={'CA': 'west'}, QUERY_CHECKS=False)
+  with app.app_context():
+    shards.init_shards()
+  return app
+
+def rows(engine, model):
+  '''
+  the ids of the rows of "model" in a shard; for shows, their venue ids.
+  '''
+  column = list(model.__table__.primary_key)[0]
+  with engine.connect() as connection:
+    return connection.execute(select(column)).scalars().all()
+
+def test_rows_go_to_the_shard_of_their_state(sharded_app):
+  with sharded_app.app_context():
+    db.session.add_all([venue(), venue(state='NY', address='1 Broadway'), artist()])
+    db.session.flush()
+    db.session.add(Show(venue_id=2, artist_id=1, start_time='2035-05-21 21:30:00'))
+    db.session.commit()
+    engines = shards.shard_engines()
+    # the ids come from one sequence per table, whatever the shard
+    assert rows(engines['west'], Venue) == [1] and rows(engines['main'], Venue) == [2]
+    assert rows(engines['west'], Artist) == [1]
+    # a show follows its venue
+    assert rows(engines['main'], Show) == [2] and rows(engines['west'], Show) == []
+    # queries read every shard
+    assert sorted(venue.id for venue in Venue.query) == [1, 2]
+    assert db.session.get(Venue, 2).state == 'NY'
+  client = sharded_app.test_client()
+  page = client.get('/venues').get_data(as_text=True)
+  assert 'San Francisco' in page and 'NY' in page
+  # the artist of the show is read from the other shard
+  assert "Guns N&#39; Petals" in client.get('/venues/2').get_data(as_text=True)
+  assert 'results for "musical": 2' in \
+    client.get('/venues/search?search_term=musical').get_data(as_text=True)
+
+def test_rebalance_moves_venues_with_their_shows(sharded_app):
+  with sharded_app.app_context():
+    db.session.add_all([venue(state='NY'), artist(state='NY')])
+    db.session.flush()
+    db.session.add(Show(venue_id=1, artist_id=2, start_time='2035-05-21 21:30:00'))
+    db.session.commit()
+    engines = shards.shard_engines()
+    # the state changes in place: the rows stay where they are
+    with engines['main'].begin() as connection:
+      connection.execute(update(Venue.__table__).values(state='CA'))
+    assert shards.rebalance() == {('Venue', 'main', 'west'): 1}
+    assert rows(engines['west'], Venue) == [1] and rows(engines['main'], Venue) == []
+    assert rows(engines['west'], Show) == [1] and rows(engines['main'], Show) == []
+    assert shards.rebalance() == {}
+
+def test_move_locks_the_source_rows(sharded_app, tmp_path):
+  with sharded_app.app_context():
+    db.session.add(venue(state='NY'))
+    db.session.commit()
+    engines = shards.shard_engines()
+    blocked = []
+    target = engines['west']
+
+    class Probe:
+      def begin(self):
+        # an edit of the venue while it is being copied
+        edit = sqlite3.connect(str(tmp_path / 'fyyur.db'), timeout=0)
+        try:
+          edit.execute("UPDATE Venue SET name = 'edited' WHERE id = 1")
+          edit.commit()
+        except sqlite3.OperationalError:
+          blocked.append(True)
+        finally:
+          edit.close()
+        return target.begin()
+
+    assert shards.move(Venue.__table__, [1], 'main', 'west', dict(engines, west=Probe())) == 1
+    assert blocked == [True]
+    with target.connect() as connection:
+      assert connection.execute(select(Venue.__table__.c.name)).scalar() == 'The Musical Hop'
+
+def test_rebalance_refuses_values_in_several_shards(sharded_app):
+  with sharded_app.app_context():
+    engines = shards.shard_engines()
+    for name, engine in engines.items():
+      with engine.begin() as connection:
+        connection.execute(insert(Venue.__table__), [{
+          "id": 10 if name == 'main' else 11, "name": 'Hop', "city": 'Oakland',
+          "state": 'CA', "address": '1 Main Street', "phone": '123-123-1234'}])
+    found = shards.duplicates()
+    assert ('Venue', 'phone', '123-123-1234', ['main', 'west']) in found
+    assert ('Venue', 'address', '1 Main Street', ['main', 'west']) in found
+  result = sharded_app.test_cli_runner().invoke(args=['shards', 'rebalance'])
+  assert result.exit_code != 0
+  assert "Venue.phone '123-123-1234' is in main, west" in result.output
+  with sharded_app.app_context():
+    # nothing was moved
+    assert rows(shards.shard_engines()['main'], Venue) == [10]
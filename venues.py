@@ -0,0 +1,216 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import sys
+from flask import Blueprint, render_template, request, flash, redirect, url_for, abort
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from extensions import db, entity_cache, limiter, search_index, images
+from models import Show, Venue, Artist
+from helpers import search, venue_areas, bulk_response, shared_page
+from documents import page, update_documents, affected_documents, refresh_documents
+from loading import loading_profile
+from sqlite import replica_reads
+from changes import record_change
+
+blueprint = Blueprint('venues', __name__)
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+#  Venues
+#  ----------------------------------------------------------------
+
+@blueprint.route('/venues')
+@replica_reads
+@shared_page
+def venues():
+  # one query instead of one query per area
+  rows = db.session.execute(select(Venue.city, Venue.state, Venue.id, Venue.name)).all()
+  return render_template('pages/venues.html', areas=venue_areas(rows))
+
+@blueprint.route('/venues/search', methods=['GET', 'POST'])
+@replica_reads
+@limiter.limit('search')
+@limiter.concurrency('search')
+def search_venues():
+  # the search box posts the term, the page links pass it in the URL
+  search_term = request.values.get('search_term', '')
+  results = search(Venue, search_term, after=request.args.get('after', type=int),
+                   before=request.args.get('before', type=int))
+  # nothing contains the term: suggest the closest names instead
+  if not results["count"] and search_term.strip():
+    results["suggestions"] = search_index.suggest('venue', search_term)
+  return render_template('pages/search_venues.html', results=results,
+                         search_term=search_term)
+
+@blueprint.route('/venues/<int:venue_id>')
+@replica_reads
+@shared_page
+def show_venue(venue_id):
+  # one primary key lookup: the page document holds the shows too
+  venue = page('venue', venue_id)
+  # Venue with venue_id is not found
+  if venue == None:
+    abort (404)
+  return render_template('pages/show_venue.html', venue=venue)
+
+#  Create Venue
+#  ----------------------------------------------------------------
+
+@blueprint.route('/venues/create', methods=['GET'])
+def create_venue_form():
+  from forms import VenueForm
+  form = VenueForm()
+  return render_template('forms/new_venue.html', form=form)
+
+@blueprint.route('/venues/create', methods=['POST'])
+@limiter.limit('write')
+@limiter.concurrency('write')
+def create_venue_submission():
+  from forms import VenueForm
+  form = VenueForm(request.form)
+  if form.validate_on_submit():
+    try:
+      # Create Venue using form data
+      venue = Venue(name=form.name.data, city=form.city.data,
+                    state=form.state.data, address=form.address.data,
+                    image_link=form.image_link.data, website=form.website.data,
+                    phone=form.phone.data, genres=','.join(form.genres.data),
+                    seeking_talent=form.seeking_talent.data,
+                    seeking_description=form.seeking_description.data,
+                    facebook_link=form.facebook_link.data)
+      db.session.add(venue)
+      db.session.flush()
+      record_change('create', venue)
+      update_documents(venue)
+      images.warm_later(venue.image_link)
+      db.session.commit()
+      entity_cache.forget(venue)
+      search_index.update('venue', venue)
+      # on successful db insert, flash success
+      flash('Venue ' + form.name.data + ' was successfully listed!')
+    except:
+      db.session.rollback()
+      # on unsuccessful db insert, flash an error instead.
+      flash('An error occurred. Venue ' + form.name.data + ' could not be listed.', 'error')
+      print(sys.exc_info())
+    finally:
+      db.session.close()
+
+    return render_template('pages/home.html')
+
+  return render_template('forms/new_venue.html', form=form)
+
+@blueprint.route('/venues/bulk', methods=['POST'])
+@limiter.limit('write')
+@limiter.concurrency('write')
+def create_venues_bulk():
+  '''
+  create the venues of a JSON array of objects with the fields of the venue
+  form, in one transaction, and answer with the outcome of each.
+  '''
+  from forms import VenueForm
+  return bulk_response(Venue, VenueForm)
+
+
+@blueprint.route('/venues/<venue_id>', methods=['DELETE'])
+@loading_profile({Venue: (selectinload(Venue.shows),)})
+def delete_venue(venue_id):
+  try:
+    venue = Venue.query.get(venue_id)
+    # Venue with venue_id is not found
+    if venue == None:
+      abort (404)
+    venue_name = venue.name
+    # the venue's shows are deleted with it
+    for show in venue.shows:
+      record_change('delete', show)
+    record_change('delete', venue)
+    # the pages of its artists list its shows
+    documents = affected_documents(venue)
+    db.session.delete(venue)
+    db.session.flush()
+    refresh_documents(documents)
+    db.session.commit()
+    entity_cache.forget(venue)
+    search_index.remove('venue', int(venue_id))
+    # on successful db delete, flash success
+    flash('Venue ' + venue_name + ' was successfully deleted!')
+  except:
+    db.session.rollback()
+    # on unsuccessful db delete, flash an error instead.
+    flash('An error occurred. Venue could not be deleted.', 'error')
+    print(sys.exc_info())
+  finally:
+    db.session.close()
+
+  return redirect(url_for('venues.venues'))
+
+#  Update
+#  ----------------------------------------------------------------
+
+@blueprint.route('/venues/<int:venue_id>/edit', methods=['GET'])
+def edit_venue(venue_id):
+  from forms import VenueForm
+  venue = entity_cache.get(Venue, venue_id)
+  # Venue with venue_id is not found
+  if venue == None:
+    abort (404)
+  form = VenueForm()
+  # Populate the form with the data of the object we want to edit
+  form.name.data = venue.name
+  form.city.data = venue.city
+  form.state.data = venue.state
+  form.address.data = venue.address
+  form.image_link.data = venue.image_link
+  form.website.data = venue.website
+  form.phone.data = venue.phone
+  form.genres.data = venue.genres.split(',')
+  form.facebook_link.data = venue.facebook_link
+  form.seeking_talent.data = venue.seeking_talent
+  form.seeking_description.data = venue.seeking_description
+
+  return render_template('forms/edit_venue.html', form=form, venue=venue)
+
+@blueprint.route('/venues/<int:venue_id>/edit', methods=['POST'])
+def edit_venue_submission(venue_id):
+  from forms import VenueForm
+  form = VenueForm(request.form)
+  venue = Venue.query.get(venue_id)
+  # Venue with venue_id is not found
+  if venue == None:
+    abort (404)
+  if form.validate_on_submit():
+    try:
+      venue.name = form.name.data
+      venue.city = form.city.data
+      venue.state = form.state.data
+      venue.address = form.address.data
+      venue.image_link = form.image_link.data
+      venue.website = form.website.data
+      venue.phone = form.phone.data
+      venue.genres = ','.join(form.genres.data)
+      venue.facebook_link = form.facebook_link.data
+      venue.seeking_talent = form.seeking_talent.data
+      venue.seeking_description = form.seeking_description.data
+
+      record_change('update', venue)
+      update_documents(venue)
+      images.warm_later(venue.image_link)
+      db.session.commit()
+      entity_cache.forget(venue)
+      search_index.update('venue', venue)
+      # on successful db insert, flash success
+      flash('Venue ' + form.name.data + ' was successfully edited!')
+    except:
+      db.session.rollback()
+      # on unsuccessful db insert, flash an error instead.
+      flash('An error occurred. Venue ' + form.name.data + ' could not be edited.', 'error')
+      print(sys.exc_info())
+    finally:
+      db.session.close()
+    return redirect(url_for('venues.show_venue', venue_id=venue_id))
+  return render_template('forms/edit_venue.html', form=form, venue=venue)
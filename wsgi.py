@@ -0,0 +1,84 @@
+#----------------------------------------------------------------------------#
+# Production entry point.
+#
+# Served by a pre-fork WSGI server with the app preloaded in the master:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:application
+#
+# The templates are compiled once in the master and inherited by every
+# worker, each worker opens its DB pool and loads the search index before
+# it accepts a request, and the pool is closed cleanly when a worker is
+# recycled or shut down.
+#----------------------------------------------------------------------------#
+
+import os
+
+os.environ.setdefault('FYYUR_DEBUG', '0')
+
+from sqlalchemy import text
+
+import metrics
+from app import create_app
+from extensions import db, search_index
+
+app = application = create_app()
+
+
+def warm_templates():
+  '''
+  compile every template ahead of the first request. When called in the
+  master before forking, the workers share the compiled templates.
+  '''
+  names = app.jinja_env.list_templates(extensions=['html'])
+  for name in names:
+    app.jinja_env.get_template(name)
+  return len(names)
+
+
+def warm_db_pool():
+  '''
+  throw away any connection inherited from the master and open the
+  worker's own pool, so the first requests do not pay for connecting.
+  '''
+  with app.app_context():
+    engine = db.engine
+    engine.dispose(close=False)
+    size = getattr(engine.pool, 'size', lambda: 1)()
+    connections = [engine.connect() for _ in range(size)]
+    for connection in connections:
+      connection.execute(text('SELECT 1'))
+      connection.close()
+  return size
+
+
+def warm_search_index():
+  '''
+  load the search index (from SEARCH_INDEX_PATH, else from the database)
+  so no request has to. Returns the number of venues and artists in it.
+  '''
+  with app.app_context():
+    search_index.ensure_loaded()
+    return len(search_index.catalog)
+
+
+def close_db_pool():
+  with app.app_context():
+    db.engine.dispose()
+
+
+def reset_metrics():
+  metrics.reset(app.config.get('METRICS_DIR'))
+
+
+def flush_metrics():
+  '''
+  write the last figures of an exiting worker, for retire_metrics().
+  '''
+  directory = app.config.get('METRICS_DIR')
+  if directory:
+    with app.app_context():
+      app.extensions['metrics'].flush(directory)
+
+
+def retire_metrics(pid):
+  metrics.retire(app.config.get('METRICS_DIR'), pid)